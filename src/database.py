@@ -19,6 +19,43 @@ engine = create_engine(
 # 创建会话工厂
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# 可选的异步引擎：DB_ASYNC=1 时读多的知识库接口 (检索 / 推荐 / 文件下载) 改用异步会话，
+# 并发度由连接池而不是线程池决定。需要安装 aiomysql (MySQL) 或 aiosqlite (SQLite)
+DB_ASYNC = os.getenv("DB_ASYNC", "0") == "1"
+DB_ASYNC_POOL_SIZE = int(os.getenv("DB_ASYNC_POOL_SIZE", 20))
+DB_ASYNC_MAX_OVERFLOW = int(os.getenv("DB_ASYNC_MAX_OVERFLOW", 20))
+
+
+def to_async_url(url: str) -> str:
+    """把同步驱动的连接串换成对应的异步驱动"""
+    for sync_prefix, async_prefix in (
+        ("mysql+pymysql://", "mysql+aiomysql://"),
+        ("mysql://", "mysql+aiomysql://"),
+        ("sqlite://", "sqlite+aiosqlite://"),
+    ):
+        if url.startswith(sync_prefix):
+            return async_prefix + url[len(sync_prefix):]
+    return url
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or to_async_url(SQLALCHEMY_DATABASE_URL)
+
+async_engine = None
+AsyncSessionLocal = None
+if DB_ASYNC:
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+    pool_kwargs = {}
+    if not ASYNC_DATABASE_URL.startswith("sqlite"):
+        pool_kwargs = {"pool_size": DB_ASYNC_POOL_SIZE, "max_overflow": DB_ASYNC_MAX_OVERFLOW}
+    async_engine = create_async_engine(
+        ASYNC_DATABASE_URL,
+        pool_pre_ping=True,
+        pool_recycle=3600,
+        **pool_kwargs,
+    )
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 # 声明基类
 Base = declarative_base()
 
@@ -31,3 +68,11 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    """
+    Dependency helper for FastAPI to get an async database session (requires DB_ASYNC=1).
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
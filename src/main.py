@@ -1,27 +1,81 @@
+import os
+import threading
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, status
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+from sqlalchemy import text
+from starlette.concurrency import run_in_threadpool
 
 import models
-from database import engine
+from database import engine, SessionLocal, DB_ASYNC, async_engine
+from utils.ocr_service import (
+    OCR_PIPELINE_KWARGS,
+    OCR_CACHE_SETTINGS,
+    UPLOAD_ROOT,
+    OUTPUT_ROOT,
+    LocalOCREngine,
+    OCREngineHandle,
+)
+from utils.ocr_pool import OCREnginePool, OCR_POOL_SIZE
+from utils.ocr_cache import OCRResultCache
+from utils.ocr_jobs import OCRJobManager, OCR_JOB_WORKERS
+from utils.uploads import OCRUploadLimitMiddleware
+from utils.bm25_index import bm25_index, SEARCH_BACKEND
+from utils.vector_index import vector_index, VECTOR_INDEX_WARMUP
+from utils.tag_matrix import tag_matrix, TAG_MATRIX_WARMUP
 
 # 导入路由
 from routers import ocr, db_routes, user, template, parsing
 
+# /ready 需要全部就绪的组件，逗号分隔 (database, ocr)
+READY_REQUIRES = [c.strip() for c in os.getenv("READY_REQUIRES", "database").split(",") if c.strip()]
+
+
+def build_ocr_engine():
+    if OCR_POOL_SIZE > 0:
+        # 多进程引擎池：每个进程一个 PPStructureV3 实例，等待所有进程加载完模型
+        pool = OCREnginePool(OCR_POOL_SIZE, OCR_PIPELINE_KWARGS)
+        for future in pool.warmup():
+            future.result()
+        return pool
+
+    from paddleocr import PaddleOCRVL, PPStructureV3
+
+    return LocalOCREngine(PPStructureV3(**OCR_PIPELINE_KWARGS))
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     models.Base.metadata.create_all(bind=engine)
 
-    from paddleocr import PaddleOCRVL, PPStructureV3
-
-    app.state.ocr = PPStructureV3(
-        use_doc_orientation_classify=False,
-        use_doc_unwarping=False
-    )
+    # OCR 模型按 OCR_LOAD_MODE 加载，默认在后台加载，不阻塞启动
+    app.state.ocr = OCREngineHandle(build_ocr_engine)
+    await run_in_threadpool(app.state.ocr.start)
+    # 以上传内容哈希为键的 OCR 结果缓存
+    app.state.ocr_cache = OCRResultCache(UPLOAD_ROOT, OUTPUT_ROOT, settings=OCR_CACHE_SETTINGS)
+    # 后台 OCR 任务队列 (POST /ocr/jobs)
+    app.state.ocr_jobs = OCRJobManager(max_workers=max(OCR_JOB_WORKERS, OCR_POOL_SIZE))
+    if SEARCH_BACKEND == "bm25":
+        # 后台加载 BM25 索引并补齐增量，首次启动时全量构建
+        bm25_index.start_warmup(SessionLocal)
+    if VECTOR_INDEX_WARMUP:
+        # 语义检索向量索引：加载或构建，同样不阻塞启动
+        threading.Thread(target=vector_index.warmup, args=(SessionLocal,), daemon=True).start()
+    if TAG_MATRIX_WARMUP:
+        # 多篇推荐用的文档 × 标签矩阵
+        threading.Thread(target=tag_matrix.warmup, args=(SessionLocal,), daemon=True).start()
     yield
-    app.state.ocr = None
+    app.state.ocr_jobs.shutdown()
+    app.state.ocr.close()
+    if SEARCH_BACKEND == "bm25" and bm25_index.dirty:
+        bm25_index.save()
+    if vector_index.dirty:
+        vector_index.save()
+    if async_engine is not None:
+        await async_engine.dispose()
 
 
 app = FastAPI(title="Backend Service", version="0.1.0", lifespan=lifespan)
@@ -32,10 +86,18 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],  # 检索分页游标
 )
+# OCR 上传大小限制 (Content-Length 预检 + 接收过程中计数)
+app.add_middleware(OCRUploadLimitMiddleware)
 
 # 注册路由模块
 app.include_router(ocr.router)
+if DB_ASYNC:
+    # 异步版本的检索 / 推荐 / 文件接口，先注册以覆盖 db_routes 中的同名路径
+    from routers import knowledge_async
+
+    app.include_router(knowledge_async.router)
 app.include_router(db_routes.router)
 app.include_router(user.router)
 app.include_router(template.router)
@@ -52,6 +114,29 @@ async def health() -> dict[str, str]:
     return {"status": "ok"}
 
 
+def _check_database() -> dict[str, str]:
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+        return {"status": "ready"}
+    except Exception as e:
+        return {"status": "failed", "error": str(e)}
+
+
+@app.get("/ready")
+async def ready() -> JSONResponse:
+    """Readiness probe: per-component status; 503 until every component in READY_REQUIRES is ready."""
+    components = {
+        "database": await run_in_threadpool(_check_database),
+        "ocr": app.state.ocr.status(),
+    }
+    is_ready = all(components[name]["status"] == "ready" for name in READY_REQUIRES if name in components)
+    return JSONResponse(
+        status_code=status.HTTP_200_OK if is_ready else status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"status": "ready" if is_ready else "not_ready", "components": components},
+    )
+
+
 @app.get("/", status_code=status.HTTP_200_OK)
 async def read_root() -> dict[str, str]:
     return {"message": "FastAPI is running"}
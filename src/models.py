@@ -1,5 +1,5 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Index, text
-from sqlalchemy.orm import relationship, Session
+from sqlalchemy import Column, Integer, BigInteger, Float, String, Text, DateTime, ForeignKey, Index, text
+from sqlalchemy.orm import relationship, Session, deferred
 from sqlalchemy.sql import func
 from database import Base
 import jieba.analyse
@@ -60,13 +60,15 @@ class KnowledgeBase(Base):
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     
-    title = Column(String(200), nullable=False)
-    content = Column(LONGTEXT, nullable=True)
-    category = Column(String(100), nullable=True)
+    title = Column(String(200), nullable=False, index=True)
+    # MySQL 用 LONGTEXT，其他数据库 (如开发用的 SQLite) 退回普通 Text
+    # 默认延迟加载：查询实体时不取正文，按需读取见 utils.kb_content
+    content = deferred(Column(Text().with_variant(LONGTEXT, "mysql"), nullable=True))
+    category = Column(String(100), nullable=True, index=True)
     authors = Column(Text, nullable=True)
     file_path = Column(String(500), nullable=True)
     file_type = Column(String(50), nullable=True)
-    year = Column(Integer, nullable=True)
+    year = Column(Integer, nullable=True, index=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
@@ -83,6 +85,72 @@ class KnowledgeBase(Base):
     )
 
 
+class KBChunk(Base):
+    """
+    知识条目的分页文本块：按页流式写入，读取方可只取需要的页，
+    不必加载整个 content 大字段
+    """
+    __tablename__ = "knowledge_chunks"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    kb_id = Column(Integer, ForeignKey("knowledge_base.id"), nullable=False)
+    page_no = Column(Integer, nullable=True, comment="页码 (从 1 开始)，非 PDF 条目为空")
+    offset = Column(Integer, nullable=False, comment="块在全文中的字符偏移")
+    text = Column(Text, nullable=False)
+
+    __table_args__ = (
+        Index('ix_knowledge_chunks_kb_page', 'kb_id', 'page_no'),
+        # 段落级检索：短文本块上的 ngram 全文索引
+        Index('ix_fulltext_chunk_text', 'text', mysql_prefix='FULLTEXT', mysql_with_parser='ngram'),
+    )
+
+
+class IngestManifest(Base):
+    """
+    语料同步清单：记录每个已入库 PDF 的文件状态，
+    重新同步时只处理新增或发生变化的文件
+    """
+    __tablename__ = "ingest_manifest"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    path = Column(String(500), unique=True, nullable=False, comment="PDF 文件路径")
+    size = Column(BigInteger, nullable=False, comment="文件大小 (字节)")
+    mtime = Column(Float, nullable=False, comment="文件修改时间")
+    content_hash = Column(String(64), nullable=False, comment="文件内容 SHA-256")
+    bib_mtime = Column(Float, nullable=True, comment="对应 .bib 文件的修改时间")
+    kb_id = Column(Integer, ForeignKey("knowledge_base.id"), nullable=True, index=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class CorpusVersion(Base):
+    """
+    语料版本号：任何写入知识库的操作都会把它加一，
+    检索结果缓存以它为键的一部分 (同步脚本等其他进程的写入同样可见)
+    """
+    __tablename__ = "corpus_version"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+
+
+class KBNeighbour(Base):
+    """
+    物化的推荐近邻表：每个条目按 IDF 加权的标签重合度保存前 K 个近邻，
+    标签变化时由 utils.neighbours 增量刷新，推荐接口只需按 kb_id 读取
+    """
+    __tablename__ = "kb_neighbours"
+
+    # 不设外键：条目删除时由刷新逻辑清理两个方向的行
+    kb_id = Column(Integer, primary_key=True)
+    neighbour_id = Column(Integer, primary_key=True, index=True)
+    score = Column(Float, nullable=False, comment="共同标签的 IDF 之和")
+    common_tags = Column(Integer, nullable=False, comment="共同标签数")
+
+    __table_args__ = (
+        Index('ix_kb_neighbours_kb_score', 'kb_id', 'score'),
+    )
+
+
 class KBService:
     @staticmethod
     def add_entry(db: Session, title: str, content: str, category: str = None):
@@ -103,18 +171,18 @@ class KBService:
         text_to_analyze = f"{title} {title} {content}" 
         keywords = jieba.analyse.extract_tags(text_to_analyze, topK=5)
 
-        # 3. 维护标签关系
-        for kw in keywords:
-            # 查找标签是否存在，不存在则创建
-            tag = db.query(Tag).filter(Tag.name == kw).first()
-            if not tag:
-                tag = Tag(name=kw)
-                db.add(tag)
-                db.flush()
-            
-            # 建立多对多关联
-            new_entry.tags.append(tag)
+        # 3. 维护标签关系：一次查询解析全部关键词，批量建立关联
+        from utils.tagging import tag_resolver
+        tag_resolver.attach(db, new_entry.id, keywords)
         
+        # 4. 写入文本块 (非 PDF 条目没有页码)
+        from utils.chunking import write_chunks
+        write_chunks(db, new_entry.id, [(None, content or "")])
+
+        # 5. 语料变化，使检索结果缓存失效
+        from utils.corpus_version import bump_corpus_version
+        bump_corpus_version(db)
+
         db.commit()
         db.refresh(new_entry)
         return new_entry
@@ -122,7 +190,7 @@ class KBService:
     @staticmethod
     def search(db: Session, keyword: str, limit: int = 10):
         """
-        全文检索：基于 MySQL MATCH AGAINST
+        全文检索：基于 MySQL MATCH AGAINST (结果按语料版本号缓存)
         """
         query_sql = text("""
             SELECT id, title, MATCH(title, content) AGAINST(:kw IN NATURAL LANGUAGE MODE) AS score
@@ -131,14 +199,28 @@ class KBService:
             ORDER BY score DESC
             LIMIT :limit
         """)
-        result = db.execute(query_sql, {"kw": keyword, "limit": limit}).all()
-        return result
+        from utils.search_cache import search_cache
+        return search_cache.get_or_compute(
+            db, "kb_service", (keyword, limit),
+            lambda: db.execute(query_sql, {"kw": keyword, "limit": limit}).all(),
+        )
 
     @staticmethod
     def recommend_similar(db: Session, kb_id: int, limit: int = 5):
         """
-        推荐系统：基于共同标签（标签重合度）
+        推荐系统：基于共同标签（标签重合度），优先读取物化近邻表
         """
+        neighbours_sql = text("""
+            SELECT neighbour_id AS kb_id, common_tags
+            FROM kb_neighbours
+            WHERE kb_id = :target_id
+            ORDER BY score DESC, neighbour_id ASC
+            LIMIT :limit
+        """)
+        rows = db.execute(neighbours_sql, {"target_id": kb_id, "limit": limit}).all()
+        if rows:
+            return rows
+
         recommend_sql = text("""
             SELECT r2.kb_id, COUNT(*) as common_tags
             FROM kb_tag_relation r1
@@ -1,15 +1,26 @@
 import jieba.analyse
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from fastapi.responses import FileResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import text
+from sqlalchemy import text, bindparam
 from typing import List
+import bisect
 import os
 
 from database import get_db
 import models  # 确保你之前的 User, KnowledgeBase, Tag 等模型都在这里
-from deep_translator import GoogleTranslator
-from nltk.corpus import wordnet
+from utils.tagging import tag_resolver
+from utils.chunking import write_chunks
+from utils.snippets import make_snippet
+from utils.query_expansion import query_expander
+from utils.search_cache import search_cache
+from utils.corpus_version import bump_corpus_version
+from utils.bm25_index import bm25_index, SEARCH_BACKEND
+from utils.pagination import SCORE_SCALE, encode_cursor, decode_cursor, cursor_sort_key
+from utils.vector_index import vector_index
+from utils.tag_matrix import tag_matrix
+from utils.neighbours import neighbour_table
+from utils.kb_content import get_kb_meta, load_content, load_pages, KB_CONTENT_MAX_CHARS, KB_CONTENT_MAX_PAGES
 import re
 
 router = APIRouter(tags=["Database"])
@@ -33,9 +44,8 @@ def add_knowledge_entry(
     db: Session = Depends(get_db)
 ):
     try:
-        # 1. 创建知识库主条目
+        # 1. 创建知识库主条目 (KnowledgeBase 没有 user_id 列，user_id 仅保留在接口参数中)
         new_entry = models.KnowledgeBase(
-            user_id=user_id,
             title=title,
             content=content,
             category=category
@@ -45,18 +55,14 @@ def add_knowledge_entry(
 
         keywords = jieba.analyse.extract_tags(f"{title} {title} {content}", topK=5)
 
-        # 3. 关联标签
-        for kw in keywords:
-            # 查找标签是否已存在，不存在则创建
-            tag = db.query(models.Tag).filter(models.Tag.name == kw).first()
-            if not tag:
-                tag = models.Tag(name=kw)
-                db.add(tag)
-                db.flush()
-            
-            # 建立多对多关联
-            if tag not in new_entry.tags:
-                new_entry.tags.append(tag)
+        # 3. 关联标签：一次查询解析全部关键词，批量建立关联
+        tag_resolver.attach(db, new_entry.id, keywords)
+
+        # 4. 写入文本块 (非 PDF 条目没有页码)
+        write_chunks(db, new_entry.id, [(None, content or "")])
+
+        # 5. 语料变化，使检索结果缓存失效
+        bump_corpus_version(db)
         
         db.commit()
         return {
@@ -69,105 +75,349 @@ def add_knowledge_entry(
         raise HTTPException(status_code=500, detail=f"Failed to add entry: {str(e)}")
 
 
-@router.get("/knowledge/search")
-def search_knowledge_robust(q: str, db: Session = Depends(get_db)):
-    def get_wordnet_expansions(word_en):
-        synonyms = []
-        for syn in wordnet.synsets(word_en)[:2]:
-            for lemma in syn.lemmas():
-                synonyms.append(lemma.name().replace('_', ' '))
-        return list(set(synonyms))[:5]
-
-    def expand_search_terms(q: str):
-        terms = {q.strip()}
-        try:
-            if re.search(r'[\u4e00-\u9fa5]', q):
-                translated = GoogleTranslator(source='zh-CN', target='en').translate(q)
-                print(translated)
-                for w in get_wordnet_expansions(translated):
-                    terms.add(w)
-
-            else:
-                translated = GoogleTranslator(source='en', target='zh-CN').translate(q)
-                for w in get_wordnet_expansions(q):
-                    terms.add(w)
-
-            terms.add(translated.strip())
-        except:
-            pass
-
-        return list(terms)
-    
-    search_terms = expand_search_terms(q)
-    print(search_terms)
-    search_payload = " ".join([f'"{term}"' for term in search_terms])
+def expand_search_terms(q: str):
+    """原词 + 翻译 + 同义词 (带缓存与时间预算，见 utils.query_expansion)"""
+    return query_expander.expand(q)
 
-    sql = text("""
-        SELECT id, title, authors, year,
-            (
-                (MATCH(title) AGAINST(:payload IN BOOLEAN MODE) * 5) + 
-                (MATCH(content) AGAINST(:payload IN BOOLEAN MODE) * 1)
-            ) AS score
-        FROM knowledge_base
-        WHERE MATCH(title, content) AGAINST(:payload IN BOOLEAN MODE)
-        ORDER BY score DESC
-        LIMIT 20
+
+def build_filter_clauses(year, category, authors, tag):
+    """检索过滤条件 -> (SQL 条件列表, 参数)"""
+    clauses = []
+    params = {}
+    if year is not None:
+        clauses.append("year = :year")
+        params["year"] = year
+    if category:
+        clauses.append("category = :category")
+        params["category"] = category
+    if authors:
+        clauses.append("authors LIKE :authors")
+        params["authors"] = f"%{authors}%"
+    if tag:
+        clauses.append("""EXISTS (
+            SELECT 1 FROM kb_tag_relation r JOIN tags t ON t.id = r.tag_id
+            WHERE r.kb_id = knowledge_base.id AND t.name = :tag
+        )""")
+        params["tag"] = tag
+    return clauses, params
+
+
+def fulltext_search_sql(clauses, has_cursor: bool):
+    """MySQL 全文检索 SQL：标题 *5 加权，按 (score DESC, id ASC) 排序，多取一条判断是否有下一页"""
+    # 浮点分数不能可靠地做等值比较：排序和游标条件都用定点数 score_key，游标参数也转成同样的 DECIMAL，
+    # 同一 score_key 内再按 id 排序，翻页时既不重复也不遗漏。
+    # score_key 是别名，游标条件放在 HAVING 中 (MySQL 允许无 GROUP BY 的 HAVING 引用别名)
+    conditions = "".join(f" AND {c}" for c in clauses)
+    decimal_type = f"DECIMAL(20, {SCORE_SCALE})"
+    having = (
+        f"HAVING score_key < CAST(:after_score AS {decimal_type}) "
+        f"OR (score_key = CAST(:after_score AS {decimal_type}) AND id > :after_id)"
+    ) if has_cursor else ""
+    return text(f"""
+        SELECT id, title, authors, year, score, CAST(score AS {decimal_type}) AS score_key
+        FROM (
+            SELECT id, title, authors, year,
+                (
+                    (MATCH(title) AGAINST(:payload IN BOOLEAN MODE) * 5) + 
+                    (MATCH(content) AGAINST(:payload IN BOOLEAN MODE) * 1)
+                ) AS score
+            FROM knowledge_base
+            WHERE MATCH(title, content) AGAINST(:payload IN BOOLEAN MODE){conditions}
+        ) AS matched
+        {having}
+        ORDER BY score_key DESC, id ASC
+        LIMIT :limit
     """)
 
-    result = db.execute(sql, {"payload": search_payload}).all()
 
+def fulltext_items(result):
     return [
         {
             "id": r.id, 
             "title": r.title, 
             "score": round(r.score, 2),
             "authors": r.authors,
-            "year": r.year
+            "year": r.year,
+            "_score": r.score_key,
         } for r in result
     ]
 
 
-@router.get("/knowledge/recommend")
-def recommend_similar_multiple(
-    kb_ids: list[int] = Query(...), # 接收类似 ?kb_ids=1&kb_ids=2 的参数
-    db: Session = Depends(get_db), 
-    limit: int = 10
+def page_results(results, limit: int, response: Response):
+    """截取一页结果，还有更多结果时在响应头中返回下一页游标"""
+    page = results[:limit]
+    if len(results) > limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(page[-1]["_score"], page[-1]["id"])
+    return [{k: v for k, v in item.items() if k != "_score"} for item in page]
+
+
+@router.get("/knowledge/search")
+def search_knowledge_robust(
+    q: str,
+    response: Response,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: str | None = None,
+    year: int | None = None,
+    category: str | None = None,
+    authors: str | None = None,
+    tag: str | None = None,
+    db: Session = Depends(get_db)
 ):
     """
-    推荐逻辑：输入文章 ID 列表，寻找与这些文章标签重合度最高的内容
+    全文检索，按 (score, id) 游标分页：
+    响应头 X-Next-Cursor 为下一页游标 (没有更多结果时不返回)，下一页请求带上 cursor 参数即可。
+    year / category / authors (包含匹配) / tag 在服务端过滤。
     """
-    if not kb_ids:
-        return []
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
+    search_terms = expand_search_terms(q)
+    print(search_terms)
+    search_payload = " ".join([f'"{term}"' for term in search_terms])
+    clauses, filter_params = build_filter_clauses(year, category, authors, tag)
+
+    def sorted_bm25_hits():
+        # 同一组检索词的全部命中只排序一次，缓存到语料变化为止，翻页时不再重新排序
+        return sorted(bm25_index.search(db, search_terms, limit=None), key=lambda h: (-h[1], h[0]))
+
+    def run_bm25_search():
+        # 二分定位游标在命中列表中的位置，从该位置起分批在数据库中过滤，只读到凑满一页为止
+        hits = search_cache.get_or_compute(db, "knowledge_bm25_hits", tuple(sorted(search_terms)), sorted_bm25_hits)
+        start = bisect.bisect_right(hits, cursor_sort_key(after), key=lambda h: (-h[1], h[0])) if after else 0
+        items = []
+        for i in range(start, len(hits), 200):
+            batch = hits[i:i + 200]
+            sql = text(f"""
+                SELECT id, title, authors, year FROM knowledge_base
+                WHERE id IN :ids {"".join(f" AND {c}" for c in clauses)}
+            """).bindparams(bindparam("ids", expanding=True))
+            rows = {r.id: r for r in db.execute(sql, {"ids": [kb_id for kb_id, _ in batch], **filter_params})}
+            for kb_id, score in batch:
+                if kb_id in rows:
+                    items.append((kb_id, score, rows[kb_id]))
+            if len(items) > limit:
+                break
+        return [
+            {
+                "id": kb_id,
+                "title": r.title,
+                "score": round(score, 2),
+                "authors": r.authors,
+                "year": r.year,
+                "_score": score,
+            } for kb_id, score, r in items[:limit + 1]
+        ]
+
+    def run_search():
+        params = {"payload": search_payload, "limit": limit + 1, **filter_params}
+        if after:
+            params["after_score"], params["after_id"] = after
+        result = db.execute(fulltext_search_sql(clauses, after is not None), params).all()
+        return fulltext_items(result)
+
+    # 多取一条用于判断是否还有下一页
+    if SEARCH_BACKEND == "bm25":
+        # BM25 按分词检索，缓存键用排序后的检索词
+        key = (tuple(sorted(search_terms)), limit, cursor, year, category, authors, tag)
+        results = search_cache.get_or_compute(db, "knowledge_bm25", key, run_bm25_search)
+    else:
+        key = (search_payload, limit, cursor, year, category, authors, tag)
+        results = search_cache.get_or_compute(db, "knowledge", key, run_search)
+
+    return page_results(results, limit, response)
+
+
+@router.get("/knowledge/semantic-search")
+def semantic_search(
+    q: str | None = None,
+    kb_ids: list[int] = Query(None),
+    limit: int = Query(10, ge=1, le=100),
+    db: Session = Depends(get_db)
+):
+    """
+    语义检索：基于本地 TF-IDF/LSA 向量的余弦相似度，能找到没有共同词或标签、但主题相近的论文。
+    q 为查询文本，kb_ids 为种子文章 (找与这些文章相似的内容)，二者至少提供一个，可同时使用。
+    """
+    if not q and not kb_ids:
+        raise HTTPException(status_code=400, detail="Either q or kb_ids is required")
+
+    query_text = " ".join(expand_search_terms(q)) if q else None
+    seed_ids = tuple(sorted(set(kb_ids or [])))
+
+    def run_search():
+        hits = vector_index.search(db, query_text, seed_ids, limit=limit)
+        rows = {
+            r.id: r for r in db.query(
+                models.KnowledgeBase.id, models.KnowledgeBase.title,
+                models.KnowledgeBase.authors, models.KnowledgeBase.year,
+            ).filter(models.KnowledgeBase.id.in_([kb_id for kb_id, _ in hits]))
+        }
+        return [
+            {
+                "id": kb_id,
+                "title": rows[kb_id].title,
+                "score": round(score, 4),
+                "authors": rows[kb_id].authors,
+                "year": rows[kb_id].year
+            } for kb_id, score in hits if kb_id in rows
+        ]
+
+    return search_cache.get_or_compute(db, "semantic", (query_text, seed_ids, limit), run_search)
+
+
+@router.get("/knowledge/passages")
+def search_passages(
+    q: str,
+    limit: int = Query(10, ge=1, le=50),
+    per_doc: int = Query(3, ge=1, le=20),
+    db: Session = Depends(get_db)
+):
+    """
+    段落级检索：在分页文本块上做全文匹配，返回最相关的段落、
+    高亮摘要以及所在页码，无需下载整篇 PDF 定位命中位置
+    """
+    search_terms = expand_search_terms(q)
+    search_payload = " ".join([f'"{term}"' for term in search_terms])
+
+    # 多取一些候选，再按每篇文档最多 per_doc 段截断
     sql = text("""
-        SELECT r2.kb_id, k.title, k.authors, k.year, COUNT(*) as common_tags_count
-        FROM kb_tag_relation r1
-        JOIN kb_tag_relation r2 ON r1.tag_id = r2.tag_id
-        JOIN knowledge_base k ON r2.kb_id = k.id
-        WHERE r1.kb_id IN :ids           -- 匹配列表中的任何一篇文章的标签
-          AND r2.kb_id NOT IN :ids      -- 排除掉列表本身的文章
-        GROUP BY r2.kb_id, k.title, k.authors, k.year
-        ORDER BY common_tags_count DESC
-        LIMIT :limit
+        SELECT c.kb_id, c.page_no, c.offset, c.text, k.title, k.authors, k.year,
+            MATCH(c.text) AGAINST(:payload IN BOOLEAN MODE) AS score
+        FROM knowledge_chunks c
+        JOIN knowledge_base k ON k.id = c.kb_id
+        WHERE MATCH(c.text) AGAINST(:payload IN BOOLEAN MODE)
+        ORDER BY score DESC
+        LIMIT :candidates
     """)
-    
-    result = db.execute(sql, {"ids": tuple(kb_ids), "limit": limit}).all()
-    
+
+    def run_search():
+        rows = db.execute(sql, {"payload": search_payload, "candidates": limit * per_doc}).all()
+
+        passages = []
+        per_doc_count = {}
+        for r in rows:
+            if per_doc_count.get(r.kb_id, 0) >= per_doc:
+                continue
+            per_doc_count[r.kb_id] = per_doc_count.get(r.kb_id, 0) + 1
+            passages.append({
+                "id": r.kb_id,
+                "title": r.title,
+                "authors": r.authors,
+                "year": r.year,
+                "page": r.page_no,
+                "offset": r.offset,
+                "score": round(r.score, 2),
+                "snippet": make_snippet(r.text, search_terms),
+            })
+            if len(passages) >= limit:
+                break
+        return passages
+
+    return search_cache.get_or_compute(db, "passages", (search_payload, limit, per_doc), run_search)
+
+
+# 推荐：读取物化近邻表 (kb_neighbours)，多篇输入时合并各自的近邻列表 (:ids 为 expanding 参数，各驱动通用)
+NEIGHBOURS_SQL = text("""
+    SELECT n.neighbour_id AS kb_id, k.title, k.authors, k.year,
+           SUM(n.common_tags) AS common_tags_count, SUM(n.score) AS score
+    FROM kb_neighbours n
+    JOIN knowledge_base k ON n.neighbour_id = k.id
+    WHERE n.kb_id IN :ids
+      AND n.neighbour_id NOT IN :ids
+    GROUP BY n.neighbour_id, k.title, k.authors, k.year
+    ORDER BY score DESC, kb_id ASC
+    LIMIT :limit
+""").bindparams(bindparam("ids", expanding=True))
+
+# 近邻表尚未建立 (未执行 sync_data --rebuild-neighbours) 时退回的实时标签重合度推荐
+RECOMMEND_SQL = text("""
+    SELECT r2.kb_id, k.title, k.authors, k.year, COUNT(*) as common_tags_count, COUNT(*) as score
+    FROM kb_tag_relation r1
+    JOIN kb_tag_relation r2 ON r1.tag_id = r2.tag_id
+    JOIN knowledge_base k ON r2.kb_id = k.id
+    WHERE r1.kb_id IN :ids           -- 匹配列表中的任何一篇文章的标签
+      AND r2.kb_id NOT IN :ids      -- 排除掉列表本身的文章
+    GROUP BY r2.kb_id, k.title, k.authors, k.year
+    ORDER BY common_tags_count DESC
+    LIMIT :limit
+""").bindparams(bindparam("ids", expanding=True))
+
+
+def recommend_items(result):
     return [
         {
             "id": r.kb_id, 
             "title": r.title, 
             "authors": r.authors,
             "year": r.year,
-            "common_tags": r.common_tags_count
+            "common_tags": r.common_tags_count,
+            "score": round(float(r.score), 4)
         } 
         for r in result
     ]
 
-@router.get("/knowledge/file/{file_id}")
-def get_knowledge_file(file_id: int, db: Session = Depends(get_db)):
-    # 1. 从数据库查找记录
-    kb_entry = db.query(models.KnowledgeBase).filter(models.KnowledgeBase.id == file_id).first()
+
+def matrix_recommend(db: Session, kb_ids, weights, exclude, limit: int, year, category):
+    """多篇 / 带权重 / 带过滤条件的推荐：在进程内标签矩阵上计算，再补全条目信息"""
+    if weights and len(weights) != len(kb_ids):
+        raise HTTPException(status_code=400, detail="weights must match kb_ids one to one")
+    seeds = {}
+    for kb_id, weight in zip(kb_ids, weights or [1.0] * len(kb_ids)):
+        seeds[kb_id] = seeds.get(kb_id, 0.0) + weight
+
+    hits = tag_matrix.recommend(db, seeds, limit=limit, exclude=exclude or (), year=year, category=category)
+    rows = {
+        r.id: r for r in db.query(
+            models.KnowledgeBase.id, models.KnowledgeBase.title,
+            models.KnowledgeBase.authors, models.KnowledgeBase.year,
+        ).filter(models.KnowledgeBase.id.in_([kb_id for kb_id, _, _ in hits]))
+    }
+    return [
+        {
+            "id": kb_id,
+            "title": rows[kb_id].title,
+            "authors": rows[kb_id].authors,
+            "year": rows[kb_id].year,
+            "common_tags": common,
+            "score": round(score, 4)
+        } for kb_id, score, common in hits if kb_id in rows
+    ]
+
+
+@router.get("/knowledge/recommend")
+def recommend_similar_multiple(
+    kb_ids: list[int] = Query(...), # 接收类似 ?kb_ids=1&kb_ids=2 的参数
+    db: Session = Depends(get_db), 
+    limit: int = Query(10, ge=1, le=100),
+    weights: list[float] | None = Query(None),  # 与 kb_ids 一一对应的权重，默认均为 1
+    exclude: list[int] | None = Query(None),    # 额外排除的条目 (如已读)
+    year: int | None = None,
+    category: str | None = None
+):
+    """
+    推荐逻辑：输入文章 ID 列表，寻找与这些文章标签重合度 (按 IDF 加权) 最高的内容。
+    - 单篇且无权重 / 过滤条件：读取物化近邻表 (每篇只保存 KB_NEIGHBOURS_TOP_K 条，
+      limit 更大时改用实时标签重合度查询，否则结果会被截断)
+    - 其他情况：进程内标签矩阵上一次稀疏乘法，耗时与输入篇数基本无关
+    """
+    if not kb_ids:
+        return []
+
+    if len(set(kb_ids)) > 1 or weights or exclude or year is not None or category is not None:
+        return matrix_recommend(db, kb_ids, weights, exclude, limit, year, category)
+
+    params = {"ids": list(kb_ids), "limit": limit}
+    result = db.execute(NEIGHBOURS_SQL, params).all() if limit <= neighbour_table.top_k else []
+    if not result:
+        result = db.execute(RECOMMEND_SQL, params).all()
+    
+    return recommend_items(result)
+
+
+def knowledge_file_response(kb_entry):
+    """校验条目的文件路径并返回以标题命名的下载响应"""
     if not kb_entry:
         raise HTTPException(status_code=404, detail="File not found in database")
     
@@ -196,4 +446,44 @@ def get_knowledge_file(file_id: int, db: Session = Depends(get_db)):
         safe_title = re.sub(r'[\\/*?:"<>|]', "", kb_entry.title)
         download_filename = f"{safe_title}{file_ext}"
         
-    return FileResponse(path=file_path, filename=download_filename)
\ No newline at end of file
+    return FileResponse(path=file_path, filename=download_filename)
+
+
+@router.get("/knowledge/file/{file_id}")
+def get_knowledge_file(file_id: int, db: Session = Depends(get_db)):
+    # 1. 从数据库查找记录 (只取需要的列，不加载正文)
+    kb_entry = get_kb_meta(db, file_id, models.KnowledgeBase.id, models.KnowledgeBase.title, models.KnowledgeBase.file_path)
+    return knowledge_file_response(kb_entry)
+
+
+@router.get("/knowledge/{kb_id}/content")
+def get_knowledge_content(
+    kb_id: int,
+    start: int = Query(0, ge=0),
+    length: int = Query(20000, ge=1),
+    page_from: int | None = Query(None, ge=1),
+    page_to: int | None = Query(None, ge=1),
+    db: Session = Depends(get_db)
+):
+    """
+    按需读取条目正文：
+    - 默认按字符区间 [start, start + length) 读取
+    - 指定 page_from (可选 page_to) 时按页读取 (仅 PDF 条目有页码)
+    """
+    if get_kb_meta(db, kb_id, models.KnowledgeBase.id) is None:
+        raise HTTPException(status_code=404, detail="Record not found")
+
+    if page_from is not None:
+        page_to = page_to or page_from
+        if page_to < page_from:
+            raise HTTPException(status_code=400, detail="page_to must be >= page_from")
+        # 先按页数拒绝，读取过程中超过字符上限时立即停止
+        if page_to - page_from + 1 > KB_CONTENT_MAX_PAGES:
+            raise HTTPException(status_code=400, detail="Requested page range is too large")
+        pages = load_pages(db, kb_id, page_from, page_to, max_chars=KB_CONTENT_MAX_CHARS)
+        if pages is None:
+            raise HTTPException(status_code=400, detail="Requested page range is too large")
+        return {"kb_id": kb_id, "pages": [{"page_no": no, "text": t} for no, t in pages]}
+
+    length = min(length, KB_CONTENT_MAX_CHARS)
+    return {"kb_id": kb_id, "start": start, "text": load_content(db, kb_id, start, length)}
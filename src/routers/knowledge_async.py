@@ -0,0 +1,108 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from database import get_async_db, SessionLocal
+import models
+from routers.db_routes import (
+    build_filter_clauses,
+    fulltext_search_sql,
+    fulltext_items,
+    page_results,
+    search_knowledge_robust,
+    NEIGHBOURS_SQL,
+    RECOMMEND_SQL,
+    recommend_items,
+    matrix_recommend,
+    knowledge_file_response,
+)
+from utils.query_expansion import query_expander
+from utils.search_cache import search_cache
+from utils.bm25_index import SEARCH_BACKEND
+from utils.pagination import decode_cursor
+from utils.neighbours import neighbour_table
+
+# 读多的知识库接口的异步版本 (DB_ASYNC=1 时在 main 中先于 db_routes 注册，覆盖同路径的同步接口)
+router = APIRouter(tags=["Database"])
+
+
+@router.get("/knowledge/search")
+async def search_knowledge_async(
+    q: str,
+    response: Response,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: str | None = None,
+    year: int | None = None,
+    category: str | None = None,
+    authors: str | None = None,
+    tag: str | None = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    全文检索 (异步会话)，参数与分页方式同 db_routes.search_knowledge_robust。
+    BM25 后端是进程内计算，仍交给线程池执行同步版本。
+    """
+    if SEARCH_BACKEND == "bm25":
+        def run_sync():
+            with SessionLocal() as sync_db:
+                return search_knowledge_robust(q, response, limit, cursor, year, category, authors, tag, sync_db)
+        return await run_in_threadpool(run_sync)
+
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    search_terms = await query_expander.expand_async(q)
+    search_payload = " ".join([f'"{term}"' for term in search_terms])
+    clauses, filter_params = build_filter_clauses(year, category, authors, tag)
+
+    async def run_search():
+        params = {"payload": search_payload, "limit": limit + 1, **filter_params}
+        if after:
+            params["after_score"], params["after_id"] = after
+        result = (await db.execute(fulltext_search_sql(clauses, after is not None), params)).all()
+        return fulltext_items(result)
+
+    key = (search_payload, limit, cursor, year, category, authors, tag)
+    results = await search_cache.get_or_compute_async(db, "knowledge", key, run_search)
+    return page_results(results, limit, response)
+
+
+@router.get("/knowledge/recommend")
+async def recommend_similar_async(
+    kb_ids: list[int] = Query(...),
+    db: AsyncSession = Depends(get_async_db),
+    limit: int = Query(10, ge=1, le=100),
+    weights: list[float] | None = Query(None),
+    exclude: list[int] | None = Query(None),
+    year: int | None = None,
+    category: str | None = None
+):
+    """推荐 (异步会话)，同 db_routes.recommend_similar_multiple；标签矩阵在线程池中计算"""
+    if not kb_ids:
+        return []
+
+    if len(set(kb_ids)) > 1 or weights or exclude or year is not None or category is not None:
+        def run_sync():
+            with SessionLocal() as sync_db:
+                return matrix_recommend(sync_db, kb_ids, weights, exclude, limit, year, category)
+        return await run_in_threadpool(run_sync)
+
+    params = {"ids": list(kb_ids), "limit": limit}
+    # 近邻表每篇只保存 top_k 条，limit 更大时改用实时查询
+    result = (await db.execute(NEIGHBOURS_SQL, params)).all() if limit <= neighbour_table.top_k else []
+    if not result:
+        result = (await db.execute(RECOMMEND_SQL, params)).all()
+    return recommend_items(result)
+
+
+@router.get("/knowledge/file/{file_id}")
+async def get_knowledge_file_async(file_id: int, db: AsyncSession = Depends(get_async_db)):
+    """下载条目对应的原始文件 (异步会话，只查询需要的列)"""
+    result = await db.execute(
+        select(models.KnowledgeBase.id, models.KnowledgeBase.title, models.KnowledgeBase.file_path)
+        .where(models.KnowledgeBase.id == file_id)
+    )
+    return knowledge_file_response(result.first())
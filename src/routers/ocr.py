@@ -1,76 +1,141 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Request
-from fastapi.responses import PlainTextResponse
-import os
-import uuid
-import glob
+import json
+from typing import Literal
+
+from fastapi import APIRouter, UploadFile, File, HTTPException, Request, Query
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+
+from utils.ocr_service import (
+    recognize,
+    stream_pages,
+    recognize_batch,
+    OCR_BATCH_SIZE,
+    OCR_BATCH_MAX_FILES,
+)
+from utils.ocr_jobs import QueueFullError
+from utils.uploads import receive_upload
 
 router = APIRouter(tags=["OCR"])
 
+
+def _get_ocr(request: Request):
+    # 模型未加载完成时返回 503 + Retry-After
+    return request.app.state.ocr.get()
+
+
 @router.post("/ocr", status_code=200)
 async def ocr_recognize(request: Request, file: UploadFile = File(...)) -> PlainTextResponse:
-    def _detect_ext(file: UploadFile) -> str:
-        name = (file.filename or "").lower()
-        ct = (file.content_type or "").lower()
-
-        known_exts = [".pdf", ".png", ".jpg", ".jpeg", ".bmp", ".webp", ".tif", ".tiff"]
-        for ext in known_exts:
-            if name.endswith(ext):
-                return ext
-
-        ct_map = {
-            "application/pdf": ".pdf",
-            "image/png": ".png",
-            "image/jpeg": ".jpg",
-            "image/bmp": ".bmp",
-            "image/webp": ".webp",
-            "image/tiff": ".tiff",
-        }
-
-        if ct in ct_map:
-            return ct_map[ct]
-
-        raise HTTPException(status_code=415, detail="Unsupported file type")
-    
-    ocr = request.app.state.ocr
-    if ocr is None:
-        raise HTTPException(status_code=503, detail="OCR service not initialized")
-
-    data = await file.read()
-    if not data:
-        raise HTTPException(status_code=400, detail="Empty file")
-
-    ext = _detect_ext(file)
-    md_parts: list[str] = []
-
-    # 使用相对于当前文件 (src/routers/ocr.py) 的相对路径 ../../
-    base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../"))
-    save_root = os.path.join(base_dir, "uploaded_files")  # 自定义固定目录
-    output_dir = os.path.join(base_dir, "ocr_outputs")
-    os.makedirs(save_root, exist_ok=True)
-    os.makedirs(output_dir, exist_ok=True)
-
-    # 2. 生成唯一文件名（避免同名文件覆盖）
-    unique_filename = f"{uuid.uuid4()}{ext}"
-    upload_path = os.path.join(save_root, unique_filename)
-    print(f"长期保存上传文件到：{upload_path}")
-
-    with open(upload_path, "wb") as fh:
-        fh.write(data)
-
-    # 记录处理前已存在的markdown文件
-    existing_files = set(glob.glob(os.path.join(output_dir, "*.md")))
-
-    results = ocr.predict(upload_path)
-    for res in results:
-        res.save_to_markdown(save_path=output_dir)
-
-    # 只读取当前生成的markdown文件
-    all_files = set(glob.glob(os.path.join(output_dir, "*.md")))
-    new_files = sorted(all_files - existing_files)
-    
-    for md_file in new_files:
-        with open(md_file, "r", encoding="utf-8") as f:
-            md_parts.append(f.read())
-
-    markdown_content = "\n\n".join(md_parts)
+    ocr = _get_ocr(request)
+
+    cache = request.app.state.ocr_cache
+    digest, upload_path, _ = await receive_upload(file, cache)
+
+    # 推理是阻塞的，放到线程池中执行，避免卡住事件循环；重复上传直接命中缓存
+    markdown_content = await run_in_threadpool(recognize, ocr, cache, digest, upload_path)
     return PlainTextResponse(content=markdown_content, media_type="text/markdown")
+
+
+@router.post("/ocr/batch", status_code=200)
+async def ocr_recognize_batch(
+    request: Request,
+    files: list[UploadFile] = File(...),
+    batch_size: int = Query(OCR_BATCH_SIZE, ge=1, le=64),
+) -> dict[str, str]:
+    """
+    批量 OCR：一次上传多个文件，按 batch_size 分组批量推理，
+    返回以原始文件名为键的 markdown (同名文件依次追加 " (2)"、" (3)" 区分)。
+    """
+    ocr = _get_ocr(request)
+    if len(files) > OCR_BATCH_MAX_FILES:
+        raise HTTPException(status_code=413, detail=f"Too many files (max {OCR_BATCH_MAX_FILES})")
+
+    cache = request.app.state.ocr_cache
+    names: list[str] = []
+    items: list[tuple[str, str]] = []
+    for i, file in enumerate(files):
+        digest, upload_path, ext = await receive_upload(file, cache)
+        items.append((digest, upload_path))
+
+        name = file.filename or f"file_{i}{ext}"
+        candidate, n = name, 1
+        while candidate in names:
+            n += 1
+            candidate = f"{name} ({n})"
+        names.append(candidate)
+
+    results = await run_in_threadpool(recognize_batch, ocr, cache, items, batch_size)
+    return {name: results[digest] for name, (digest, _) in zip(names, items)}
+
+
+@router.post("/ocr/stream", status_code=200)
+async def ocr_recognize_stream(
+    request: Request,
+    file: UploadFile = File(...),
+    format: Literal["markdown", "sse"] = "markdown",
+) -> StreamingResponse:
+    """
+    流式 OCR：每识别完一页就立即输出该页的 markdown。
+    format=markdown 为分块传输的 text/markdown，页与页之间以空行分隔；
+    format=sse 为 Server-Sent Events，每页一个 page 事件，结束时发送 done 事件。
+    """
+    ocr = _get_ocr(request)
+
+    cache = request.app.state.ocr_cache
+    digest, upload_path, _ = await receive_upload(file, cache)
+
+    # 同步生成器由 StreamingResponse 放到线程池中迭代，不会阻塞事件循环
+    pages = stream_pages(ocr, cache, digest, upload_path)
+
+    if format == "sse":
+        return StreamingResponse(_sse_events(pages), media_type="text/event-stream")
+    return StreamingResponse(_markdown_chunks(pages), media_type="text/markdown")
+
+
+def _markdown_chunks(pages):
+    for i, page in enumerate(pages):
+        yield page if i == 0 else f"\n\n{page}"
+
+
+def _sse_events(pages):
+    count = 0
+    try:
+        for count, page in enumerate(pages, start=1):
+            payload = json.dumps({"page": count - 1, "markdown": page}, ensure_ascii=False)
+            yield f"event: page\ndata: {payload}\n\n"
+    except Exception as e:
+        print(f"流式 OCR 失败: {e}")
+        yield f"event: error\ndata: {json.dumps({'error': str(e)}, ensure_ascii=False)}\n\n"
+        return
+    yield f"event: done\ndata: {json.dumps({'pages': count})}\n\n"
+
+
+@router.post("/ocr/jobs", status_code=202)
+async def create_ocr_job(request: Request, file: UploadFile = File(...)):
+    """
+    异步 OCR：立即返回 job_id，由后台工作线程执行识别，
+    通过 GET /ocr/jobs/{job_id} 轮询状态与结果。
+    """
+    ocr = _get_ocr(request)
+    jobs = request.app.state.ocr_jobs
+
+    # 队列已满时在读取上传内容之前就拒绝
+    if jobs.is_full():
+        raise HTTPException(status_code=429, detail="OCR queue is full", headers={"Retry-After": "10"})
+
+    cache = request.app.state.ocr_cache
+    digest, upload_path, _ = await receive_upload(file, cache)
+
+    try:
+        job = jobs.submit(recognize, ocr, cache, digest, upload_path, filename=file.filename)
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "10"})
+
+    return {"job_id": job.id, "status": job.status}
+
+
+@router.get("/ocr/jobs/{job_id}")
+async def get_ocr_job(job_id: str, request: Request):
+    job = request.app.state.ocr_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
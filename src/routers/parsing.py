@@ -3,7 +3,12 @@ from sqlalchemy.orm import Session
 from database import get_db
 from models import KnowledgeBase, Log
 from utils.get_resources_content import process_material_workflow
+from utils.kb_content import get_kb_meta, load_content
 import json
+import os
+
+# 解析只用到正文开头的部分 (与 call_llm_api 的截断长度一致)
+MATERIAL_PARSE_CHARS = int(os.getenv("MATERIAL_PARSE_CHARS", 3000))
 
 router = APIRouter(tags=["Material Analysis"])
 
@@ -14,18 +19,20 @@ async def parse_material(kb_id: int, request: Request, db: Session = Depends(get
     并将结果记录在 Log 中，实现转换与溯源。
     """
     # 1. 获取知识库条目 (溯源核心：基于已有KB ID)
-    kb_item = db.query(KnowledgeBase).filter(KnowledgeBase.id == kb_id).first()
+    # 只查询元数据，正文在数据库端截取需要的前缀
+    kb_item = get_kb_meta(db, kb_id, KnowledgeBase.id, KnowledgeBase.title)
     if not kb_item:
         raise HTTPException(status_code=404, detail="Material not found")
 
-    if not kb_item.content:
+    content = load_content(db, kb_id, 0, MATERIAL_PARSE_CHARS)
+    if not content:
         raise HTTPException(status_code=400, detail="Material content is empty")
 
     # 2. 调用解析工作流
     # 构造输入数据，process_material_workflow 期望 {"id": ..., "content": ...}
     material_input = {
         "id": str(kb_item.id), # 转即字符串为了通用性
-        "content": kb_item.content
+        "content": content
     }
     
     # 这里调用我们在 utils 中实现的具体逻辑
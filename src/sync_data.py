@@ -1,10 +1,23 @@
 import os
+import re
+import json
+import time
+import hashlib
+import argparse
+import tempfile
 import fitz  # PyMuPDF
 import bibtexparser
 import jieba.analyse
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from sqlalchemy import select, update, exists
 from sqlalchemy.orm import Session
 from database import SessionLocal
-from models import KnowledgeBase, Tag, KBTagRelation, Log  # 确保导入你的模型
+from utils.tagging import tag_resolver
+from utils.chunking import write_chunks, write_chunks_many, delete_chunks
+from utils.corpus_version import bump_corpus_version
+from utils.neighbours import neighbour_table
+from utils.kb_content import load_content
+from models import KnowledgeBase, KBChunk, Tag, KBTagRelation, Log, IngestManifest  # 确保导入你的模型
 
 def clean_bib_text(text):
     """清理 BibTeX 中的花括号"""
@@ -12,24 +25,96 @@ def clean_bib_text(text):
         return ""
     return text.replace('{', '').replace('}', '')
 
+# 是否同时把全文写入 knowledge_base.content (MySQL 全文检索依赖该字段)
+SYNC_STORE_FULL_CONTENT = os.getenv("SYNC_STORE_FULL_CONTENT", "1") == "1"
+# 批量提交：每累计 N 篇或每隔 T 秒提交一次事务 (N=1 即逐篇提交)
+SYNC_BATCH_SIZE = int(os.getenv("SYNC_BATCH_SIZE", 20))
+SYNC_BATCH_SECONDS = float(os.getenv("SYNC_BATCH_SECONDS", 5))
+# 整批提交失败后的重试次数，之后逐篇提交以隔离出错的文档
+SYNC_BATCH_RETRIES = int(os.getenv("SYNC_BATCH_RETRIES", 1))
+# 监听模式：轮询间隔，以及文件保持不变多久后才处理 (秒)
+SYNC_WATCH_INTERVAL = float(os.getenv("SYNC_WATCH_INTERVAL", 1))
+SYNC_WATCH_DEBOUNCE = float(os.getenv("SYNC_WATCH_DEBOUNCE", 2))
+# 监听模式下一批处理失败后的重试间隔上限 (秒)，间隔按连续失败次数翻倍
+SYNC_WATCH_MAX_BACKOFF = float(os.getenv("SYNC_WATCH_MAX_BACKOFF", 300))
+# 提取进程逐页写入文本的临时文件目录 (默认系统临时目录)
+SYNC_SPOOL_DIR = os.getenv("SYNC_SPOOL_DIR") or None
+# 写入 content 时每次追加的字符数，写入进程只持有这么多文本
+SYNC_CONTENT_PIECE_CHARS = int(os.getenv("SYNC_CONTENT_PIECE_CHARS", 1_000_000))
+# 并行提取 PDF 的进程数，默认串行；按机器核数与数据库承受能力显式调大
+SYNC_WORKERS = int(os.getenv("SYNC_WORKERS", 1))
+
+def iter_pdf_pages(pdf_path):
+    """逐页产出 (页码, 页面文本)，页码从 1 开始"""
+    doc = fitz.open(pdf_path)
+    try:
+        for i, page in enumerate(doc):
+            yield i + 1, page.get_text()
+    finally:
+        doc.close()
+
+class PageSpool:
+    """
+    提取进程逐页写入的临时文件 (每行一个 JSON [页码, 文本])。
+    进程间只传递文件路径；写入进程逐页读取，内存占用与单页而不是整篇文档相关，可重复遍历 (批次重试)。
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def __iter__(self):
+        with open(self.path, encoding="utf-8") as fh:
+            for line in fh:
+                page_no, text = json.loads(line)
+                yield page_no, text
+
+    def pieces(self, size: int = SYNC_CONTENT_PIECE_CHARS):
+        """把逐页文本拼成不小于 size 个字符的片段 (最后一段可能更短)"""
+        buf, length = [], 0
+        for _, text in self:
+            buf.append(text)
+            length += len(text)
+            if length >= size:
+                yield "".join(buf)
+                buf, length = [], 0
+        if buf:
+            yield "".join(buf)
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
 def extract_pdf_info(pdf_path):
     """
-    提取 PDF 内容
-    返回: (全文内容, 用于提取标签的前3页内容)
+    逐页提取 PDF 内容，边读边写入临时文件，不在内存中保留全文
+    返回: (PageSpool, 用于提取标签的前3页内容)
     """
-    full_text = ""
-    core_text = ""
+    fd, path = tempfile.mkstemp(prefix="sync-pages-", suffix=".jsonl", dir=SYNC_SPOOL_DIR)
+    core_pages = []
     try:
-        doc = fitz.open(pdf_path)
-        for i, page in enumerate(doc):
-            page_text = page.get_text()
-            full_text += page_text
-            if i < 3:  # 仅提取前3页作为核心内容
-                core_text += page_text
-        doc.close()
-    except Exception as e:
-        print(f"读取 PDF 失败 {pdf_path}: {e}")
-    return full_text, core_text
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            try:
+                for page_no, text in iter_pdf_pages(pdf_path):
+                    fh.write(json.dumps([page_no, text], ensure_ascii=False) + "\n")
+                    # 仅提取前3页作为核心内容
+                    if page_no <= 3:
+                        core_pages.append(text)
+            except Exception as e:
+                print(f"读取 PDF 失败 {pdf_path}: {e}")
+    except BaseException:
+        os.remove(path)
+        raise
+    return PageSpool(path), "".join(core_pages)
+
+def store_content(db: Session, kb_id: int, pages: PageSpool, piece_chars: int = SYNC_CONTENT_PIECE_CHARS):
+    """把逐页文本分段写入 knowledge_base.content (第一段覆盖，之后在数据库端追加)"""
+    table = KnowledgeBase.__table__
+    value = None
+    for piece in pages.pieces(piece_chars):
+        value = piece if value is None else table.c.content + piece
+        db.execute(update(table).where(table.c.id == kb_id).values(content=value))
 
 def parse_year(year_str):
     """
@@ -41,105 +126,609 @@ def parse_year(year_str):
     match = re.search(r'\d{4}', str(year_str))
     return int(match.group()) if match else None
 
-def sync_papers(db: Session, bibs_dir: str, pdfs_dir: str):
+def read_bib_metadata(paper_id, bib_path):
     """
-    同步 BibTeX 和 PDF 到数据库，包含 year 属性处理
+    从 BibTeX 读取元数据，读取失败时退回默认值
+    返回: (title, authors, year)
     """
-    if not os.path.exists(pdfs_dir):
-        print(f"❌ 错误: 找不到 PDF 文件夹 {pdfs_dir}")
-        return
+    # 1. 默认元数据
+    title = paper_id
+    authors = ""
+    year_val = None
+
+    # 2. 从 BibTeX 读取信息
+    if os.path.exists(bib_path):
+        try:
+            with open(bib_path, encoding='utf-8') as b_file:
+                bib_db = bibtexparser.load(b_file)
+                if bib_db.entries:
+                    entry = bib_db.entries[0]
+                    title = clean_bib_text(entry.get('title', paper_id))
+                    authors = clean_bib_text(entry.get('author', ''))
+                    # 使用正则解析年份
+                    year_val = parse_year(entry.get('year', ''))
+        except Exception as e:
+            print(f"  ⚠️ 解析 BibTeX 失败 ({paper_id}): {e}")
+    else:
+        print(f"  ⚠️ 未找到 Bib 文件: {paper_id}.bib")
+
+    return title, authors, year_val
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """分块计算文件内容的 SHA-256"""
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def prepare_paper(pdf_path, title, known_hash=None, extract=True):
+    """
+    CPU 密集部分：内容哈希 + PDF 文本提取 + jieba 关键词提取。
+    不访问数据库，可在进程池中执行。
+    known_hash 与当前内容一致 (仅 mtime 变化) 或 extract=False 时只返回哈希。
+    返回: {"content_hash", "unchanged", "pages" (PageSpool，由 PaperBatch 负责删除), "keywords"}
+    """
+    content_hash = file_sha256(pdf_path)
+    result = {"content_hash": content_hash, "unchanged": content_hash == known_hash}
+    if result["unchanged"] or not extract:
+        return result
+
+    # pages: 逐页文本的临时文件 (分页写入文本块), core_text: 用于生成标签
+    pages, core_text = extract_pdf_info(pdf_path)
 
-    # 获取所有 PDF 文件
-    pdf_files = [f for f in os.listdir(pdfs_dir) if f.lower().endswith(".pdf")]
-    
+    # 自动标签生成 (基于标题加权)
+    tag_source = f"{title} {title} {core_text}"
+    result["pages"] = pages
+    result["keywords"] = jieba.analyse.extract_tags(tag_source, topK=5)
+    return result
+
+def write_paper(db: Session, task, prepared, tag_items, chunk_docs):
+    """
+    在当前事务中写入一篇论文 (不提交，只在单一写入进程中调用)：
+    - 新文件：新建条目
+    - 内容变化：原地更新已有条目的内容与元数据，清除旧标签与文本块
+    - 内容未变 / 按标题并入已有条目：只更新元数据与清单
+    标签与文本块不立即写入，而是追加到 tag_items / chunk_docs，由批次统一批量插入。
+    返回本篇的处理结果描述。
+    """
+    title, year_val = task["title"], task["year"]
+    entry = db.get(KnowledgeBase, task["kb_id"]) if task["kb_id"] else None
+    if entry is None and "pages" not in prepared:
+        # 清单指向的条目已被删除：按新文件重新提取
+        prepared = prepare_paper(task["pdf_path"], title)
+
+    if entry is None:
+        entry = KnowledgeBase(
+            title=title,
+            content=None,
+            authors=task["authors"],
+            year=year_val,          # 新增属性
+            file_path=task["pdf_path"],
+            file_type="pdf",
+            category="Paper"
+        )
+        db.add(entry)
+        db.flush()  # 生成自增 ID
+        action = "成功入库"
+    elif "pages" in prepared:
+        entry.title = title
+        entry.authors = task["authors"]
+        entry.year = year_val
+        entry.content = None
+        entry.file_path = task["pdf_path"]
+        # 标签与文本块随内容重建
+        tag_resolver.detach(db, entry.id)
+        delete_chunks(db, entry.id)
+        action = "已更新"
+    else:
+        if task["bib_changed"]:
+            entry.title = title
+            entry.authors = task["authors"]
+            entry.year = year_val
+        action = "已登记"
+
+    if "pages" in prepared:
+        tag_items.append((entry.id, prepared["keywords"]))
+        chunk_docs.append((entry.id, prepared["pages"]))
+        if SYNC_STORE_FULL_CONTENT:
+            # 先写出条目本身的修改，再分段写入正文，避免之后的 flush 用 None 覆盖
+            db.flush()
+            store_content(db, entry.id, prepared["pages"])
+
+    manifest = task["manifest"]
+    if manifest is None:
+        manifest = IngestManifest(path=task["pdf_path"])
+        db.add(manifest)
+    manifest.size = task["size"]
+    manifest.mtime = task["mtime"]
+    manifest.bib_mtime = task["bib_mtime"]
+    manifest.content_hash = prepared["content_hash"]
+    manifest.kb_id = entry.id
+    return action
+
+class PaperBatch:
+    """
+    批量提交：累计 size 篇或距第一篇加入超过 seconds 秒时在一个事务中写入，
+    整批的标签只解析一次，关联与文本块用 executemany 批量插入。
+    提交失败时先整批重试 retries 次，仍失败则逐篇单独提交，隔离出有问题的文档，
+    其余文档照常入库 (失败文档的清单不更新，下次同步会再次处理)。
+    """
+
+    def __init__(self, db: Session, size: int = SYNC_BATCH_SIZE, seconds: float = SYNC_BATCH_SECONDS,
+                 retries: int = SYNC_BATCH_RETRIES):
+        self.db = db
+        self.size = max(1, size)
+        self.seconds = seconds
+        self.retries = retries
+        self.items = []
+        self.started = None
+        # 本批写入用到的逐页临时文件 (含写入时重新提取产生的)，批次结束后删除
+        self._spools = []
+
+    def add(self, task, prepared):
+        if not self.items:
+            self.started = time.monotonic()
+        self.items.append((task, prepared))
+        if len(self.items) >= self.size or self.due():
+            self.flush()
+
+    def due(self):
+        return bool(self.items) and time.monotonic() - self.started >= self.seconds
+
+    def flush(self):
+        items, self.items = self.items, []
+        if not items:
+            return
+        try:
+            self._flush(items)
+        finally:
+            spools = self._spools + [prepared["pages"] for _, prepared in items if "pages" in prepared]
+            self._spools = []
+            for spool in spools:
+                spool.remove()
+
+    def _flush(self, items):
+        for attempt in range(self.retries + 1):
+            try:
+                self._commit(items)
+                return
+            except Exception as e:
+                self.db.rollback()
+                if len(items) == 1:
+                    print(f"  ❌ 数据库写入失败 ({items[0][0]['title']}): {e}")
+                else:
+                    print(f"  ⚠️ 批量写入失败 (第 {attempt + 1} 次，共 {len(items)} 篇): {e}")
+        if len(items) == 1:
+            return
+
+        print("  🔎 逐篇重试以定位失败的文档")
+        for item in items:
+            try:
+                self._commit([item])
+            except Exception as e:
+                self.db.rollback()
+                print(f"  ❌ 数据库写入失败 ({item[0]['title']}): {e}")
+
+    def _commit(self, items):
+        tag_items = []
+        chunk_docs = []
+        try:
+            actions = [write_paper(self.db, task, prepared, tag_items, chunk_docs) for task, prepared in items]
+        finally:
+            self._spools.extend(pages for _, pages in chunk_docs)
+        tag_resolver.attach_many(self.db, tag_items)
+        write_chunks_many(self.db, chunk_docs)
+        # 语料变化，使 API 进程中的检索结果缓存失效
+        bump_corpus_version(self.db)
+        self.db.commit()
+        for (task, _), action in zip(items, actions):
+            year_val = task["year"]
+            print(f"  ✅ {action}: {task['title']} ({year_val if year_val else '未知年份'})")
+
+def _file_mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+def _existing_titles(db: Session, titles):
+    """一次 (分块) IN 查询取回已存在的标题 -> 条目 ID"""
+    found = {}
+    titles = list(titles)
+    for i in range(0, len(titles), 500):
+        chunk = titles[i:i + 500]
+        rows = db.query(KnowledgeBase.id, KnowledgeBase.title).filter(KnowledgeBase.title.in_(chunk)).all()
+        for kb_id, title in rows:
+            found.setdefault(title, kb_id)
+    return found
+
+def plan_sync(db: Session, bibs_dir: str, pdfs_dir: str, pdf_files=None):
+    """
+    对比同步清单与磁盘文件状态，生成需要处理的任务列表。
+    大小、mtime 与 .bib 均未变化的文件直接跳过，不读取文件内容。
+    pdf_files 指定时只检查这些文件 (监听模式下的增量)，否则扫描整个目录。
+    """
+    if pdf_files is None:
+        # 获取所有 PDF 文件，一次性取回清单，代替逐个文件查询
+        pdf_files = [f for f in os.listdir(pdfs_dir) if f.lower().endswith(".pdf")]
+        manifests = {m.path: m for m in db.query(IngestManifest).all()}
+    else:
+        paths = [os.path.join(pdfs_dir, f) for f in pdf_files]
+        manifests = {m.path: m for m in db.query(IngestManifest).filter(IngestManifest.path.in_(paths)).all()}
+
+    tasks = []
+    new_tasks = []
+    unchanged = 0
     for pdf_file in pdf_files:
         paper_id = os.path.splitext(pdf_file)[0]
         pdf_path = os.path.join(pdfs_dir, pdf_file)
         bib_path = os.path.join(bibs_dir, f"{paper_id}.bib")
-        
+        st = os.stat(pdf_path)
+        bib_mtime = _file_mtime(bib_path)
+
+        manifest = manifests.get(pdf_path)
+        file_changed = manifest is None or manifest.size != st.st_size or manifest.mtime != st.st_mtime
+        bib_changed = manifest is not None and manifest.bib_mtime != bib_mtime
+        if not file_changed and not bib_changed:
+            unchanged += 1
+            continue
+
         print(f"🔍 正在处理: {paper_id}...")
+        title, authors, year_val = read_bib_metadata(paper_id, bib_path)
+        task = {
+            "pdf_path": pdf_path,
+            "title": title,
+            "authors": authors,
+            "year": year_val,
+            "size": st.st_size,
+            "mtime": st.st_mtime,
+            "bib_mtime": bib_mtime,
+            "bib_changed": bib_changed,
+            "manifest": manifest,
+            "kb_id": manifest.kb_id if manifest is not None else None,
+            # 沿用已知哈希：内容未变 (只有 mtime 或 .bib 变化) 时不重新提取
+            "known_hash": manifest.content_hash if manifest is not None else None,
+            "extract": True,
+        }
+        (tasks if manifest is not None else new_tasks).append(task)
+
+    # 新文件按标题去重：一次批量查询已存在的标题
+    existing = _existing_titles(db, {t["title"] for t in new_tasks})
+    seen_titles = set()
+    for task in new_tasks:
+        title = task["title"]
+        if title in seen_titles:
+            print(f"  ⏭️ 跳过: {title} 已存在")
+            continue
+        seen_titles.add(title)
+        if title in existing:
+            # 清单启用前已入库的条目：登记到清单，不重新提取
+            print(f"  ⏭️ 跳过: {title} 已存在")
+            task["kb_id"] = existing[title]
+            task["extract"] = False
+        tasks.append(task)
+
+    print(f"📋 共 {len(pdf_files)} 个 PDF，{unchanged} 个未变化，{len(tasks)} 个待处理")
+    return tasks
+
+def _prepare_args(task):
+    return task["pdf_path"], task["title"], task["known_hash"], task["extract"]
 
-        # 1. 默认元数据
-        title = paper_id
-        authors = ""
-        year_val = None
-        
-        # 2. 从 BibTeX 读取信息
-        if os.path.exists(bib_path):
+def ingest_tasks(tasks, batch: PaperBatch, executor=None, workers: int = 1):
+    """
+    提取并写入一组同步任务。executor 为进程池时并行提取，
+    当前进程作为唯一写入者，按批次提交。
+    """
+    if executor is None:
+        for task in tasks:
             try:
-                with open(bib_path, encoding='utf-8') as b_file:
-                    bib_db = bibtexparser.load(b_file)
-                    if bib_db.entries:
-                        entry = bib_db.entries[0]
-                        title = clean_bib_text(entry.get('title', paper_id))
-                        authors = clean_bib_text(entry.get('author', ''))
-                        # 使用正则解析年份
-                        year_val = parse_year(entry.get('year', ''))
+                prepared = prepare_paper(*_prepare_args(task))
             except Exception as e:
-                print(f"  ⚠️ 解析 BibTeX 失败 ({paper_id}): {e}")
-        else:
-            print(f"  ⚠️ 未找到 Bib 文件: {paper_id}.bib")
+                print(f"  ❌ PDF 提取失败: {e}")
+                continue
+            batch.add(task, prepared)
+        batch.flush()
+        return
 
-        # 3. 检查数据库是否已存在 (避免重复导入)
-        existing = db.query(KnowledgeBase).filter(KnowledgeBase.title == title).first()
-        if existing:
-            print(f"  ⏭️ 跳过: {title} 已存在")
-            continue
+    remaining = iter(tasks)
+    in_flight = {}
 
-        # 4. 提取 PDF 内容 (假设你已有 extract_pdf_info 函数)
-        try:
-            # full_text: 用于全文检索, core_text: 用于生成标签
-            full_text, core_text = extract_pdf_info(pdf_path) 
-        except Exception as e:
-            print(f"  ❌ PDF 提取失败: {e}")
-            continue
+    def submit_more():
+        # 限制在途任务数，避免已提取的全文在内存中堆积
+        while len(in_flight) < workers * 2:
+            task = next(remaining, None)
+            if task is None:
+                return
+            in_flight[executor.submit(prepare_paper, *_prepare_args(task))] = task
+
+    submit_more()
+    while in_flight:
+        # 谁先提取完谁先入库，写入始终在当前进程串行进行
+        # 带超时等待，提取较慢时也能按时间间隔提交已完成的部分
+        done, _ = wait(in_flight, timeout=batch.seconds, return_when=FIRST_COMPLETED)
+        for future in done:
+            task = in_flight.pop(future)
+            try:
+                prepared = future.result()
+            except Exception as e:
+                print(f"  ❌ PDF 提取失败 ({task['title']}): {e}")
+                continue
+            batch.add(task, prepared)
+        if batch.due():
+            batch.flush()
+        submit_more()
+    batch.flush()
+
+def sync_papers(db: Session, bibs_dir: str, pdfs_dir: str, workers: int = 1,
+                batch_size: int = SYNC_BATCH_SIZE, batch_seconds: float = SYNC_BATCH_SECONDS,
+                executor=None):
+    """
+    增量同步 BibTeX 和 PDF 到数据库，包含 year 属性处理
+    workers > 1 时由进程池并行完成哈希、PDF 提取与关键词提取，当前进程作为唯一写入者入库
+    写入按 batch_size 篇 / batch_seconds 秒分批提交
+    """
+    if not os.path.exists(pdfs_dir):
+        print(f"❌ 错误: 找不到 PDF 文件夹 {pdfs_dir}")
+        return
+
+    tasks = plan_sync(db, bibs_dir, pdfs_dir)
+    batch = PaperBatch(db, size=batch_size, seconds=batch_seconds)
+
+    # 提取 PDF 内容并入库
+    if workers <= 1 or executor is not None:
+        ingest_tasks(tasks, batch, executor, workers)
+        return
+
+    print(f"⚙️ 使用 {workers} 个进程并行提取 {len(tasks)} 篇论文")
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        ingest_tasks(tasks, batch, executor, workers)
+
+def _content_pages(db: Session, kb_id: int, piece_chars: int = SYNC_CONTENT_PIECE_CHARS):
+    """分段读取条目已有的 content，作为无页码的 "页" 产出"""
+    start = 0
+    while True:
+        piece = load_content(db, kb_id, start, piece_chars)
+        if not piece:
+            return
+        yield None, piece
+        start += len(piece)
+
+def backfill_chunks(db: Session, batch: int = SYNC_BATCH_SIZE) -> int:
+    """
+    为还没有文本块的条目补写 knowledge_chunks (如启用文本块之前入库、同步时按标题跳过提取的条目)：
+    PDF 文件仍在时逐页读取 (保留页码)，否则分段读取 content；每 batch 篇提交一次，返回补写的条目数
+    """
+    has_chunks = exists().where(KBChunk.kb_id == KnowledgeBase.id)
+    rows = db.execute(
+        select(KnowledgeBase.id, KnowledgeBase.title, KnowledgeBase.file_path)
+        .where(~has_chunks)
+        .order_by(KnowledgeBase.id)
+    ).all()
+    filled = 0
+    for i in range(0, len(rows), batch):
+        for kb_id, title, file_path in rows[i:i + batch]:
+            from_pdf = bool(file_path) and file_path.lower().endswith(".pdf") and os.path.exists(file_path)
+            pages = iter_pdf_pages(file_path) if from_pdf else _content_pages(db, kb_id)
+            try:
+                with db.begin_nested():
+                    count = write_chunks(db, kb_id, pages)
+            except Exception as e:
+                print(f"  ❌ 补写文本块失败 ({title}): {e}")
+                continue
+            if count:
+                filled += 1
+        bump_corpus_version(db)
+        db.commit()
+        print(f"  🧩 已处理 {min(i + batch, len(rows))}/{len(rows)} 个缺少文本块的条目")
+    return filled
+
+def remove_papers(db: Session, pdf_paths):
+    """
+    PDF 已从磁盘删除：移除清单记录，以及只被这些文件引用的条目 (连同标签关联与文本块)
+    """
+    manifests = db.query(IngestManifest).filter(IngestManifest.path.in_(list(pdf_paths))).all()
+    if not manifests:
+        return
+    kb_ids = {m.kb_id for m in manifests if m.kb_id}
+    for manifest in manifests:
+        db.delete(manifest)
+    db.flush()
+
+    # 按标题并入的多个文件可能共用一个条目，仍被引用的条目保留
+    still_used = {
+        kb_id for (kb_id,) in
+        db.query(IngestManifest.kb_id).filter(IngestManifest.kb_id.in_(kb_ids)).distinct()
+    }
+    try:
+        for entry in db.query(KnowledgeBase).filter(KnowledgeBase.id.in_(kb_ids - still_used)).all():
+            tag_resolver.detach(db, entry.id)
+            delete_chunks(db, entry.id)
+            db.delete(entry)
+            print(f"  🗑️ 已移除: {entry.title}")
+        bump_corpus_version(db)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"  ❌ 移除失败: {e}")
+
+def _scan_dir(path, ext):
+    """返回 {paper_id: (文件名, 大小, mtime)}，只读取目录项元数据"""
+    found = {}
+    try:
+        with os.scandir(path) as it:
+            for item in it:
+                if not item.name.lower().endswith(ext) or not item.is_file():
+                    continue
+                try:
+                    st = item.stat()
+                except OSError:
+                    continue
+                found[os.path.splitext(item.name)[0]] = (item.name, st.st_size, st.st_mtime)
+    except FileNotFoundError:
+        pass
+    return found
+
+class CorpusWatcher:
+    """
+    监听模式：定时轮询 PDF 与 BibTeX 目录 (不依赖 inotify，任何挂载点都可用)，
+    只把新增、修改或删除的文件送入同步流程。
+    文件在 debounce 秒内不再变化才处理，避免读到复制到一半的文件；
+    同一轮中稳定下来的所有变化合并为一次批量写入；
+    一批处理失败时记录错误，把这些文件放回待处理队列，按连续失败次数退避后重试。
+    """
 
-        # 5. 写入数据库
+    def __init__(self, bibs_dir: str, pdfs_dir: str, session_factory=SessionLocal,
+                 interval: float = SYNC_WATCH_INTERVAL, debounce: float = SYNC_WATCH_DEBOUNCE,
+                 batch_size: int = SYNC_BATCH_SIZE, batch_seconds: float = SYNC_BATCH_SECONDS,
+                 max_backoff: float = SYNC_WATCH_MAX_BACKOFF):
+        self.bibs_dir = bibs_dir
+        self.pdfs_dir = pdfs_dir
+        self.session_factory = session_factory
+        self.interval = interval
+        self.debounce = debounce
+        self.batch_size = batch_size
+        self.batch_seconds = batch_seconds
+        self.max_backoff = max_backoff
+        self._pdfs = {}
+        self._bibs = {}
+        # paper_id -> 最近一次观察到变化的时间
+        self._pending = {}
+        # paper_id -> 最近一次见到的 PDF 文件名 (文件删除后用于定位清单记录)
+        self._names = {}
+        # paper_id -> 连续处理失败的次数
+        self._failures = {}
+
+    def poll(self):
+        """扫描一次目录，记录发生变化的 paper_id，返回已稳定、可以处理的集合"""
+        now = time.monotonic()
+        pdfs = _scan_dir(self.pdfs_dir, ".pdf")
+        bibs = _scan_dir(self.bibs_dir, ".bib")
+        for old, new in ((self._pdfs, pdfs), (self._bibs, bibs)):
+            for paper_id in old.keys() | new.keys():
+                if old.get(paper_id) != new.get(paper_id):
+                    self._pending[paper_id] = now
+        self._pdfs, self._bibs = pdfs, bibs
+        self._names.update((pid, info[0]) for pid, info in pdfs.items())
+
+        ready = {pid for pid, changed_at in self._pending.items() if now - changed_at >= self.debounce}
+        for pid in ready:
+            del self._pending[pid]
+        return ready
+
+    def process(self, paper_ids, executor=None, workers: int = 1):
+        """把一组已稳定的变化送入同步流程"""
+        present = sorted(self._pdfs[pid][0] for pid in paper_ids if pid in self._pdfs)
+        gone = [pid for pid in paper_ids if pid not in self._pdfs]
+        removed = [os.path.join(self.pdfs_dir, self._names.get(pid, f"{pid}.pdf")) for pid in gone]
+        db = self.session_factory()
         try:
-            new_entry = KnowledgeBase(
-                title=title,
-                content=full_text,
-                authors=authors,
-                year=year_val,          # 新增属性
-                file_path=pdf_path,
-                file_type="pdf",
-                category="Paper"
-            )
-            db.add(new_entry)
-            db.flush()  # 生成自增 ID
-
-            # 6. 自动标签生成 (基于标题加权)
-            tag_source = f"{title} {title} {core_text}"
-            keywords = jieba.analyse.extract_tags(tag_source, topK=5)
-
-            for kw in keywords:
-                # 检查标签池
-                tag = db.query(Tag).filter(Tag.name == kw).first()
-                if not tag:
-                    tag = Tag(name=kw)
-                    db.add(tag)
-                    db.flush()
-                
-                # 建立多对多关联
-                if tag not in new_entry.tags:
-                    new_entry.tags.append(tag)
-            
-            db.commit()
-            print(f"  ✅ 成功入库: {title} ({year_val if year_val else '未知年份'})")
+            if removed:
+                remove_papers(db, removed)
+            if present:
+                tasks = plan_sync(db, self.bibs_dir, self.pdfs_dir, pdf_files=present)
+                batch = PaperBatch(db, size=self.batch_size, seconds=self.batch_seconds)
+                ingest_tasks(tasks, batch, executor, workers)
+        finally:
+            db.close()
+        for pid in gone:
+            self._names.pop(pid, None)
 
-        except Exception as e:
-            db.rollback()
-            print(f"  ❌ 数据库写入失败: {e}")
+    def retry_later(self, paper_ids):
+        """处理失败：放回待处理队列，推迟 debounce × 2^(连续失败次数) 秒 (不超过 max_backoff)"""
+        now = time.monotonic()
+        delay = 0.0
+        for pid in paper_ids:
+            failures = self._failures.get(pid, 0) + 1
+            self._failures[pid] = failures
+            delay = min(self.debounce * 2 ** failures, self.max_backoff)
+            # poll 在 changed_at 之后 debounce 秒才处理；期间文件再次变化时由 poll 覆盖为新的时间
+            self._pending[pid] = now + delay - self.debounce
+        return delay
+
+    def run(self, workers: int = 1):
+        """先做一次完整的增量同步，之后持续监听，直到被中断"""
+        executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+        try:
+            # 记录启动时的目录状态，全量同步已覆盖这些文件
+            self._pdfs = _scan_dir(self.pdfs_dir, ".pdf")
+            self._bibs = _scan_dir(self.bibs_dir, ".bib")
+            self._names = {pid: info[0] for pid, info in self._pdfs.items()}
+            db = self.session_factory()
+            try:
+                sync_papers(db, self.bibs_dir, self.pdfs_dir, workers=workers, batch_size=self.batch_size,
+                            batch_seconds=self.batch_seconds, executor=executor)
+            finally:
+                db.close()
 
+            print(f"👀 正在监听 {self.pdfs_dir} 与 {self.bibs_dir} (每 {self.interval} 秒轮询)")
+            while True:
+                time.sleep(self.interval)
+                ready = self.poll()
+                if ready:
+                    print(f"📥 检测到 {len(ready)} 篇论文发生变化")
+                    try:
+                        self.process(ready, executor, workers)
+                    except Exception as e:
+                        delay = self.retry_later(ready)
+                        print(f"❌ 处理失败，{delay:.0f} 秒后重试 ({len(ready)} 篇): {e}")
+                    else:
+                        for pid in ready:
+                            self._failures.pop(pid, None)
+        except KeyboardInterrupt:
+            print("👋 停止监听")
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="同步 BibTeX 与 PDF 到知识库")
     # 配置你的路径
-    BIB_FOLDER = os.path.join("..", "bibs")
-    PDF_FOLDER = os.path.join("..", "database")
-    
-    # 启动同步
-    db_session = SessionLocal()
-    try:
-        sync_papers(db_session, BIB_FOLDER, PDF_FOLDER)
-    finally:
-        db_session.close()
\ No newline at end of file
+    parser.add_argument("--bibs", default=os.path.join("..", "bibs"), help="BibTeX 文件夹")
+    parser.add_argument("--pdfs", default=os.path.join("..", "database"), help="PDF 文件夹")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=SYNC_WORKERS,
+        help="并行提取 PDF 的进程数 (1 为串行)",
+    )
+    parser.add_argument("--batch-size", type=int, default=SYNC_BATCH_SIZE, help="每个事务最多写入的论文数")
+    parser.add_argument("--batch-seconds", type=float, default=SYNC_BATCH_SECONDS, help="事务最长累积时间 (秒)")
+    parser.add_argument("--watch", action="store_true", help="同步完成后持续监听目录变化")
+    parser.add_argument("--interval", type=float, default=SYNC_WATCH_INTERVAL, help="监听模式的轮询间隔 (秒)")
+    parser.add_argument("--debounce", type=float, default=SYNC_WATCH_DEBOUNCE, help="文件稳定多少秒后才处理")
+    parser.add_argument("--rebuild-neighbours", action="store_true", help="全量重建推荐近邻表后退出")
+    parser.add_argument("--rebuild-chunks", action="store_true", help="为缺少文本块的已有条目补写文本块后退出")
+    args = parser.parse_args()
+
+    if args.rebuild_neighbours:
+        db_session = SessionLocal()
+        try:
+            count = neighbour_table.rebuild(db_session)
+            db_session.commit()
+            print(f"✅ 推荐近邻表已重建 ({count} 个条目)")
+        finally:
+            db_session.close()
+    elif args.rebuild_chunks:
+        db_session = SessionLocal()
+        try:
+            count = backfill_chunks(db_session, batch=args.batch_size)
+            print(f"✅ 已为 {count} 个条目补写文本块")
+        finally:
+            db_session.close()
+    elif args.watch:
+        watcher = CorpusWatcher(
+            args.bibs, args.pdfs, interval=args.interval, debounce=args.debounce,
+            batch_size=args.batch_size, batch_seconds=args.batch_seconds,
+        )
+        watcher.run(workers=args.workers)
+    else:
+        # 启动同步
+        db_session = SessionLocal()
+        try:
+            sync_papers(
+                db_session, args.bibs, args.pdfs, workers=args.workers,
+                batch_size=args.batch_size, batch_seconds=args.batch_seconds,
+            )
+        finally:
+            db_session.close()
@@ -0,0 +1,38 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# 测试使用临时 SQLite 数据库与索引目录，必须在导入业务模块之前设置
+_TMP = tempfile.mkdtemp(prefix="kb-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_TMP, 'test.db')}")
+os.environ.setdefault("DB_ASYNC", "1")
+os.environ.setdefault("SEARCH_BACKEND", "bm25")
+os.environ.setdefault("BM25_INDEX_DIR", os.path.join(_TMP, "search_index"))
+os.environ.setdefault("VECTOR_INDEX_DIR", os.path.join(_TMP, "vector_index"))
+os.environ.setdefault("CORPUS_VERSION_POLL_SECONDS", "0")
+os.environ.setdefault("QUERY_EXPANSION_BACKEND", "none")
+os.environ.setdefault("QUERY_EXPANSION_WORDNET", "0")
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import models  # noqa: E402
+from database import Base, engine, SessionLocal  # noqa: E402
+from utils.search_cache import search_cache  # noqa: E402
+from utils.tagging import tag_resolver  # noqa: E402
+
+
+@pytest.fixture
+def db():
+    """每个测试一个空库"""
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    # 标签 ID 缓存与检索结果缓存都属于上一个库 (新库的语料版本号会重复)
+    tag_resolver._cache.clear()
+    search_cache.backend.clear()
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
@@ -0,0 +1,98 @@
+import os
+
+import pytest
+from fastapi import HTTPException
+
+import models
+from database import SessionLocal
+from utils.bm25_index import BM25Index
+from utils.corpus_version import bump_corpus_version
+
+
+def add_doc(db, title, content):
+    entry = models.KnowledgeBase(title=title, content=content)
+    db.add(entry)
+    bump_corpus_version(db)
+    db.commit()
+    return entry
+
+
+def ready_index(path):
+    index = BM25Index(index_dir=str(path))
+    index.warmup(SessionLocal)
+    return index
+
+
+def test_title_matches_rank_above_content_matches(db, tmp_path):
+    in_content = add_doc(db, "图像识别", "本文顺带提到 强化学习")
+    in_title = add_doc(db, "强化学习综述", "策略 奖励 环境")
+    unrelated = add_doc(db, "数据库索引", "倒排 索引 压缩")
+    index = ready_index(tmp_path)
+
+    hits = index.search(db, ["强化学习"])
+    assert [kb_id for kb_id, _ in hits] == [in_title.id, in_content.id]
+    assert unrelated.id not in dict(hits)
+
+
+def test_refresh_picks_up_inserts_updates_and_deletes(db, tmp_path):
+    first = add_doc(db, "图像分割", "卷积 网络")
+    second = add_doc(db, "目标检测", "卷积 特征")
+    index = ready_index(tmp_path)
+
+    third = add_doc(db, "语义分割", "卷积 解码器")
+    assert third.id in dict(index.search(db, ["解码器"]))
+
+    first.content = "注意力 机制"
+    bump_corpus_version(db)
+    db.commit()
+    assert first.id not in dict(index.search(db, ["卷积"]))
+    assert first.id in dict(index.search(db, ["注意力"]))
+
+    db.delete(second)
+    bump_corpus_version(db)
+    db.commit()
+    assert second.id not in dict(index.search(db, ["特征"]))
+
+
+def test_deleted_documents_do_not_count_towards_df(db, tmp_path):
+    keep = [add_doc(db, f"文档 {i}", f"卷积 网络 主题{i}") for i in range(3)]
+    doomed = [add_doc(db, f"旧文档 {i}", "卷积 过时") for i in range(3)]
+    index = ready_index(tmp_path / "incremental")
+    for entry in doomed:
+        db.delete(entry)
+    bump_corpus_version(db)
+    db.commit()
+    hits = index.search(db, ["卷积"])
+    # 删除尚未合并进主索引
+    assert index.dirty
+
+    # 与按剩余文档全新构建的索引得分一致
+    fresh = ready_index(tmp_path / "fresh")
+    assert hits == pytest.approx(fresh.search(db, ["卷积"]))
+    assert {kb_id for kb_id, _ in index.search(db, ["卷积"])} == {e.id for e in keep}
+
+
+def test_search_before_warmup_returns_503_and_loads_in_background(db, tmp_path):
+    entry = add_doc(db, "强化学习", "策略 梯度")
+    index = BM25Index(index_dir=str(tmp_path))
+    with pytest.raises(HTTPException) as exc:
+        index.search(db, ["策略"])
+    assert exc.value.status_code == 503
+    assert "Retry-After" in exc.value.headers
+
+    index._warmup_thread.join(timeout=30)
+    assert index.ready
+    assert [kb_id for kb_id, _ in index.search(db, ["策略"])] == [entry.id]
+
+
+def test_save_switches_current_without_leftover_temp_files(db, tmp_path):
+    add_doc(db, "强化学习", "策略 梯度")
+    index = ready_index(tmp_path)
+    add_doc(db, "图像识别", "卷积")
+    index.search(db, ["卷积"])
+    index.save()
+
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+    reloaded = BM25Index(index_dir=str(tmp_path))
+    assert reloaded.load()
+    assert reloaded.base.size == 2
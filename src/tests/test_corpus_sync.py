@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta
+
+import models
+from utils.corpus_sync import corpus_changes
+from utils.corpus_version import bump_corpus_version
+from utils.vector_index import VectorIndex
+
+
+def add_docs(db, n):
+    """n 篇文档，updated_at 依次相隔 1 秒，全部落在回看窗口内"""
+    start = datetime.now().replace(microsecond=0) - timedelta(seconds=n + 10)
+    entries = []
+    for i in range(n):
+        entry = models.KnowledgeBase(
+            title=f"文档 {i}", content=f"机器学习 数据 主题{i}", updated_at=start + timedelta(seconds=i)
+        )
+        db.add(entry)
+        entries.append(entry)
+    bump_corpus_version(db)
+    db.commit()
+    return entries
+
+
+def test_unchanged_rows_in_lag_window_are_not_reread(db):
+    entries = add_docs(db, 10)
+    ids = [e.id for e in entries]
+    watermark, changed, removed, seen = corpus_changes(db, [], None)
+    assert changed == set(ids) and not removed
+
+    watermark, changed, removed, seen = corpus_changes(db, ids, watermark, seen)
+    # 只有与水位同一秒的最后一篇需要重新读取
+    assert changed == {ids[-1]}
+
+    entries[3].title = "修改后的标题"
+    db.commit()
+    _, changed, _, _ = corpus_changes(db, ids, watermark, seen)
+    assert entries[3].id in changed and len(changed) <= 2
+
+
+def test_single_update_folds_into_vector_delta(db, tmp_path):
+    entries = add_docs(db, 20)
+    index = VectorIndex(index_dir=str(tmp_path), dim=0, rebuild_ratio=0.2)
+    index.refresh(db)
+    base_path = index.path
+
+    entries[5].content = "机器学习 数据 数据"
+    bump_corpus_version(db)
+    db.commit()
+    index.refresh(db)
+
+    # 增量折叠而不是全量重建
+    assert index.path == base_path
+    assert entries[5].id in index._delta_ids
@@ -0,0 +1,27 @@
+from sqlalchemy import select
+
+import models
+from database import SessionLocal
+from utils.corpus_version import bump_corpus_version, current_corpus_version
+
+
+def stored_version():
+    with SessionLocal() as other:
+        return other.execute(select(models.CorpusVersion.version)).scalar() or 0
+
+
+def test_version_is_bumped_after_commit_only(db):
+    db.add(models.KnowledgeBase(title="新条目", content=""))
+    bump_corpus_version(db)
+    db.flush()
+    # 写入事务内不触碰版本号行 (不持有它的行锁)
+    assert db.execute(select(models.CorpusVersion.version)).scalar() is None
+    db.commit()
+    assert stored_version() == 1
+    assert current_corpus_version(db) == 1
+
+    db.add(models.KnowledgeBase(title="回滚的条目", content=""))
+    bump_corpus_version(db)
+    db.rollback()
+    db.commit()
+    assert stored_version() == 1
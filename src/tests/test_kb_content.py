@@ -0,0 +1,39 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import models
+from database import get_db
+from routers import db_routes
+from utils.chunking import write_chunks
+from utils.kb_content import load_pages
+
+
+def add_pdf_entry(db, pages):
+    entry = models.KnowledgeBase(title="分页条目", content=None)
+    db.add(entry)
+    db.flush()
+    write_chunks(db, entry.id, pages)
+    db.commit()
+    return entry.id
+
+
+def test_load_pages_stops_once_over_the_cap(db):
+    kb_id = add_pdf_entry(db, [(i, "字" * 100) for i in range(1, 11)])
+    assert [no for no, _ in load_pages(db, kb_id, 2, 4, max_chars=300)] == [2, 3, 4]
+    assert load_pages(db, kb_id, 1, 10, max_chars=250) is None
+
+
+def test_content_route_rejects_large_page_ranges(db, monkeypatch):
+    kb_id = add_pdf_entry(db, [(i, "字" * 100) for i in range(1, 11)])
+    app = FastAPI()
+    app.include_router(db_routes.router)
+    app.dependency_overrides[get_db] = lambda: db
+    client = TestClient(app)
+    monkeypatch.setattr(db_routes, "KB_CONTENT_MAX_PAGES", 5)
+    monkeypatch.setattr(db_routes, "KB_CONTENT_MAX_CHARS", 250)
+
+    url = f"/knowledge/{kb_id}/content"
+    assert client.get(url, params={"page_from": 1, "page_to": 6}).status_code == 400
+    assert client.get(url, params={"page_from": 1, "page_to": 3}).status_code == 400
+    response = client.get(url, params={"page_from": 1, "page_to": 2})
+    assert [p["page_no"] for p in response.json()["pages"]] == [1, 2]
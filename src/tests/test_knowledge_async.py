@@ -0,0 +1,86 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import models
+from routers import db_routes, knowledge_async
+from database import SessionLocal
+from utils.bm25_index import BM25Index
+from utils.corpus_version import bump_corpus_version
+from utils.neighbours import neighbour_table
+from utils.tag_matrix import TagMatrix
+from utils.tagging import tag_resolver
+
+DOCS = [
+    ("深度学习综述", "深度学习 神经网络 图像识别", ["深度学习", "神经网络", "图像"]),
+    ("神经网络优化", "神经网络 梯度 优化 深度学习", ["神经网络", "优化", "深度学习"]),
+    ("图像分割方法", "图像 分割 卷积 神经网络", ["图像", "卷积", "神经网络"]),
+    ("强化学习入门", "强化学习 策略 奖励", ["强化学习", "策略"]),
+    ("卷积网络加速", "卷积 神经网络 硬件 加速", ["卷积", "神经网络", "硬件"]),
+    ("策略梯度方法", "策略 梯度 强化学习 优化", ["策略", "强化学习", "优化"]),
+]
+
+
+@pytest.fixture
+def clients(db, tmp_path, monkeypatch):
+    for i, (title, content, tags) in enumerate(DOCS, start=1):
+        db.add(models.KnowledgeBase(id=i, title=title, content=content, year=2020 + i % 2, category="AI"))
+        db.flush()
+        tag_resolver.attach(db, i, tags)
+    bump_corpus_version(db)
+    db.commit()
+    # 每个测试的库都是新建的，使用新的进程内索引
+    index = BM25Index(index_dir=str(tmp_path / "bm25"))
+    index.warmup(SessionLocal)
+    monkeypatch.setattr(db_routes, "bm25_index", index)
+    monkeypatch.setattr(db_routes, "tag_matrix", TagMatrix())
+
+    sync_app = FastAPI()
+    sync_app.include_router(db_routes.router)
+    async_app = FastAPI()
+    async_app.include_router(knowledge_async.router)
+    return TestClient(sync_app), TestClient(async_app)
+
+
+def same(clients, url, params):
+    sync_client, async_client = clients
+    expected = sync_client.get(url, params=params)
+    actual = async_client.get(url, params=params)
+    assert expected.status_code == actual.status_code == 200
+    assert expected.json() == actual.json()
+    assert expected.headers.get("X-Next-Cursor") == actual.headers.get("X-Next-Cursor")
+    return actual.json()
+
+
+@pytest.mark.parametrize("params", [
+    {"q": "神经网络"},
+    {"q": "神经网络", "limit": 2},
+    {"q": "策略", "year": 2020},
+])
+def test_search_matches_sync_route(clients, params):
+    assert same(clients, "/knowledge/search", params)
+
+
+@pytest.mark.parametrize("params", [
+    {"kb_ids": [1]},
+    {"kb_ids": [1, 4]},
+    {"kb_ids": [2], "exclude": [1]},
+    {"kb_ids": [1, 3], "weights": [2.0, 1.0], "limit": 2},
+])
+def test_recommend_matches_sync_route(clients, params):
+    assert same(clients, "/knowledge/recommend", params)
+
+
+def test_recommend_fallback_matches_sync_route(clients, db):
+    # 近邻表为空时两边都退回实时标签重合度查询
+    db.query(models.KBNeighbour).delete()
+    db.commit()
+    assert same(clients, "/knowledge/recommend", {"kb_ids": [5]})
+
+
+def test_recommend_beyond_neighbour_top_k_uses_live_query(clients, monkeypatch):
+    # 近邻表每篇只保存 top_k 条，更大的 limit 改用实时标签重合度查询 (score 即共同标签数)
+    monkeypatch.setattr(neighbour_table, "top_k", 2)
+    items = same(clients, "/knowledge/recommend", {"kb_ids": [1], "limit": 3})
+    assert len(items) == 3
+    assert all(item["score"] == item["common_tags"] for item in items)
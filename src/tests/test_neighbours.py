@@ -0,0 +1,71 @@
+from sqlalchemy import delete, insert, select
+
+import models
+from utils.neighbours import neighbour_table
+
+# 条目 -> 标签
+FIXTURE = {
+    1: ["a", "b", "c"],
+    2: ["a", "d"],
+    3: ["b", "c", "e"],
+    4: ["a", "c", "e"],
+    5: ["d", "e"],
+    6: ["b", "d"],
+    7: ["a", "b", "e"],
+}
+
+_rel = models.KBTagRelation.__table__
+_nb = models.KBNeighbour.__table__
+
+
+def load_fixture(db):
+    tags = {}
+    for name in sorted({name for names in FIXTURE.values() for name in names}):
+        tag = models.Tag(name=name)
+        db.add(tag)
+        tags[name] = tag
+    for kb_id in FIXTURE:
+        db.add(models.KnowledgeBase(id=kb_id, title=f"文档 {kb_id}", content=""))
+    db.flush()
+    db.execute(insert(_rel), [{"kb_id": kb_id, "tag_id": tags[n].id} for kb_id, names in FIXTURE.items() for n in names])
+    neighbour_table.rebuild(db)
+    db.commit()
+    return {name: tag.id for name, tag in tags.items()}
+
+
+def snapshot(db):
+    return sorted(
+        (row.kb_id, row.neighbour_id, round(row.score, 9), row.common_tags)
+        for row in db.execute(select(_nb))
+    )
+
+
+def test_incremental_refresh_matches_rebuild(db):
+    tags = load_fixture(db)
+    # 1 与 6 交换标签 a / d：N 与各标签的 df 不变，增量结果应与全量重建完全一致
+    db.execute(delete(_rel).where(_rel.c.kb_id == 1, _rel.c.tag_id == tags["a"]))
+    db.execute(delete(_rel).where(_rel.c.kb_id == 6, _rel.c.tag_id == tags["d"]))
+    db.execute(insert(_rel), [{"kb_id": 1, "tag_id": tags["d"]}, {"kb_id": 6, "tag_id": tags["a"]}])
+    neighbour_table.mark(db, [1, 6])
+    db.commit()
+    incremental = snapshot(db)
+
+    neighbour_table.rebuild(db)
+    db.commit()
+    assert incremental == snapshot(db)
+
+
+def test_forget_marks_a_bounded_number_of_entries(db, monkeypatch):
+    load_fixture(db)
+    monkeypatch.setattr(neighbour_table, "forget_limit", 2)
+    neighbour_table.forget(db, 7)
+    assert len(db.info["_kb_neighbours_dirty"]) == 3
+    db.rollback()
+
+
+def test_doc_count_is_cached(db):
+    load_fixture(db)
+    assert neighbour_table._doc_count(db) == len(FIXTURE)
+    db.execute(delete(_rel).where(_rel.c.kb_id == 7))
+    assert neighbour_table._doc_count(db) == len(FIXTURE)
+    db.rollback()
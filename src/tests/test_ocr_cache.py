@@ -0,0 +1,61 @@
+import os
+import time
+
+from utils.ocr_cache import OCRResultCache, sharded_path
+
+DIGESTS = [f"{i:02x}" * 32 for i in range(1, 5)]
+
+
+def make_cache(tmp_path, **kwargs):
+    kwargs.setdefault("max_bytes", 10 ** 9)
+    kwargs.setdefault("max_age", 10 ** 9)
+    return OCRResultCache(
+        str(tmp_path / "uploads"), str(tmp_path / "outputs"),
+        settings={"lang": "ch"}, evict_interval=10 ** 9, **kwargs,
+    )
+
+
+def age(path, seconds):
+    t = time.time() - seconds
+    os.utime(path, (t, t))
+
+
+def test_hit_after_put_and_settings_change_misses(tmp_path):
+    cache = make_cache(tmp_path)
+    assert cache.get(DIGESTS[0]) is None
+    cache.put(DIGESTS[0], "# 第 1 页")
+    assert cache.get(DIGESTS[0]) == "# 第 1 页"
+
+    other = OCRResultCache(cache.upload_root, cache.output_root, settings={"lang": "en"})
+    assert other.get(DIGESTS[0]) is None
+
+
+def test_evicts_least_recently_used_entries_over_size_limit(tmp_path):
+    cache = make_cache(tmp_path, max_bytes=250)
+    for i, digest in enumerate(DIGESTS):
+        cache.put(digest, "x" * 100)
+        age(sharded_path(cache.output_root, digest), 100 - i)
+    # 读取刷新使用时间：最旧的条目变成最新
+    assert cache.get(DIGESTS[0]) is not None
+
+    assert cache.evict() == 2
+    assert [cache.get(d) is not None for d in DIGESTS] == [True, False, False, True]
+
+
+def test_evicts_expired_uploads_and_outputs(tmp_path):
+    cache = make_cache(tmp_path, max_age=3600)
+    for digest in DIGESTS[:2]:
+        tmp = tmp_path / f"{digest}.part"
+        tmp.write_bytes(b"%PDF-1.4")
+        cache.commit_upload(str(tmp), digest, ".pdf")
+        cache.put(digest, "md")
+    age(cache.upload_path(DIGESTS[0], ".pdf"), 7200)
+    age(sharded_path(cache.output_root, DIGESTS[0]), 7200)
+
+    assert cache.evict() == 2
+    assert not os.path.exists(cache.upload_path(DIGESTS[0], ".pdf"))
+    assert cache.get(DIGESTS[0]) is None
+    assert os.path.exists(cache.upload_path(DIGESTS[1], ".pdf"))
+    assert cache.get(DIGESTS[1]) == "md"
+    # 清理后不留下空的分片目录
+    assert not os.path.exists(os.path.dirname(cache.upload_path(DIGESTS[0], ".pdf")))
@@ -0,0 +1,69 @@
+import threading
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from routers import ocr
+from utils.ocr_jobs import OCRJobManager, QueueFullError
+
+
+def wait_done(manager, job_id):
+    for _ in range(500):
+        job = manager.get(job_id)
+        if job is not None and job.finished_at is not None:
+            return job
+        threading.Event().wait(0.01)
+    raise AssertionError("job did not finish")
+
+
+def test_queue_full_rejects_until_a_job_finishes():
+    manager = OCRJobManager(max_workers=1, max_pending=2)
+    release = threading.Event()
+    jobs = [manager.submit(release.wait, 5) for _ in range(2)]
+    assert manager.is_full()
+    with pytest.raises(QueueFullError):
+        manager.submit(lambda: "x")
+
+    release.set()
+    for job in jobs:
+        wait_done(manager, job.id)
+    assert manager.pending == 0
+    assert manager.submit(lambda: "ok") is not None
+    manager.shutdown()
+
+
+def test_finished_jobs_are_pruned_after_ttl():
+    manager = OCRJobManager(max_workers=1, max_pending=4, result_ttl=60)
+    done = wait_done(manager, manager.submit(lambda: "# 结果").id)
+    failed = wait_done(manager, manager.submit(lambda: 1 / 0).id)
+    assert done.to_dict()["markdown"] == "# 结果"
+    assert failed.status == "failed" and "division" in failed.to_dict()["error"]
+
+    # 完成时间早于保留期的任务在下一次访问时清理，未过期的保留
+    done.finished_at -= 120
+    assert manager.get(done.id) is None
+    assert manager.get(failed.id) is failed
+    manager.shutdown()
+
+
+class ReadyOCR:
+    def get(self):
+        return object()
+
+
+def test_jobs_route_returns_429_when_queue_is_full():
+    manager = OCRJobManager(max_workers=1, max_pending=1)
+    release = threading.Event()
+    manager.submit(release.wait, 5)
+
+    app = FastAPI()
+    app.include_router(ocr.router)
+    app.state.ocr = ReadyOCR()
+    app.state.ocr_jobs = manager
+    response = TestClient(app).post("/ocr/jobs", files={"file": ("a.pdf", b"%PDF-1.4", "application/pdf")})
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "10"
+
+    release.set()
+    manager.shutdown()
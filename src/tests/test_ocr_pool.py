@@ -0,0 +1,55 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import ocr_pool
+from utils.ocr_pool import OCREnginePool
+from utils.ocr_service import LocalOCREngine
+
+
+class CountingPipeline:
+    """记录已识别的页数"""
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.predicted = 0
+
+    def predict_iter(self, path):
+        for i in range(self.pages):
+            self.predicted += 1
+            yield type("Result", (), {"markdown": {"markdown_texts": f"第 {i + 1} 页", "markdown_images": {}}})()
+
+    predict = predict_iter
+
+
+class ThreadManager:
+    """用线程版本的 Queue / Event 代替 multiprocessing.Manager"""
+
+    Queue = queue.Queue
+    Event = threading.Event
+
+
+def make_pool(monkeypatch, pipeline):
+    monkeypatch.setattr(ocr_pool, "_engine", LocalOCREngine(pipeline))
+    pool = OCREnginePool.__new__(OCREnginePool)
+    executor = ThreadPoolExecutor(max_workers=1)
+    pool._get_manager = lambda: ThreadManager
+    pool._submit = lambda fn, *args: executor.submit(fn, *args)
+    return pool, executor
+
+
+def test_pool_stream_reads_all_pages(monkeypatch, tmp_path):
+    pool, executor = make_pool(monkeypatch, CountingPipeline(5))
+    assert list(pool.iter_pages("a.pdf", str(tmp_path))) == [f"第 {i} 页" for i in range(1, 6)]
+    executor.shutdown()
+
+
+def test_pool_stream_stops_worker_when_client_disconnects(monkeypatch, tmp_path):
+    pipeline = CountingPipeline(100)
+    pool, executor = make_pool(monkeypatch, pipeline)
+    pages = pool.iter_pages("a.pdf", str(tmp_path))
+    assert next(pages) == "第 1 页"
+    pages.close()
+    executor.shutdown(wait=True)
+    # 工作进程最多领先 OCR_POOL_STREAM_AHEAD 页 (外加正在识别的一页)
+    assert pipeline.predicted <= ocr_pool.OCR_POOL_STREAM_AHEAD + 3
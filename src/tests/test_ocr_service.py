@@ -0,0 +1,162 @@
+import os
+import threading
+
+import fitz
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from routers import ocr
+from utils import ocr_service
+from utils.ocr_cache import OCRResultCache
+from utils.ocr_service import LocalOCREngine, iter_pdf_hybrid_pages, recognize_batch
+
+
+class FakeResult:
+    def __init__(self, text):
+        self.markdown = {"markdown_texts": text, "markdown_images": {}}
+
+
+class FakePipeline:
+    def __init__(self, pages=3):
+        self.pages = pages
+        self.closed = 0
+
+    def predict_iter(self, path):
+        try:
+            for i in range(self.pages):
+                yield FakeResult(f"{path} 第 {i + 1} 页")
+        finally:
+            self.closed += 1
+
+    predict = predict_iter
+
+
+def test_lock_is_not_held_while_a_page_is_being_consumed(tmp_path):
+    engine = LocalOCREngine(FakePipeline())
+    slow = engine.iter_pages("a.pdf", str(tmp_path))
+    assert next(slow) == "a.pdf 第 1 页"
+
+    # 第一个请求停在 yield 处 (客户端还没读取) 时，另一个线程仍可使用模型
+    pages = []
+    worker = threading.Thread(target=lambda: pages.extend(engine.iter_pages("b.pdf", str(tmp_path))))
+    worker.start()
+    worker.join(timeout=5)
+    assert not worker.is_alive()
+    assert pages == ["b.pdf 第 1 页", "b.pdf 第 2 页", "b.pdf 第 3 页"]
+
+    assert list(slow) == ["a.pdf 第 2 页", "a.pdf 第 3 页"]
+
+
+def test_disconnect_closes_predict_iterator(tmp_path):
+    pipeline = FakePipeline()
+    engine = LocalOCREngine(pipeline)
+    pages = engine.iter_pages("a.pdf", str(tmp_path))
+    next(pages)
+    pages.close()
+    assert pipeline.closed == 1
+    assert not engine._lock.locked()
+
+
+def make_pdf(path):
+    doc = fitz.open()
+    page = doc.new_page()
+    page.insert_text((72, 72), "Text layer page with enough visible characters to skip OCR entirely.")
+    doc.new_page()
+    doc.save(path)
+    doc.close()
+
+
+class FakeOCR:
+    def __init__(self, pages):
+        self.pages = pages
+        self.paths = []
+
+    def iter_pages(self, path, output_dir):
+        self.paths.append(path)
+        yield from self.pages
+
+
+def test_hybrid_pages_use_a_private_temp_file(tmp_path):
+    pdf = str(tmp_path / "mixed.pdf")
+    make_pdf(pdf)
+    out = tmp_path / "out"
+    ocr = FakeOCR(["OCR 第 2 页"])
+    pages = list(iter_pdf_hybrid_pages(ocr, pdf, str(out)))
+    assert pages[1] == "OCR 第 2 页"
+    assert pages[0].startswith("Text layer page")
+    assert os.path.basename(ocr.paths[0]) != "scanned_pages.pdf"
+    assert os.listdir(out) == []
+
+
+def test_hybrid_pages_fall_back_when_ocr_returns_fewer_pages(tmp_path):
+    pdf = str(tmp_path / "mixed.pdf")
+    make_pdf(pdf)
+    out = tmp_path / "out"
+    pages = list(iter_pdf_hybrid_pages(FakeOCR([]), pdf, str(out)))
+    assert len(pages) == 2 and pages[1] == ""
+    assert os.listdir(out) == []
+
+
+class FakeBatchResult(FakeResult):
+    def __init__(self, path, text):
+        super().__init__(text)
+        self.input_path = path
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+
+class FakeBatchEngine:
+    """每个文件两页；predict_batch 与 LocalOCREngine 相同，依据 input_path 归属页面"""
+
+    def __init__(self):
+        self.batches = []
+        self.engine = LocalOCREngine(self)
+
+    def predict(self, paths):
+        self.batches.append([os.path.basename(p) for p in paths])
+        for page in (1, 2):
+            for path in paths:
+                yield FakeBatchResult(path, f"{os.path.basename(path)} 第 {page} 页")
+
+    def predict_batch(self, jobs):
+        return self.engine.predict_batch(jobs)
+
+    def get(self):
+        return self
+
+
+def test_batch_routes_pages_by_input_path_and_skips_cached(tmp_path, monkeypatch):
+    monkeypatch.setattr(ocr_service, "OCR_PDF_TEXT_LAYER", False)
+    cache = OCRResultCache(str(tmp_path / "up"), str(tmp_path / "out"), settings={})
+    cache.put("d0", "缓存结果")
+    engine = FakeBatchEngine()
+    items = [("d0", "/x/a.png"), ("d1", "/x/b.png"), ("d2", "/x/c.png"), ("d1", "/x/b.png"), ("d3", "/x/d.png")]
+
+    results = recognize_batch(engine, cache, items, batch_size=2)
+    # 缓存命中与重复的文件不再推理，其余按 batch_size 分组
+    assert engine.batches == [["b.png", "c.png"], ["d.png"]]
+    assert results["d0"] == "缓存结果"
+    assert results["d1"] == "b.png 第 1 页\n\nb.png 第 2 页"
+    assert results["d3"] == "d.png 第 1 页\n\nd.png 第 2 页"
+    assert cache.get("d2") == results["d2"]
+
+
+def test_batch_route_keys_duplicate_filenames(tmp_path, monkeypatch):
+    monkeypatch.setattr(ocr_service, "OCR_PDF_TEXT_LAYER", False)
+    app = FastAPI()
+    app.include_router(ocr.router)
+    app.state.ocr = FakeBatchEngine()
+    app.state.ocr_cache = OCRResultCache(str(tmp_path / "up"), str(tmp_path / "out"), settings={})
+    files = [
+        ("files", ("scan.png", b"\x89PNG one", "image/png")),
+        ("files", ("scan.png", b"\x89PNG two", "image/png")),
+        ("files", ("other.png", b"\x89PNG one", "image/png")),
+    ]
+    response = TestClient(app).post("/ocr/batch", files=files)
+    assert response.status_code == 200
+    body = response.json()
+    assert list(body) == ["scan.png", "scan.png (2)", "other.png"]
+    # 内容相同的文件只推理一次，结果相同
+    assert body["other.png"] == body["scan.png"] != body["scan.png (2)"]
+    assert len(app.state.ocr.batches) == 1 and len(app.state.ocr.batches[0]) == 2
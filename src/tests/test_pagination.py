@@ -0,0 +1,70 @@
+from decimal import Decimal
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import models
+from routers import db_routes
+from database import SessionLocal
+from utils.bm25_index import BM25Index
+from utils.corpus_version import bump_corpus_version
+from utils.pagination import encode_cursor, decode_cursor
+
+
+@pytest.fixture
+def client(db, tmp_path, monkeypatch):
+    # 前 12 篇内容完全相同 (得分并列)，其余得分各不相同，年份交替用于过滤
+    for i in range(1, 31):
+        content = "神经网络" if i <= 12 else "神经网络 " + "优化 " * (i - 12)
+        db.add(models.KnowledgeBase(id=i, title=f"论文{i}", content=content, year=2020 + i % 2, category="AI"))
+    bump_corpus_version(db)
+    db.commit()
+    index = BM25Index(index_dir=str(tmp_path / "bm25"))
+    index.warmup(SessionLocal)
+    monkeypatch.setattr(db_routes, "bm25_index", index)
+
+    app = FastAPI()
+    app.include_router(db_routes.router)
+    return TestClient(app)
+
+
+def page_through(client, params, limit):
+    ids, cursor = [], None
+    while True:
+        resp = client.get("/knowledge/search", params={**params, "limit": limit, **({"cursor": cursor} if cursor else {})})
+        assert resp.status_code == 200
+        ids += [item["id"] for item in resp.json()]
+        cursor = resp.headers.get("X-Next-Cursor")
+        if cursor is None:
+            return ids
+
+
+@pytest.mark.parametrize("params", [{"q": "神经网络"}, {"q": "神经网络", "year": 2021}])
+@pytest.mark.parametrize("limit", [1, 5, 7])
+def test_paging_to_the_end_has_no_duplicates_or_gaps(client, params, limit):
+    expected = [item["id"] for item in client.get("/knowledge/search", params={**params, "limit": 100}).json()]
+    assert len(expected) == (30 if "year" not in params else 15)
+
+    ids = page_through(client, params, limit)
+    assert ids == expected
+    assert len(set(ids)) == len(ids)
+
+
+def test_cursor_round_trip_keeps_exact_score():
+    score = 0.1 + 0.2
+    assert decode_cursor(encode_cursor(score, 7)) == (repr(score), 7)
+    assert float(decode_cursor(encode_cursor(score, 7))[0]) == score
+    # MySQL 的 DECIMAL 分数原样保存
+    assert decode_cursor(encode_cursor(Decimal("12.345600"), 3)) == ("12.345600", 3)
+
+
+@pytest.mark.parametrize("cursor", ["not-a-cursor", encode_cursor("nan", 1)])
+def test_invalid_cursor_is_rejected(client, cursor):
+    assert client.get("/knowledge/search", params={"q": "神经网络", "cursor": cursor}).status_code == 400
+
+
+def test_fulltext_cursor_compares_fixed_point_scores():
+    sql = str(db_routes.fulltext_search_sql([], True))
+    assert "ORDER BY score_key DESC, id ASC" in sql
+    assert "score_key = CAST(:after_score AS DECIMAL(20, 6))" in sql
@@ -0,0 +1,147 @@
+import json
+import os
+import time
+
+import fitz
+import pytest
+
+import models
+import sync_data
+from sync_data import CorpusWatcher, PageSpool, backfill_chunks, store_content
+from utils.kb_content import load_content
+
+
+def test_backfill_chunks_for_rows_without_chunks(db):
+    text = "机器学习 " * 50
+    entry = models.KnowledgeBase(title="旧条目", content=text)
+    db.add(entry)
+    db.commit()
+
+    assert backfill_chunks(db, batch=10) == 1
+    assert db.query(models.KBChunk).filter_by(kb_id=entry.id).count() > 0
+    # 已有文本块的条目不再处理
+    assert backfill_chunks(db, batch=10) == 0
+
+
+def test_store_content_appends_pieces(db, tmp_path):
+    path = tmp_path / "pages.jsonl"
+    spool = PageSpool(str(path))
+    with open(path, "w", encoding="utf-8") as f:
+        for page_no, text in [(1, "第一页"), (2, "第二页"), (3, "第三页")]:
+            f.write(json.dumps([page_no, text], ensure_ascii=False) + "\n")
+    entry = models.KnowledgeBase(title="分段", content=None)
+    db.add(entry)
+    db.flush()
+    store_content(db, entry.id, spool, piece_chars=4)
+    db.commit()
+    assert load_content(db, entry.id) == "".join(text for _, text in spool)
+
+
+def test_watcher_keeps_polling_after_a_failed_batch(tmp_path, monkeypatch):
+    watcher = CorpusWatcher(str(tmp_path), str(tmp_path), interval=0, debounce=0.01)
+    monkeypatch.setattr(sync_data, "sync_papers", lambda *args, **kwargs: None)
+    monkeypatch.setattr(watcher, "poll", lambda: {"p1"})
+    calls = []
+
+    def process(paper_ids, executor=None, workers=1):
+        calls.append(set(paper_ids))
+        if len(calls) == 1:
+            raise RuntimeError("数据库连接断开")
+        if len(calls) == 3:
+            raise KeyboardInterrupt
+
+    monkeypatch.setattr(watcher, "process", process)
+    watcher.run()
+    assert calls == [{"p1"}, {"p1"}, {"p1"}]
+    # 第二次处理成功后清除失败计数
+    assert watcher._failures == {}
+
+
+def test_failed_papers_are_retried_with_backoff(tmp_path):
+    watcher = CorpusWatcher(str(tmp_path), str(tmp_path), debounce=0.05, max_backoff=1)
+    assert watcher.retry_later({"p1"}) == 0.1
+    assert watcher.poll() == set()
+    time.sleep(0.12)
+    assert watcher.poll() == {"p1"}
+    # 连续失败时间隔翻倍，不超过 max_backoff
+    assert watcher.retry_later({"p1"}) == 0.2
+    for _ in range(10):
+        delay = watcher.retry_later({"p1"})
+    assert delay == 1
+
+
+def write_pdf(path, text):
+    doc = fitz.open()
+    page = doc.new_page()
+    page.insert_text((72, 72), text)
+    doc.save(str(path))
+    doc.close()
+
+
+def make_corpus(tmp_path, names):
+    bibs, pdfs = tmp_path / "bibs", tmp_path / "pdfs"
+    bibs.mkdir()
+    pdfs.mkdir()
+    for name in names:
+        write_pdf(pdfs / f"{name}.pdf", f"{name} convolution network training " * 5)
+    return str(bibs), str(pdfs)
+
+
+def test_manifest_skips_unchanged_and_updates_changed_in_place(db, tmp_path):
+    bibs, pdfs = make_corpus(tmp_path, ["alpha", "beta"])
+    sync_data.sync_papers(db, bibs, pdfs)
+    entries = {e.title: e.id for e in db.query(models.KnowledgeBase)}
+    assert set(entries) == {"alpha", "beta"}
+    assert db.query(models.IngestManifest).count() == 2
+
+    # 未变化的语料不产生任何任务
+    assert sync_data.plan_sync(db, bibs, pdfs) == []
+
+    # 内容变化：原地更新同一条目，不新建
+    alpha = os.path.join(pdfs, "alpha.pdf")
+    old_hash = db.query(models.IngestManifest).filter_by(path=alpha).one().content_hash
+    write_pdf(alpha, "transformer attention replaces recurrence " * 5)
+    tasks = sync_data.plan_sync(db, bibs, pdfs)
+    assert [(t["pdf_path"], t["kb_id"]) for t in tasks] == [(alpha, entries["alpha"])]
+    sync_data.sync_papers(db, bibs, pdfs)
+    db.expire_all()
+
+    assert db.query(models.KnowledgeBase).count() == 2
+    assert "transformer" in load_content(db, entries["alpha"])
+    manifest = db.query(models.IngestManifest).filter_by(path=alpha).one()
+    assert manifest.kb_id == entries["alpha"] and manifest.content_hash != old_hash
+    assert sync_data.plan_sync(db, bibs, pdfs) == []
+
+
+def test_mtime_only_change_refreshes_manifest_without_reextracting(db, tmp_path, monkeypatch):
+    bibs, pdfs = make_corpus(tmp_path, ["alpha"])
+    sync_data.sync_papers(db, bibs, pdfs)
+    content = load_content(db, 1)
+
+    alpha = os.path.join(pdfs, "alpha.pdf")
+    os.utime(alpha, (time.time() + 100, time.time() + 100))
+    monkeypatch.setattr(sync_data, "extract_pdf_info", lambda path: pytest.fail("内容未变不应重新提取"))
+    sync_data.sync_papers(db, bibs, pdfs)
+    assert load_content(db, 1) == content
+    assert sync_data.plan_sync(db, bibs, pdfs) == []
+
+
+def test_failed_batch_isolates_the_bad_document(db, tmp_path, monkeypatch):
+    bibs, pdfs = make_corpus(tmp_path, ["alpha", "beta", "gamma"])
+    write_paper = sync_data.write_paper
+    attempts = []
+
+    def failing_write(db, task, *args):
+        if task["title"] == "beta":
+            attempts.append(task["title"])
+            raise RuntimeError("损坏的 PDF")
+        return write_paper(db, task, *args)
+
+    monkeypatch.setattr(sync_data, "write_paper", failing_write)
+    sync_data.sync_papers(db, bibs, pdfs, batch_size=10)
+
+    # 整批重试 retries 次后逐篇提交：其余文档照常入库，失败文档不登记清单
+    assert len(attempts) == sync_data.SYNC_BATCH_RETRIES + 2
+    assert sorted(t for t, in db.query(models.KnowledgeBase.title)) == ["alpha", "gamma"]
+    assert db.query(models.KBChunk).count() > 0
+    assert [t["title"] for t in sync_data.plan_sync(db, bibs, pdfs)] == ["beta"]
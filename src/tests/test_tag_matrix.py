@@ -0,0 +1,92 @@
+import pytest
+from sqlalchemy import delete
+
+import models
+from utils.corpus_version import bump_corpus_version
+from utils.tag_matrix import TagMatrix
+from utils.tagging import tag_resolver
+
+# 条目 -> (标签, 年份, 分类)
+DOCS = {
+    1: (["视觉", "卷积", "分割"], 2020, "CV"),
+    2: (["视觉", "卷积", "检测"], 2021, "CV"),
+    3: (["视觉", "分割"], 2021, "CV"),
+    4: (["语言", "注意力", "翻译"], 2020, "NLP"),
+    5: (["语言", "注意力", "卷积"], 2021, "NLP"),
+    6: (["强化", "策略"], 2020, "RL"),
+    7: (["强化", "策略", "注意力"], 2021, "RL"),
+}
+
+
+@pytest.fixture
+def corpus(db):
+    for kb_id, (tags, year, category) in DOCS.items():
+        db.add(models.KnowledgeBase(id=kb_id, title=f"文档 {kb_id}", content="", year=year, category=category))
+        db.flush()
+        tag_resolver.attach(db, kb_id, tags)
+    bump_corpus_version(db)
+    db.commit()
+    return db
+
+
+def loaded(db, **kwargs):
+    matrix = TagMatrix(**kwargs)
+    matrix.refresh(db)
+    return matrix
+
+
+def ids(hits):
+    return [kb_id for kb_id, _, _ in hits]
+
+
+def test_recommend_weights_exclude_and_filters(corpus):
+    matrix = loaded(corpus)
+    # 1 的近邻：3 (视觉+分割) 优于 2 (视觉+卷积，卷积更常见)
+    assert ids(matrix.recommend(corpus, {1: 1.0}))[:2] == [3, 2]
+    # 权重偏向 4 时，语言类条目排在前面
+    assert ids(matrix.recommend(corpus, {1: 0.1, 4: 5.0}))[0] == 5
+    assert 3 not in ids(matrix.recommend(corpus, {1: 1.0}, exclude=[3]))
+    assert set(ids(matrix.recommend(corpus, {1: 1.0}, year=2021))) <= {2, 3, 5}
+    assert ids(matrix.recommend(corpus, {7: 1.0}, category="RL")) == [6]
+    assert matrix.recommend(corpus, {7: 1.0}, category="不存在") == []
+    # 输入文章本身不出现在结果中，共同标签数按输入篇数累计
+    hits = matrix.recommend(corpus, {1: 1.0, 2: 1.0})
+    assert not {1, 2} & set(ids(hits))
+    assert dict((kb_id, common) for kb_id, _, common in hits)[3] == 3
+
+
+def test_incremental_changes_match_a_fresh_load(corpus, monkeypatch):
+    matrix = loaded(corpus)
+    builds = []
+    monkeypatch.setattr(matrix, "_build", lambda docs: builds.append(docs) or TagMatrix._build(docs))
+
+    # 只改标签 (条目这一行不变)、新增条目、删除条目
+    tag_resolver.attach(corpus, 6, ["视觉"])
+    corpus.add(models.KnowledgeBase(id=8, title="文档 8", content="", year=2021, category="CV"))
+    corpus.flush()
+    tag_resolver.attach(corpus, 8, ["视觉", "分割", "检测"])
+    corpus.execute(delete(models.KBTagRelation).where(models.KBTagRelation.kb_id == 2))
+    corpus.execute(delete(models.KnowledgeBase).where(models.KnowledgeBase.id == 2))
+    bump_corpus_version(corpus)
+    corpus.commit()
+
+    fresh = loaded(corpus)
+    for seeds, kwargs in [({1: 1.0}, {}), ({3: 2.0, 8: 1.0}, {}), ({6: 1.0}, {"year": 2020}), ({1: 1.0}, {"category": "CV"})]:
+        assert matrix.recommend(corpus, seeds, **kwargs) == pytest.approx(fresh.recommend(corpus, seeds, **kwargs))
+    # 变化只进入增量部分，没有重建矩阵
+    assert builds == []
+    assert {2, 6, 8} <= set(matrix._overlay)
+
+
+def test_large_overlay_is_rebuilt_in_background(corpus):
+    matrix = loaded(corpus, overlay_max=1)
+    tag_resolver.attach(corpus, 6, ["视觉"])
+    tag_resolver.attach(corpus, 7, ["分割"])
+    bump_corpus_version(corpus)
+    corpus.commit()
+
+    before = matrix.recommend(corpus, {1: 1.0})
+    matrix._rebuild_thread.join(timeout=30)
+    assert not matrix._overlay
+    assert matrix.recommend(corpus, {1: 1.0}) == pytest.approx(before)
+    assert matrix.recommend(corpus, {1: 1.0}) == pytest.approx(loaded(corpus).recommend(corpus, {1: 1.0}))
@@ -0,0 +1,93 @@
+from sqlalchemy import event
+
+import models
+from database import engine
+from utils.tagging import TagResolver, tag_resolver
+
+
+def add_entries(db, n):
+    for i in range(1, n + 1):
+        db.add(models.KnowledgeBase(id=i, title=f"条目 {i}", content=""))
+    db.flush()
+
+
+def tag_names(db, kb_id):
+    rows = (
+        db.query(models.Tag.name)
+        .join(models.KBTagRelation, models.KBTagRelation.tag_id == models.Tag.id)
+        .filter(models.KBTagRelation.kb_id == kb_id)
+    )
+    return sorted(name for name, in rows)
+
+
+def count_queries(fn):
+    statements = []
+
+    def listener(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        fn()
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    return statements
+
+
+def test_attach_dedups_names_and_batches_tags(db):
+    resolver = TagResolver()
+    add_entries(db, 2)
+    resolver.attach(db, 1, ["深度学习", " 深度学习 ", "", None, "图像", "深度学习"])
+    assert resolver.attach_many(db, [(1, ["图像", "优化"]), (2, ["优化", "优化", "图像"])]) == 4
+    db.commit()
+
+    assert tag_names(db, 1) == ["优化", "图像", "深度学习"]
+    assert tag_names(db, 2) == ["优化", "图像"]
+    assert db.query(models.Tag).count() == 3
+
+
+def test_cache_holds_only_committed_tags(db):
+    # 提交 / 回滚事件只更新共享的 tag_resolver
+    resolver = tag_resolver
+    add_entries(db, 1)
+    resolver.attach(db, 1, ["回滚"])
+    db.rollback()
+    assert "回滚" not in resolver._cache
+
+    created = resolver.resolve(db, ["缓存"])
+    db.commit()
+    assert resolver._cache["缓存"] == created["缓存"]
+    # 已缓存的标签不再查询数据库
+    statements = count_queries(lambda: resolver.resolve(db, ["缓存"]))
+    assert not [s for s in statements if "tags" in s]
+
+
+def test_cache_is_bounded(db, monkeypatch):
+    resolver = tag_resolver
+    monkeypatch.setattr(resolver, "max_size", 2)
+    resolver.resolve(db, ["a", "b", "c"])
+    db.commit()
+    assert list(resolver._cache) == ["b", "c"]
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def all(self):
+        return self.rows
+
+
+class FakeSession:
+    """模拟 MySQL 不区分大小写的排序规则：返回的 name 与请求的写法不同"""
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def execute(self, stmt):
+        return FakeResult(self.rows)
+
+
+def test_select_matches_names_case_insensitively():
+    found = TagResolver()._select(FakeSession([(7, "deep learning"), (8, "CNN")]), ["Deep Learning", "cnn", "rnn"])
+    assert found == {"Deep Learning": 7, "cnn": 8}
@@ -0,0 +1,35 @@
+from fastapi.testclient import TestClient
+
+import main
+from utils import uploads
+
+
+def chunked(body: bytes, size: int = 256):
+    for i in range(0, len(body), size):
+        yield body[i:i + size]
+
+
+def multipart(payload: bytes) -> bytes:
+    return (
+        b"--xx\r\nContent-Disposition: form-data; name=\"file\"; filename=\"a.pdf\"\r\n"
+        b"Content-Type: application/pdf\r\n\r\n" + payload + b"\r\n--xx--\r\n"
+    )
+
+
+def test_chunked_upload_over_limit_is_rejected_while_streaming(monkeypatch):
+    monkeypatch.setattr(uploads, "max_request_bytes", lambda path: 1024)
+    client = TestClient(main.app)
+    # 生成器作为请求体时没有 Content-Length，只能在接收过程中检查
+    response = client.post(
+        "/ocr",
+        content=chunked(multipart(b"%PDF-" + b"0" * 4096)),
+        headers={"Content-Type": "multipart/form-data; boundary=xx"},
+    )
+    assert response.status_code == 413
+
+
+def test_content_length_over_limit_is_rejected_up_front(monkeypatch):
+    monkeypatch.setattr(uploads, "max_request_bytes", lambda path: 1024)
+    client = TestClient(main.app)
+    response = client.post("/ocr", files={"file": ("a.pdf", b"%PDF-" + b"0" * 4096, "application/pdf")})
+    assert response.status_code == 413
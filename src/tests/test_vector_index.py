@@ -0,0 +1,80 @@
+import threading
+
+import numpy as np
+
+import models
+from utils.corpus_version import bump_corpus_version
+from utils.vector_index import VectorIndex
+
+
+def add_doc(db, title, content):
+    entry = models.KnowledgeBase(title=title, content=content)
+    db.add(entry)
+    db.flush()
+    bump_corpus_version(db)
+    db.commit()
+    return entry
+
+
+def test_update_twice_then_save(db, tmp_path):
+    entries = [add_doc(db, f"文档 {i}", f"机器学习 深度学习 主题{i} 数据 {i}") for i in range(5)]
+    index = VectorIndex(index_dir=str(tmp_path), dim=0, rebuild_ratio=10)
+    index.refresh(db)
+
+    target = entries[0]
+    for content in ("机器学习 数据 数据", "深度学习 数据 主题3"):
+        target.content = content
+        bump_corpus_version(db)
+        db.commit()
+        index.refresh(db)
+    # 同一文档在两次落盘之间修改了两次：增量中有它的两行，前一行已标记删除
+    assert index._delta_ids.count(target.id) == 2
+
+    expected = index.doc_vectors([target.id])[0]
+    index.save()
+
+    assert sorted(index.doc_ids.tolist()) == sorted(e.id for e in entries)
+    assert not index.dirty
+    np.testing.assert_allclose(index.doc_vectors([target.id])[0], expected)
+
+    reloaded = VectorIndex(index_dir=str(tmp_path), dim=0)
+    assert reloaded.load()
+    assert sorted(reloaded.doc_ids.tolist()) == sorted(e.id for e in entries)
+
+
+def test_few_changes_never_trigger_a_rebuild(db, tmp_path):
+    entries = [add_doc(db, f"文档 {i}", f"机器学习 数据 主题{i}") for i in range(3)]
+    index = VectorIndex(index_dir=str(tmp_path), dim=0, rebuild_ratio=0, rebuild_min_changes=10)
+    index.refresh(db)
+
+    entries[0].content = "机器学习 数据 数据"
+    bump_corpus_version(db)
+    db.commit()
+    index.refresh(db)
+    assert index._rebuild_thread is None
+    assert entries[0].id in index._delta_ids
+
+
+def test_rebuild_runs_in_background_while_serving_fold_ins(db, tmp_path):
+    entries = [add_doc(db, f"文档 {i}", f"机器学习 数据 主题{i}") for i in range(4)]
+    index = VectorIndex(index_dir=str(tmp_path), dim=0, rebuild_ratio=0.2, rebuild_min_changes=2)
+    index.refresh(db)
+    base_path = index.path
+    # 后台重建等到检查完增量之后再计算
+    release = threading.Event()
+    compute = index._compute
+    index._compute = lambda db: release.wait(30) and compute(db)
+
+    added = [add_doc(db, f"新文档 {i}", "深度学习 数据") for i in range(2)]
+    index.refresh(db)
+    # 本次刷新仍按增量处理，新文档立即可检索
+    assert {e.id for e in added} <= set(index._delta_ids)
+    thread = index._rebuild_thread
+    assert thread is not None
+    release.set()
+    thread.join(timeout=30)
+
+    # 后台重建完成后切换到新索引，增量并入主矩阵
+    assert index.path != base_path
+    assert not index._delta_ids
+    assert sorted(index.doc_ids.tolist()) == sorted(e.id for e in entries + added)
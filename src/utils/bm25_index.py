@@ -0,0 +1,464 @@
+import os
+import re
+import json
+import math
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import jieba
+import numpy as np
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+
+from utils.corpus_version import current_corpus_version
+from utils.corpus_sync import corpus_changes, load_texts
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../"))
+
+# /knowledge/search 的检索后端：mysql (FULLTEXT ngram) | bm25 (进程内倒排索引)
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "mysql")
+# 索引持久化目录 (numpy 文件，以内存映射方式加载)
+BM25_INDEX_DIR = os.getenv("BM25_INDEX_DIR", os.path.join(BASE_DIR, "search_index"))
+BM25_K1 = float(os.getenv("BM25_K1", 1.2))
+BM25_B = float(os.getenv("BM25_B", 0.75))
+# 标题字段的权重，对应 MySQL 检索中的 MATCH(title) * 5
+BM25_TITLE_BOOST = float(os.getenv("BM25_TITLE_BOOST", 5))
+# 增量部分累积多少篇文档后合并进磁盘上的主索引
+BM25_MERGE_THRESHOLD = int(os.getenv("BM25_MERGE_THRESHOLD", 500))
+# 索引尚未就绪 (启动时加载或首次构建中) 时建议客户端的重试间隔 (秒)
+BM25_RETRY_AFTER = int(os.getenv("BM25_RETRY_AFTER", 5))
+
+FIELDS = ("title", "content")
+_FORMAT = 2
+_WORD = re.compile(r"\w")
+_TF_MAX = np.iinfo(np.uint16).max
+
+
+def tokenize(text: str | None) -> list[str]:
+    """jieba 搜索引擎模式分词 (长词同时产出其中的短词)，统一小写并去掉标点"""
+    if not text:
+        return []
+    return [t for t in jieba.cut_for_search(text.lower()) if _WORD.search(t)]
+
+
+def _term_counts(text: str | None) -> tuple[dict[str, int], int]:
+    counts = {}
+    tokens = tokenize(text)
+    for t in tokens:
+        counts[t] = counts.get(t, 0) + 1
+    return counts, len(tokens)
+
+
+class _Segment:
+    """
+    磁盘上的主索引 (只读)：每个字段一组 CSR 结构的倒排表
+    - offsets[i]:offsets[i+1] 为第 i 个词的倒排区间
+    - docs / tfs 为文档序号 (int32) 与词频 (uint16)
+    - fwd_offsets / fwd_terms 为按文档组织的正排 (文档 -> 词序号)，删除文档时用于扣减文档频率
+    数组以 mmap 方式打开，常驻内存的只有词表。
+    """
+
+    def __init__(self, path: str | None = None):
+        self.path = path
+        self.meta = {}
+        self.doc_ids = np.zeros(0, dtype=np.int64)
+        self.lens = {f: np.zeros(0, dtype=np.int32) for f in FIELDS}
+        self.terms = {f: {} for f in FIELDS}
+        self.offsets = {f: np.zeros(1, dtype=np.int64) for f in FIELDS}
+        self.docs = {f: np.zeros(0, dtype=np.int32) for f in FIELDS}
+        self.tfs = {f: np.zeros(0, dtype=np.uint16) for f in FIELDS}
+        self.fwd_offsets = {f: np.zeros(1, dtype=np.int64) for f in FIELDS}
+        self.fwd_terms = {f: np.zeros(0, dtype=np.int32) for f in FIELDS}
+        if path is not None:
+            self._load(path)
+
+    def _load(self, path: str):
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as fh:
+            self.meta = json.load(fh)
+        self.doc_ids = np.load(os.path.join(path, "doc_ids.npy"), mmap_mode="r")
+        for f in FIELDS:
+            self.terms[f] = {t: i for i, t in enumerate(self.meta["terms"][f])}
+            self.lens[f] = np.load(os.path.join(path, f"{f}_lens.npy"), mmap_mode="r")
+            self.offsets[f] = np.load(os.path.join(path, f"{f}_offsets.npy"), mmap_mode="r")
+            self.docs[f] = np.load(os.path.join(path, f"{f}_docs.npy"), mmap_mode="r")
+            self.tfs[f] = np.load(os.path.join(path, f"{f}_tfs.npy"), mmap_mode="r")
+            self.fwd_offsets[f] = np.load(os.path.join(path, f"{f}_fwd_offsets.npy"), mmap_mode="r")
+            self.fwd_terms[f] = np.load(os.path.join(path, f"{f}_fwd_terms.npy"), mmap_mode="r")
+
+    @property
+    def size(self) -> int:
+        return len(self.doc_ids)
+
+    def postings(self, field: str, term: str):
+        idx = self.terms[field].get(term)
+        if idx is None:
+            return None
+        start, end = self.offsets[field][idx], self.offsets[field][idx + 1]
+        return self.docs[field][start:end], self.tfs[field][start:end]
+
+    def doc_terms(self, field: str, doc_no: int) -> list[str]:
+        """文档在该字段中出现过的词"""
+        names = self.meta["terms"][field]
+        start, end = self.fwd_offsets[field][doc_no], self.fwd_offsets[field][doc_no + 1]
+        return [names[i] for i in self.fwd_terms[field][start:end]]
+
+
+class BM25Index:
+    """
+    进程内 BM25 倒排索引 (title + content 两个字段，标题加权)。
+    - 主索引持久化为 numpy 文件并以内存映射加载；新增或修改的文档先进入内存中的增量部分，
+      达到 merge_threshold 篇后与主索引合并并重新落盘
+    - 通过语料版本号感知写入：版本变化时按 updated_at 增量拉取变化的条目，
+      并剔除已从数据库删除的条目，无需全量重建
+    - 加载与首次构建只在后台线程 (warmup) 中进行，完成前检索返回 503
+    """
+
+    def __init__(
+        self,
+        index_dir: str = BM25_INDEX_DIR,
+        k1: float = BM25_K1,
+        b: float = BM25_B,
+        title_boost: float = BM25_TITLE_BOOST,
+        merge_threshold: int = BM25_MERGE_THRESHOLD,
+    ):
+        self.index_dir = index_dir
+        self.k1 = k1
+        self.b = b
+        self.weights = {"title": title_boost, "content": 1.0}
+        self.merge_threshold = merge_threshold
+        self._lock = threading.RLock()
+        # 上次刷新时回看窗口内条目的 updated_at (见 corpus_changes)
+        self._seen = {}
+        self.loaded = False
+        # 完成过一次与数据库的对齐，可以响应检索
+        self.ready = False
+        self._warmup_lock = threading.Lock()
+        self._warmup_thread = None
+        self._reset(_Segment())
+
+    def _reset(self, base: _Segment):
+        self.base = base
+        self.corpus_version = base.meta.get("corpus_version")
+        watermark = base.meta.get("watermark")
+        self.watermark = datetime.fromisoformat(watermark) if watermark else None
+        # kb_id -> 文档序号 (主索引 0..n-1，增量部分从 n 开始)
+        self._doc_nos = {int(kb_id): i for i, kb_id in enumerate(base.doc_ids)}
+        self._deleted: set[int] = set()
+        self._delta_ids: list[int] = []
+        self._delta_lens = {f: [] for f in FIELDS}
+        self._delta_postings = {f: {} for f in FIELDS}
+        # 增量文档各字段中出现过的词 (删除时扣减文档频率)
+        self._delta_terms = {f: [] for f in FIELDS}
+        # 已删除但尚未合并掉的文档在各词上贡献的文档频率
+        self._deleted_df = {f: {} for f in FIELDS}
+        self._total_len = {f: int(np.asarray(base.lens[f], dtype=np.int64).sum()) for f in FIELDS}
+        self._lens_cache = None
+
+    # ---------- 加载 / 持久化 ----------
+
+    def load(self) -> bool:
+        """从磁盘加载最新的主索引，不存在时返回 False"""
+        current = os.path.join(self.index_dir, "CURRENT")
+        if not os.path.exists(current):
+            return False
+        with open(current, encoding="utf-8") as fh:
+            name = fh.read().strip()
+        try:
+            segment = _Segment(os.path.join(self.index_dir, name))
+        except (OSError, ValueError, KeyError) as e:
+            print(f"⚠️ BM25 索引加载失败，将重建: {e}")
+            return False
+        if segment.meta.get("format") != _FORMAT:
+            return False
+        with self._lock:
+            self._reset(segment)
+            self.loaded = True
+        print(f"📚 已加载 BM25 索引: {segment.size} 篇文档")
+        return True
+
+    def save(self):
+        """把增量部分合并进主索引，写入新目录后原子切换 CURRENT"""
+        with self._lock:
+            doc_ids, lens, postings = self._merged_arrays()
+            name = f"seg-{time.time_ns()}"
+            path = os.path.join(self.index_dir, name)
+            os.makedirs(path)
+            meta = {
+                "format": _FORMAT,
+                "corpus_version": self.corpus_version,
+                "watermark": self.watermark.isoformat() if self.watermark else None,
+                "terms": {},
+            }
+            np.save(os.path.join(path, "doc_ids.npy"), doc_ids)
+            for f in FIELDS:
+                terms, offsets, docs, tfs, fwd_offsets, fwd_terms = postings[f]
+                meta["terms"][f] = terms
+                np.save(os.path.join(path, f"{f}_lens.npy"), lens[f])
+                np.save(os.path.join(path, f"{f}_offsets.npy"), offsets)
+                np.save(os.path.join(path, f"{f}_docs.npy"), docs)
+                np.save(os.path.join(path, f"{f}_tfs.npy"), tfs)
+                np.save(os.path.join(path, f"{f}_fwd_offsets.npy"), fwd_offsets)
+                np.save(os.path.join(path, f"{f}_fwd_terms.npy"), fwd_terms)
+            with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as fh:
+                json.dump(meta, fh, ensure_ascii=False)
+
+            # 多个进程可能同时落盘，临时文件名各不相同，切换 CURRENT 是原子的
+            fd, tmp = tempfile.mkstemp(prefix="CURRENT.", suffix=".tmp", dir=self.index_dir)
+            with os.fdopen(fd, "w", encoding="utf-8") as fh:
+                fh.write(name)
+            os.replace(tmp, os.path.join(self.index_dir, "CURRENT"))
+
+            old = self.base.path
+            self._reset(_Segment(path))
+            self.loaded = True
+        if old and os.path.isdir(old):
+            shutil.rmtree(old, ignore_errors=True)
+
+    @property
+    def dirty(self) -> bool:
+        """是否有尚未落盘的增量或删除"""
+        return bool(self._delta_ids or self._deleted)
+
+    def _merged_arrays(self):
+        """主索引 (去掉已删除文档) + 增量部分 -> 新的 CSR 数组，全程向量化"""
+        base = self.base
+        n_base = base.size
+        n_total = n_base + len(self._delta_ids)
+        live = np.ones(n_total, dtype=bool)
+        if self._deleted:
+            live[np.fromiter(self._deleted, dtype=np.int64)] = False
+        # 旧序号 -> 新序号 (删除的文档为 -1)
+        remap = np.full(n_total, -1, dtype=np.int64)
+        remap[live] = np.arange(int(live.sum()))
+
+        all_ids = np.concatenate([np.asarray(base.doc_ids, dtype=np.int64), np.array(self._delta_ids, dtype=np.int64)])
+        doc_ids = all_ids[live]
+        lens = {}
+        postings = {}
+        for f in FIELDS:
+            all_lens = np.concatenate([np.asarray(base.lens[f], dtype=np.int32), np.array(self._delta_lens[f], dtype=np.int32)])
+            lens[f] = all_lens[live]
+
+            vocab = list(base.meta.get("terms", {}).get(f, []))
+            term_ids = dict(base.terms[f])
+            counts = np.diff(np.asarray(base.offsets[f], dtype=np.int64))
+            b_terms = np.repeat(np.arange(len(counts), dtype=np.int64), counts)
+            b_docs = np.asarray(base.docs[f], dtype=np.int64)
+            b_tfs = np.asarray(base.tfs[f], dtype=np.uint16)
+
+            d_terms, d_docs, d_tfs = [], [], []
+            for term, doc_tfs in self._delta_postings[f].items():
+                idx = term_ids.get(term)
+                if idx is None:
+                    idx = term_ids[term] = len(vocab)
+                    vocab.append(term)
+                for doc_no, tf in doc_tfs.items():
+                    d_terms.append(idx)
+                    d_docs.append(doc_no)
+                    d_tfs.append(tf)
+
+            terms_arr = np.concatenate([b_terms, np.array(d_terms, dtype=np.int64)])
+            docs_arr = remap[np.concatenate([b_docs, np.array(d_docs, dtype=np.int64)])]
+            tfs_arr = np.concatenate([b_tfs, np.array(d_tfs, dtype=np.uint16)])
+            keep = docs_arr >= 0
+            terms_arr, docs_arr, tfs_arr = terms_arr[keep], docs_arr[keep], tfs_arr[keep]
+
+            # 去掉已无倒排的词，按 (词, 文档) 排序
+            used = np.bincount(terms_arr, minlength=len(vocab)) > 0
+            term_remap = np.cumsum(used) - 1
+            terms_arr = term_remap[terms_arr]
+            order = np.lexsort((docs_arr, terms_arr))
+            terms_arr, docs_arr, tfs_arr = terms_arr[order], docs_arr[order], tfs_arr[order]
+
+            n_terms = int(used.sum())
+            offsets = np.zeros(n_terms + 1, dtype=np.int64)
+            np.cumsum(np.bincount(terms_arr, minlength=n_terms), out=offsets[1:])
+            # 正排：按 (文档, 词) 排序
+            fwd_order = np.lexsort((terms_arr, docs_arr))
+            fwd_offsets = np.zeros(len(doc_ids) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(docs_arr, minlength=len(doc_ids)), out=fwd_offsets[1:])
+            postings[f] = (
+                [t for t, u in zip(vocab, used) if u],
+                offsets,
+                docs_arr.astype(np.int32),
+                tfs_arr,
+                fwd_offsets,
+                terms_arr[fwd_order].astype(np.int32),
+            )
+        return doc_ids, lens, postings
+
+    # ---------- 增量更新 ----------
+
+    def add_document(self, kb_id: int, title: str | None, content: str | None):
+        """新增或替换一篇文档 (旧版本标记为删除)"""
+        with self._lock:
+            self._remove(kb_id)
+            doc_no = self.base.size + len(self._delta_ids)
+            self._delta_ids.append(kb_id)
+            for f, text in zip(FIELDS, (title, content)):
+                counts, length = _term_counts(text)
+                self._delta_lens[f].append(length)
+                self._total_len[f] += length
+                self._delta_terms[f].append(list(counts))
+                postings = self._delta_postings[f]
+                for term, tf in counts.items():
+                    postings.setdefault(term, {})[doc_no] = min(tf, _TF_MAX)
+            self._doc_nos[kb_id] = doc_no
+            self._lens_cache = None
+
+    def remove_document(self, kb_id: int):
+        with self._lock:
+            self._remove(kb_id)
+
+    def _remove(self, kb_id: int):
+        doc_no = self._doc_nos.pop(kb_id, None)
+        if doc_no is None:
+            return
+        self._deleted.add(doc_no)
+        n_base = self.base.size
+        for f in FIELDS:
+            self._total_len[f] -= int(self._doc_len(f, doc_no))
+            terms = self.base.doc_terms(f, doc_no) if doc_no < n_base else self._delta_terms[f][doc_no - n_base]
+            deleted_df = self._deleted_df[f]
+            for term in terms:
+                deleted_df[term] = deleted_df.get(term, 0) + 1
+
+    def _doc_len(self, field: str, doc_no: int) -> int:
+        n_base = self.base.size
+        if doc_no < n_base:
+            return int(self.base.lens[field][doc_no])
+        return self._delta_lens[field][doc_no - n_base]
+
+    def _all_lens(self):
+        if self._lens_cache is None:
+            self._lens_cache = {
+                f: np.concatenate([
+                    np.asarray(self.base.lens[f], dtype=np.float32),
+                    np.array(self._delta_lens[f], dtype=np.float32),
+                ])
+                for f in FIELDS
+            }
+        return self._lens_cache
+
+    def refresh(self, db: Session):
+        """
+        语料版本号变化时与数据库对齐：剔除已删除的条目，
+        重新索引 updated_at 晚于上次水位 (减去回看窗口) 的条目以及索引中缺失的条目
+        """
+        version = current_corpus_version(db)
+        if self.loaded and version == self.corpus_version:
+            return
+        with self._lock:
+            if self.loaded and version == self.corpus_version:
+                return
+            started = time.monotonic()
+            watermark, changed, removed, seen = corpus_changes(db, self._doc_nos, self.watermark, self._seen)
+            for kb_id in removed:
+                self._remove(kb_id)
+
+            for kb_id, title, text in load_texts(db, changed):
+                self.add_document(kb_id, title, text)
+                if len(self._delta_ids) >= self.merge_threshold:
+                    # 全量构建时分段落盘，控制增量部分的内存 (版本号仍为旧值，中断后会继续补齐)
+                    self.save()
+
+            self.corpus_version = version
+            self.watermark = watermark
+            self._seen = seen
+            self.loaded = True
+            self.ready = True
+            if changed or removed:
+                print(
+                    f"🔄 BM25 索引已刷新: 重新索引 {len(changed)} 篇，移除 {len(removed)} 篇 "
+                    f"({time.monotonic() - started:.2f}s)"
+                )
+            if len(self._delta_ids) >= self.merge_threshold or (self.base.path is None and self._doc_nos):
+                self.save()
+
+    # ---------- 检索 ----------
+
+    def search(self, db: Session, terms, limit: int | None = 20) -> list[tuple[int, float]]:
+        """
+        返回按 BM25 得分降序的 (kb_id, score)，limit 为 None 时返回全部命中，检索前先与数据库对齐。
+        索引尚未就绪时在后台开始加载，本次请求返回 503 + Retry-After
+        """
+        if not self.ready:
+            bind = db.get_bind()
+            self.start_warmup(lambda: Session(bind=bind))
+            raise HTTPException(
+                status_code=503,
+                detail="Search index is loading",
+                headers={"Retry-After": str(BM25_RETRY_AFTER)},
+            )
+        self.refresh(db)
+        tokens = list(dict.fromkeys(t for term in terms for t in tokenize(term)))
+        with self._lock:
+            n_live = len(self._doc_nos)
+            if not tokens or n_live == 0:
+                return []
+            n_base = self.base.size
+            n_total = n_base + len(self._delta_ids)
+            scores = np.zeros(n_total, dtype=np.float32)
+            all_lens = self._all_lens()
+
+            for f in FIELDS:
+                avgdl = max(self._total_len[f] / n_live, 1.0)
+                norm = self.k1 * (1 - self.b + self.b * all_lens[f] / avgdl)
+                for token in tokens:
+                    base_hits = self.base.postings(f, token)
+                    delta_hits = self._delta_postings[f].get(token)
+                    docs_parts, tfs_parts = [], []
+                    if base_hits is not None:
+                        docs_parts.append(np.asarray(base_hits[0], dtype=np.int64))
+                        tfs_parts.append(np.asarray(base_hits[1], dtype=np.float32))
+                    if delta_hits:
+                        docs_parts.append(np.fromiter(delta_hits.keys(), dtype=np.int64, count=len(delta_hits)))
+                        tfs_parts.append(np.fromiter(delta_hits.values(), dtype=np.float32, count=len(delta_hits)))
+                    if not docs_parts:
+                        continue
+                    docs = np.concatenate(docs_parts)
+                    tfs = np.concatenate(tfs_parts)
+                    # 扣除已删除 (尚未合并掉) 的文档
+                    df = len(docs) - self._deleted_df[f].get(token, 0)
+                    if df <= 0:
+                        continue
+                    idf = math.log(1 + (n_live - df + 0.5) / (df + 0.5))
+                    scores[docs] += self.weights[f] * idf * tfs * (self.k1 + 1) / (tfs + norm[docs])
+
+            if self._deleted:
+                scores[np.fromiter(self._deleted, dtype=np.int64)] = 0
+            hits = np.flatnonzero(scores > 0)
+            if limit is not None and len(hits) > limit:
+                hits = hits[np.argpartition(-scores[hits], limit - 1)[:limit]]
+            hits = hits[np.argsort(-scores[hits], kind="stable")]
+
+            base_ids = self.base.doc_ids
+            return [
+                (int(base_ids[d]) if d < n_base else self._delta_ids[d - n_base], float(scores[d]))
+                for d in hits
+            ]
+
+    def start_warmup(self, db_factory):
+        """在后台线程中执行 warmup (已在运行时不重复启动)，返回该线程"""
+        with self._warmup_lock:
+            if self._warmup_thread is None or not self._warmup_thread.is_alive():
+                self._warmup_thread = threading.Thread(target=self.warmup, args=(db_factory,), daemon=True)
+                self._warmup_thread.start()
+            return self._warmup_thread
+
+    def warmup(self, db_factory):
+        """启动时加载磁盘索引并与数据库对齐 (首次使用时全量构建)"""
+        self.load()
+        db = db_factory()
+        try:
+            self.refresh(db)
+        except Exception as e:
+            print(f"⚠️ BM25 索引预热失败: {e}")
+        finally:
+            db.close()
+
+
+bm25_index = BM25Index()
@@ -0,0 +1,76 @@
+import os
+
+from sqlalchemy import insert, delete
+from sqlalchemy.orm import Session
+
+from models import KBChunk
+
+# 每个文本块的目标长度 (字符)
+KB_CHUNK_SIZE = int(os.getenv("KB_CHUNK_SIZE", 1000))
+# 每次批量插入的行数
+KB_CHUNK_INSERT_BATCH = int(os.getenv("KB_CHUNK_INSERT_BATCH", 200))
+
+# 优先在这些字符之后切分，避免把句子截断
+_BREAK_CHARS = "\n。！？；.!?;"
+
+
+def split_text(text: str, size: int = KB_CHUNK_SIZE):
+    """
+    把一段文本切成不超过 size 个字符的块，产出 (块内偏移, 块文本)。
+    在块的后 20% 范围内寻找句末或换行作为切分点。
+    """
+    start = 0
+    length = len(text)
+    while start < length:
+        end = min(start + size, length)
+        if end < length:
+            window_start = start + int(size * 0.8)
+            for i in range(end - 1, window_start - 1, -1):
+                if text[i] in _BREAK_CHARS:
+                    end = i + 1
+                    break
+        chunk = text[start:end]
+        if chunk.strip():
+            yield start, chunk
+        start = end
+
+
+def iter_chunks(pages, size: int = KB_CHUNK_SIZE):
+    """
+    pages 为 (页码, 页面文本) 的可迭代对象 (页码可为 None)，逐页切块，
+    产出 (页码, 全文偏移, 块文本)，整个过程只持有当前页的文本。
+    """
+    doc_offset = 0
+    for page_no, page_text in pages:
+        for offset, chunk in split_text(page_text, size):
+            yield page_no, doc_offset + offset, chunk
+        doc_offset += len(page_text)
+
+
+def write_chunks(db: Session, kb_id: int, pages, size: int = KB_CHUNK_SIZE, batch: int = KB_CHUNK_INSERT_BATCH) -> int:
+    """把条目的文本按页切块后批量写入 knowledge_chunks，返回写入的块数"""
+    return write_chunks_many(db, [(kb_id, pages)], size, batch)
+
+
+def write_chunks_many(db: Session, docs, size: int = KB_CHUNK_SIZE, batch: int = KB_CHUNK_INSERT_BATCH) -> int:
+    """docs 为 (kb_id, pages)：多个条目的文本块合并成同一组 executemany 写入"""
+    stmt = insert(KBChunk.__table__)
+    rows = []
+    total = 0
+    for kb_id, pages in docs:
+        for page_no, offset, chunk in iter_chunks(pages, size):
+            rows.append({"kb_id": kb_id, "page_no": page_no, "offset": offset, "text": chunk})
+            if len(rows) >= batch:
+                db.execute(stmt, rows)
+                total += len(rows)
+                rows = []
+    if rows:
+        db.execute(stmt, rows)
+        total += len(rows)
+    return total
+
+
+def delete_chunks(db: Session, kb_id: int):
+    """删除条目已有的全部文本块"""
+    db.execute(delete(KBChunk.__table__).where(KBChunk.kb_id == kb_id))
+
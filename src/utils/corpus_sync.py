@@ -0,0 +1,67 @@
+import os
+from datetime import timedelta
+
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+
+from models import KnowledgeBase, KBChunk
+
+# 本地索引增量刷新时按 updated_at 回看的秒数，覆盖提交较晚的事务
+INDEX_REFRESH_LAG = int(os.getenv("INDEX_REFRESH_LAG", 60))
+# 从数据库读取正文的批大小
+INDEX_LOAD_BATCH = int(os.getenv("INDEX_LOAD_BATCH", 100))
+
+
+def recent_updates(db: Session, watermark, lag: int = INDEX_REFRESH_LAG) -> dict:
+    """回看窗口 (水位前 lag 秒) 内条目的 {ID: updated_at}，在读取正文之前记录，供下次 corpus_changes 比较"""
+    if watermark is None:
+        return {}
+    since = watermark - timedelta(seconds=lag)
+    return dict(db.execute(select(KnowledgeBase.id, KnowledgeBase.updated_at).where(KnowledgeBase.updated_at >= since)).all())
+
+
+def corpus_changes(db: Session, indexed_ids, watermark, seen=None, lag: int = INDEX_REFRESH_LAG):
+    """
+    对比本地索引与数据库，返回 (新水位, 需要重新索引的 ID, 已删除的 ID, 新的回看窗口记录)：
+    - 索引中缺失的条目需要索引
+    - updated_at 晚于上次水位 (减去回看窗口) 的条目中，只有时间戳与上次记录的 (seen) 不同、
+      或落在上次水位那一秒的条目才需要重新索引，窗口内未变化的条目不会在每次刷新时重复读取
+    调用方保存返回的窗口记录，下次刷新时作为 seen 传入
+    """
+    seen = seen or {}
+    new_watermark = db.execute(select(func.max(KnowledgeBase.updated_at))).scalar()
+    window = recent_updates(db, new_watermark, lag)
+    ids = set(db.scalars(select(KnowledgeBase.id)))
+    indexed_ids = set(indexed_ids)
+
+    removed = indexed_ids - ids
+    changed = ids - indexed_ids
+    if watermark is not None:
+        for kb_id, updated_at in recent_updates(db, watermark, lag).items():
+            # 与上次水位同一秒的更新可能发生在上次刷新之后 (时间戳精度为秒)，总是重新读取
+            if seen.get(kb_id) != updated_at or updated_at >= watermark:
+                changed.add(kb_id)
+    return new_watermark, changed, removed, window
+
+
+def load_texts(db: Session, kb_ids, batch: int = INDEX_LOAD_BATCH):
+    """分批读取 (id, 标题, 正文)；content 为空的条目 (如只存文本块) 用文本块拼接"""
+    kb_ids = sorted(kb_ids)
+    for i in range(0, len(kb_ids), batch):
+        chunk_ids = kb_ids[i:i + batch]
+        rows = db.execute(
+            select(KnowledgeBase.id, KnowledgeBase.title, KnowledgeBase.content)
+            .where(KnowledgeBase.id.in_(chunk_ids))
+        ).all()
+        missing = [r.id for r in rows if r.content is None]
+        chunks = {}
+        if missing:
+            for kb_id, text in db.execute(
+                select(KBChunk.kb_id, KBChunk.text)
+                .where(KBChunk.kb_id.in_(missing))
+                .order_by(KBChunk.kb_id, KBChunk.offset)
+            ):
+                chunks.setdefault(kb_id, []).append(text)
+        for r in rows:
+            text = r.content if r.content is not None else "".join(chunks.get(r.id, []))
+            yield r.id, r.title, text
@@ -0,0 +1,89 @@
+import os
+import threading
+import time
+
+from sqlalchemy import event, insert, select, update
+from sqlalchemy.orm import Session
+
+from models import CorpusVersion
+
+# 读取版本号的缓存时间 (秒)：其他进程 (如 sync_data) 的写入最多延迟这么久被感知，0 表示每次都查询
+CORPUS_VERSION_POLL_SECONDS = float(os.getenv("CORPUS_VERSION_POLL_SECONDS", 1))
+
+# 当前事务中是否递增过版本号，提交后让本进程的缓存立即失效
+_BUMPED_KEY = "_corpus_version_bumped"
+
+_ROW_ID = 1
+_lock = threading.Lock()
+_memo = {"version": None, "checked_at": 0.0}
+
+
+def bump_corpus_version(db: Session):
+    """
+    登记当前事务修改了语料：提交成功后在独立的短事务中把版本号加一 (回滚则不加)。
+    版本号行的行锁只在这条 UPDATE 内持有，并发的写入事务不会因它互相等待到提交为止；
+    读取方在数据提交之后才会看到新版本号，不会用新版本号缓存旧数据
+    """
+    db.info[_BUMPED_KEY] = True
+
+
+def _increment(conn):
+    table = CorpusVersion.__table__
+    result = conn.execute(update(table).where(table.c.id == _ROW_ID).values(version=table.c.version + 1))
+    if result.rowcount == 0:
+        stmt = (
+            insert(table)
+            .prefix_with("IGNORE", dialect="mysql")
+            .prefix_with("OR IGNORE", dialect="sqlite")
+        )
+        conn.execute(stmt, {"id": _ROW_ID, "version": 1})
+
+
+def current_corpus_version(db: Session) -> int:
+    """当前语料版本号，在 CORPUS_VERSION_POLL_SECONDS 内复用上次读取的结果"""
+    now = time.monotonic()
+    with _lock:
+        if _memo["version"] is not None and now - _memo["checked_at"] < CORPUS_VERSION_POLL_SECONDS:
+            return _memo["version"]
+
+    version = db.execute(select(CorpusVersion.version).where(CorpusVersion.id == _ROW_ID)).scalar() or 0
+    with _lock:
+        _memo["version"] = version
+        _memo["checked_at"] = now
+    return version
+
+
+async def current_corpus_version_async(db) -> int:
+    """current_corpus_version 的异步会话版本，共用同一份缓存"""
+    now = time.monotonic()
+    with _lock:
+        if _memo["version"] is not None and now - _memo["checked_at"] < CORPUS_VERSION_POLL_SECONDS:
+            return _memo["version"]
+
+    version = (await db.execute(select(CorpusVersion.version).where(CorpusVersion.id == _ROW_ID))).scalar() or 0
+    with _lock:
+        _memo["version"] = version
+        _memo["checked_at"] = now
+    return version
+
+
+def _forget():
+    with _lock:
+        _memo["version"] = None
+
+
+@event.listens_for(Session, "after_commit")
+def _refresh_after_bump(session):
+    if session.info.pop(_BUMPED_KEY, False):
+        try:
+            with session.get_bind().begin() as conn:
+                _increment(conn)
+        except Exception as e:
+            # 数据已经提交，这里不再抛出；缓存最多延迟到下一次写入才失效
+            print(f"⚠️ 语料版本号递增失败: {e}")
+        _forget()
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_bump(session):
+    session.info.pop(_BUMPED_KEY, None)
@@ -0,0 +1,104 @@
+import os
+
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+
+from models import KnowledgeBase, KBChunk
+
+# 单次读取正文的最大字符数 (接口上限，防止一次取回整个 LONGTEXT)
+KB_CONTENT_MAX_CHARS = int(os.getenv("KB_CONTENT_MAX_CHARS", 200000))
+# 单次按页读取的最大页数
+KB_CONTENT_MAX_PAGES = int(os.getenv("KB_CONTENT_MAX_PAGES", 200))
+
+# 元数据投影：不含 content 的全部列
+KB_META_COLUMNS = (
+    KnowledgeBase.id,
+    KnowledgeBase.title,
+    KnowledgeBase.category,
+    KnowledgeBase.authors,
+    KnowledgeBase.file_path,
+    KnowledgeBase.file_type,
+    KnowledgeBase.year,
+    KnowledgeBase.created_at,
+    KnowledgeBase.updated_at,
+)
+
+
+def get_kb_meta(db: Session, kb_id: int, *columns):
+    """
+    只查询条目的元数据列 (默认 KB_META_COLUMNS，也可指定部分列)，
+    返回 Row，条目不存在时返回 None
+    """
+    columns = columns or KB_META_COLUMNS
+    return db.execute(select(*columns).where(KnowledgeBase.id == kb_id)).first()
+
+
+def load_content(db: Session, kb_id: int, start: int = 0, length: int | None = None) -> str | None:
+    """
+    读取条目正文的字符区间 [start, start + length) (length 为空时读到末尾)。
+    content 列有值时在数据库端截取 (SUBSTR)，只传回需要的部分；
+    content 为空的条目 (只存文本块) 用覆盖该区间的文本块拼接。
+    条目不存在时返回 None。
+    """
+    start = max(start, 0)
+    if length is None:
+        piece = func.substr(KnowledgeBase.content, start + 1)
+    else:
+        piece = func.substr(KnowledgeBase.content, start + 1, max(length, 0))
+    row = db.execute(
+        select(KnowledgeBase.id, piece.label("piece"), KnowledgeBase.content.is_(None).label("empty"))
+        .where(KnowledgeBase.id == kb_id)
+    ).first()
+    if row is None:
+        return None
+    if not row.empty:
+        return row.piece or ""
+
+    end = None if length is None else start + max(length, 0)
+    stmt = (
+        select(KBChunk.offset, KBChunk.text)
+        .where(KBChunk.kb_id == kb_id, KBChunk.offset + func.length(KBChunk.text) > start)
+        .order_by(KBChunk.offset)
+    )
+    if end is not None:
+        stmt = stmt.where(KBChunk.offset < end)
+
+    # 文本块之间被跳过的空白段用空格补齐，保证偏移与全文一致
+    parts = []
+    pos = start
+    for offset, chunk in db.execute(stmt):
+        if offset > pos:
+            parts.append(" " * (offset - pos))
+            pos = offset
+        parts.append(chunk[pos - offset:] if end is None else chunk[pos - offset:end - offset])
+        pos = offset + len(chunk)
+        if end is not None and pos >= end:
+            break
+    return "".join(parts)
+
+
+def load_pages(
+    db: Session, kb_id: int, first_page: int, last_page: int | None = None, max_chars: int | None = None
+) -> list[tuple[int, str]] | None:
+    """
+    按页读取正文 (来自文本块)，返回 [(页码, 页面文本)]，没有页码的条目返回空列表。
+    文本块按游标分批取回，累计超过 max_chars 个字符时立即停止读取并返回 None
+    """
+    last_page = first_page if last_page is None else last_page
+    pages = {}
+    total = 0
+    rows = db.execute(
+        select(KBChunk.page_no, KBChunk.text)
+        .where(KBChunk.kb_id == kb_id, KBChunk.page_no.between(first_page, last_page))
+        .order_by(KBChunk.page_no, KBChunk.offset)
+        .execution_options(yield_per=100)
+    )
+    try:
+        for page_no, chunk in rows:
+            total += len(chunk)
+            if max_chars is not None and total > max_chars:
+                return None
+            pages.setdefault(page_no, []).append(chunk)
+    finally:
+        rows.close()
+    return [(page_no, "".join(chunks)) for page_no, chunks in pages.items()]
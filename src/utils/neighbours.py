@@ -0,0 +1,222 @@
+import heapq
+import math
+import os
+import time
+
+from sqlalchemy import event, select, insert, delete, func, bindparam
+from sqlalchemy.orm import Session
+
+from models import KBTagRelation, KBNeighbour
+
+# 每个条目保存的近邻数
+KB_NEIGHBOURS_TOP_K = int(os.getenv("KB_NEIGHBOURS_TOP_K", 20))
+# 出现在超过该比例条目中的标签区分度很低，计算近邻时忽略 (条目数少于 KB_NEIGHBOURS_MIN_DOCS 时不忽略)
+KB_NEIGHBOURS_MAX_DF = float(os.getenv("KB_NEIGHBOURS_MAX_DF", 0.2))
+KB_NEIGHBOURS_MIN_DOCS = int(os.getenv("KB_NEIGHBOURS_MIN_DOCS", 50))
+# 每次 IN 查询 / 计算的条目数
+KB_NEIGHBOURS_BATCH = int(os.getenv("KB_NEIGHBOURS_BATCH", 500))
+# 有标签的条目数 N (IDF 的分子) 在进程内缓存的秒数，增量刷新不必每次提交都做一次全表 COUNT(DISTINCT)
+KB_NEIGHBOURS_DOC_COUNT_TTL = float(os.getenv("KB_NEIGHBOURS_DOC_COUNT_TTL", 300))
+# 条目标签被清除时，最多重新计算多少个原先以它为近邻的条目 (按原分数从高到低)，其余条目暂少一个近邻，全量重建时补齐
+KB_NEIGHBOURS_FORGET_LIMIT = int(os.getenv("KB_NEIGHBOURS_FORGET_LIMIT", 500))
+
+# 当前事务中标签发生变化的条目，提交前统一刷新近邻
+_DIRTY_KEY = "_kb_neighbours_dirty"
+
+_rel = KBTagRelation.__table__
+_nb = KBNeighbour.__table__
+
+
+def _in_chunks(values, size):
+    values = sorted(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def _top(candidates: dict, k: int):
+    """candidates 为 {id: (score, common)}，按分数降序 (同分按 id 升序) 取前 k 个"""
+    return dict(heapq.nlargest(k, candidates.items(), key=lambda kv: (kv[1][0], -kv[0])))
+
+
+class NeighbourTable:
+    """
+    物化的推荐近邻表 (kb_neighbours)：
+    - 相似度 = 共同标签的 IDF 之和，IDF = ln(1 + N / df)，常见标签权重低
+    - 每个条目保存前 top_k 个近邻；标签写入路径 (TagResolver) 登记变化的条目，
+      事务提交前只重新计算这些条目，并把它们合并进候选条目的近邻列表
+    - N 在进程内缓存 doc_count_ttl 秒，增量结果与全量重建的差异只来自 IDF 的漂移
+    - 全量重建见 rebuild (sync_data --rebuild-neighbours)
+    """
+
+    def __init__(
+        self,
+        top_k: int = KB_NEIGHBOURS_TOP_K,
+        max_df: float = KB_NEIGHBOURS_MAX_DF,
+        min_docs: int = KB_NEIGHBOURS_MIN_DOCS,
+        batch: int = KB_NEIGHBOURS_BATCH,
+        doc_count_ttl: float = KB_NEIGHBOURS_DOC_COUNT_TTL,
+        forget_limit: int = KB_NEIGHBOURS_FORGET_LIMIT,
+    ):
+        self.top_k = top_k
+        self.max_df = max_df
+        self.min_docs = min_docs
+        self.batch = batch
+        self.doc_count_ttl = doc_count_ttl
+        self.forget_limit = forget_limit
+        # (N, 读取时间)
+        self._doc_count_memo = None
+
+    def mark(self, db: Session, kb_ids):
+        """登记标签发生变化的条目 (提交前刷新)"""
+        db.info.setdefault(_DIRTY_KEY, set()).update(kb_ids)
+
+    def forget(self, db: Session, kb_id: int):
+        """条目的标签被清除：删除两个方向的近邻行，原先以它为近邻的条目待重新计算"""
+        affected = db.scalars(
+            select(_nb.c.kb_id)
+            .where(_nb.c.neighbour_id == kb_id)
+            .order_by(_nb.c.score.desc(), _nb.c.kb_id)
+            .limit(self.forget_limit)
+        ).all()
+        db.execute(delete(_nb).where((_nb.c.kb_id == kb_id) | (_nb.c.neighbour_id == kb_id)))
+        self.mark(db, [kb_id, *affected])
+
+    def refresh(self, db: Session, kb_ids) -> int:
+        """重新计算 kb_ids 的近邻列表，并更新以它们为候选的其他条目，返回刷新的条目数"""
+        kb_ids = set(kb_ids)
+        if not kb_ids:
+            return 0
+        n_docs = self._doc_count(db)
+        for chunk in _in_chunks(kb_ids, self.batch):
+            candidates = self._candidates(db, chunk, n_docs)
+            self._replace(db, chunk, candidates)
+            self._merge_reverse(db, kb_ids, chunk, candidates)
+        return len(kb_ids)
+
+    def rebuild(self, db: Session) -> int:
+        """清空并全量重建近邻表 (在调用方的事务内)，返回有标签的条目数"""
+        db.execute(delete(_nb))
+        kb_ids = db.scalars(select(_rel.c.kb_id).distinct()).all()
+        n_docs = len(kb_ids)
+        self._doc_count_memo = (n_docs, time.monotonic())
+        for chunk in _in_chunks(kb_ids, self.batch):
+            self._replace(db, chunk, self._candidates(db, chunk, n_docs))
+        db.info.pop(_DIRTY_KEY, None)
+        return n_docs
+
+    def _doc_count(self, db: Session) -> int:
+        """有标签的条目数，在 doc_count_ttl 秒内复用上次的结果"""
+        now = time.monotonic()
+        memo = self._doc_count_memo
+        if memo is not None and now - memo[1] < self.doc_count_ttl:
+            return memo[0]
+        n_docs = db.execute(select(func.count(func.distinct(_rel.c.kb_id)))).scalar() or 0
+        self._doc_count_memo = (n_docs, now)
+        return n_docs
+
+    def _candidates(self, db: Session, kb_ids, n_docs: int) -> dict:
+        """返回 {kb_id: {候选条目: (分数, 共同标签数)}}，包含所有有共同 (非常见) 标签的条目"""
+        doc_tags = {kb_id: [] for kb_id in kb_ids}
+        for kb_id, tag_id in db.execute(select(_rel.c.kb_id, _rel.c.tag_id).where(_rel.c.kb_id.in_(kb_ids))):
+            doc_tags[kb_id].append(tag_id)
+
+        tag_ids = {tag_id for tags in doc_tags.values() for tag_id in tags}
+        max_df = n_docs * self.max_df if n_docs >= self.min_docs else n_docs
+        idf = {}
+        for chunk in _in_chunks(tag_ids, self.batch):
+            for tag_id, df in db.execute(
+                select(_rel.c.tag_id, func.count()).where(_rel.c.tag_id.in_(chunk)).group_by(_rel.c.tag_id)
+            ):
+                # 只出现在一个条目中的标签不产生近邻
+                if 1 < df <= max_df:
+                    idf[tag_id] = math.log(1 + n_docs / df)
+
+        postings = {}
+        for chunk in _in_chunks(idf, self.batch):
+            for tag_id, kb_id in db.execute(select(_rel.c.tag_id, _rel.c.kb_id).where(_rel.c.tag_id.in_(chunk))):
+                postings.setdefault(tag_id, []).append(kb_id)
+
+        result = {}
+        for kb_id, tags in doc_tags.items():
+            scores = {}
+            for tag_id in tags:
+                weight = idf.get(tag_id)
+                if weight is None:
+                    continue
+                for other in postings[tag_id]:
+                    if other != kb_id:
+                        score, common = scores.get(other, (0.0, 0))
+                        scores[other] = (score + weight, common + 1)
+            result[kb_id] = scores
+        return result
+
+    def _replace(self, db: Session, kb_ids, candidates: dict):
+        """用新的前 K 个近邻替换 kb_ids 的全部近邻行"""
+        db.execute(delete(_nb).where(_nb.c.kb_id.in_(kb_ids)))
+        rows = [
+            {"kb_id": kb_id, "neighbour_id": other, "score": score, "common_tags": common}
+            for kb_id, scores in candidates.items()
+            for other, (score, common) in _top(scores, self.top_k).items()
+        ]
+        if rows:
+            db.execute(insert(_nb), rows)
+
+    def _merge_reverse(self, db: Session, dirty: set, kb_ids, candidates: dict):
+        """把刚计算的条目合并进其候选条目 (及原先以它们为近邻的条目) 的近邻列表"""
+        incoming = {}
+        for kb_id, scores in candidates.items():
+            for other, value in scores.items():
+                if other not in dirty:
+                    incoming.setdefault(other, {})[kb_id] = value
+
+        current = {}
+        for chunk in _in_chunks(kb_ids, self.batch):
+            for row in db.execute(
+                select(_nb.c.kb_id, _nb.c.neighbour_id, _nb.c.score, _nb.c.common_tags)
+                .where(_nb.c.neighbour_id.in_(chunk))
+            ):
+                if row.kb_id not in dirty:
+                    current.setdefault(row.kb_id, {})
+        for chunk in _in_chunks(set(incoming) | set(current), self.batch):
+            for row in db.execute(
+                select(_nb.c.kb_id, _nb.c.neighbour_id, _nb.c.score, _nb.c.common_tags)
+                .where(_nb.c.kb_id.in_(chunk))
+            ):
+                current.setdefault(row.kb_id, {})[row.neighbour_id] = (row.score, row.common_tags)
+
+        stale = []
+        fresh = []
+        for other in set(incoming) | set(current):
+            before = current.get(other, {})
+            merged = {nb: value for nb, value in before.items() if nb not in candidates}
+            merged.update(incoming.get(other, {}))
+            after = _top(merged, self.top_k)
+            for nb, value in before.items():
+                if after.get(nb) != value:
+                    stale.append({"k": other, "n": nb})
+            for nb, (score, common) in after.items():
+                if before.get(nb) != (score, common):
+                    fresh.append({"kb_id": other, "neighbour_id": nb, "score": score, "common_tags": common})
+
+        if stale:
+            db.execute(
+                delete(_nb).where(_nb.c.kb_id == bindparam("k"), _nb.c.neighbour_id == bindparam("n")),
+                stale,
+            )
+        if fresh:
+            db.execute(insert(_nb), fresh)
+
+
+neighbour_table = NeighbourTable()
+
+
+@event.listens_for(Session, "before_commit")
+def _refresh_dirty_neighbours(session):
+    dirty = session.info.pop(_DIRTY_KEY, None)
+    if dirty:
+        neighbour_table.refresh(session, dirty)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_dirty_neighbours(session):
+    session.info.pop(_DIRTY_KEY, None)
@@ -0,0 +1,231 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+
+# 缓存配置 (可通过环境变量覆盖)
+OCR_CACHE_MAX_MB = int(os.getenv("OCR_CACHE_MAX_MB", 4096))
+OCR_CACHE_MAX_AGE_DAYS = float(os.getenv("OCR_CACHE_MAX_AGE_DAYS", 30))
+# 两次淘汰扫描之间的最小间隔 (秒)
+OCR_CACHE_EVICT_INTERVAL = float(os.getenv("OCR_CACHE_EVICT_INTERVAL", 600))
+
+RESULT_FILENAME = "result.md"
+
+
+def sharded_path(root: str, digest: str, suffix: str = "") -> str:
+    """按哈希前缀分两级目录存放，避免单目录文件过多：root/ab/cd/<digest><suffix>"""
+    return os.path.join(root, digest[:2], digest[2:4], f"{digest}{suffix}")
+
+
+def settings_key(settings: dict) -> str:
+    """OCR 参数的稳定摘要，参数变化后旧缓存自然失效"""
+    payload = json.dumps(settings, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:12]
+
+
+class OCRResultCache:
+    """
+    以上传内容 SHA-256 为键的 OCR 结果缓存。
+    - 上传文件保存在 uploaded_files/ab/cd/<sha256>.<ext>
+    - OCR 输出保存在 ocr_outputs/ab/cd/<sha256>/<settings_key>/
+    两个目录都按总大小 (LRU, 以 mtime 计) 和最大存活时间淘汰。
+    """
+
+    def __init__(
+        self,
+        upload_root: str,
+        output_root: str,
+        settings: dict,
+        max_bytes: int = OCR_CACHE_MAX_MB * 1024 * 1024,
+        max_age: float = OCR_CACHE_MAX_AGE_DAYS * 86400,
+        evict_interval: float = OCR_CACHE_EVICT_INTERVAL,
+    ):
+        self.upload_root = upload_root
+        self.output_root = output_root
+        self.settings_key = settings_key(settings)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.evict_interval = evict_interval
+        self._last_evict = 0.0
+        self._evict_lock = threading.Lock()
+
+    def upload_path(self, digest: str, ext: str) -> str:
+        return sharded_path(self.upload_root, digest, ext)
+
+    def output_dir(self, digest: str) -> str:
+        return os.path.join(sharded_path(self.output_root, digest), self.settings_key)
+
+    def commit_upload(self, tmp_path: str, digest: str, ext: str) -> str:
+        """把已写完的临时文件移动到内容寻址路径 (内容相同则复用已有文件)，返回保存路径"""
+        path = self.upload_path(digest, ext)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+            _touch(path)
+            return path
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+        print(f"长期保存上传文件到：{path}")
+        return path
+
+    def get(self, digest: str) -> str | None:
+        result_path = os.path.join(self.output_dir(digest), RESULT_FILENAME)
+        try:
+            with open(result_path, "r", encoding="utf-8") as f:
+                markdown = f.read()
+        except FileNotFoundError:
+            return None
+        _touch(result_path)
+        _touch(sharded_path(self.output_root, digest))
+        return markdown
+
+    def put(self, digest: str, markdown: str):
+        out_dir = self.output_dir(digest)
+        os.makedirs(out_dir, exist_ok=True)
+        result_path = os.path.join(out_dir, RESULT_FILENAME)
+        tmp_path = f"{result_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(markdown)
+        os.replace(tmp_path, result_path)
+        self.maybe_evict()
+
+    def tee_pages(self, digest: str, pages):
+        """
+        逐页透传 OCR 结果，同时追加写入缓存临时文件；
+        全部页面成功输出后才提交缓存，中途失败或客户端断开则丢弃。
+        """
+        out_dir = self.output_dir(digest)
+        os.makedirs(out_dir, exist_ok=True)
+        result_path = os.path.join(out_dir, RESULT_FILENAME)
+        tmp_path = f"{result_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        completed = False
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for i, page in enumerate(pages):
+                    if i:
+                        f.write("\n\n")
+                    f.write(page)
+                    yield page
+            completed = True
+        finally:
+            if completed:
+                os.replace(tmp_path, result_path)
+                self.maybe_evict()
+            elif os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def maybe_evict(self):
+        """距上次淘汰超过 evict_interval 才执行，避免每次请求都扫描目录"""
+        if time.time() - self._last_evict < self.evict_interval:
+            return
+        if not self._evict_lock.acquire(blocking=False):
+            return
+        try:
+            self.evict()
+        finally:
+            self._evict_lock.release()
+
+    def evict(self) -> int:
+        """按年龄和总大小淘汰两个目录中的旧条目，返回删除的条目数"""
+        self._last_evict = time.time()
+        removed = 0
+        for root, entries in (
+            (self.upload_root, _upload_entries(self.upload_root)),
+            (self.output_root, _output_entries(self.output_root)),
+        ):
+            removed += _evict_entries(entries, self.max_bytes, self.max_age)
+            _remove_empty_dirs(root)
+        if removed:
+            print(f"OCR 缓存淘汰 {removed} 个条目")
+        return removed
+
+
+def _touch(path: str):
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+
+def _upload_entries(root: str) -> list[tuple[str, float, int]]:
+    """上传目录的淘汰单位：每个文件 (包括旧版 uuid 命名的文件)，跳过正在写入的 .tmp 目录"""
+    entries = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        if dirpath == root and ".tmp" in dirnames:
+            dirnames.remove(".tmp")
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((path, st.st_mtime, st.st_size))
+    return entries
+
+
+def _output_entries(root: str) -> list[tuple[str, float, int]]:
+    """输出目录的淘汰单位：每个 ab/cd/<digest> 目录，以及根目录下的旧版散落文件"""
+    entries = []
+    if not os.path.isdir(root):
+        return entries
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if os.path.isfile(path):
+            st = os.stat(path)
+            entries.append((path, st.st_mtime, st.st_size))
+        elif len(name) == 2 and os.path.isdir(path):
+            for sub in os.listdir(path):
+                sub_path = os.path.join(path, sub)
+                if not os.path.isdir(sub_path):
+                    continue
+                for digest in os.listdir(sub_path):
+                    entry = os.path.join(sub_path, digest)
+                    if os.path.isdir(entry):
+                        entries.append((entry, os.stat(entry).st_mtime, _dir_size(entry)))
+        elif os.path.isdir(path):
+            # 旧版 save_to_markdown 生成的图片等目录
+            entries.append((path, os.stat(path).st_mtime, _dir_size(path)))
+    return entries
+
+
+def _evict_entries(entries: list[tuple[str, float, int]], max_bytes: int, max_age: float) -> int:
+    now = time.time()
+    removed = 0
+    total = sum(size for _, _, size in entries)
+    # 最久未使用的排在前面
+    for path, mtime, size in sorted(entries, key=lambda e: e[1]):
+        if now - mtime <= max_age and total <= max_bytes:
+            break
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        except OSError as e:
+            print(f"删除缓存失败 {path}: {e}")
+            continue
+        total -= size
+        removed += 1
+    return removed
+
+
+def _remove_empty_dirs(root: str):
+    for dirpath, _, _ in os.walk(root, topdown=False):
+        if dirpath != root and os.path.basename(dirpath) != ".tmp" and not os.listdir(dirpath):
+            try:
+                os.rmdir(dirpath)
+            except OSError:
+                pass
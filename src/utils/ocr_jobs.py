@@ -0,0 +1,123 @@
+import os
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+# 队列配置 (可通过环境变量覆盖)
+OCR_JOB_WORKERS = int(os.getenv("OCR_JOB_WORKERS", 1))
+OCR_JOB_QUEUE_SIZE = int(os.getenv("OCR_JOB_QUEUE_SIZE", 16))
+OCR_JOB_RESULT_TTL = float(os.getenv("OCR_JOB_RESULT_TTL", 3600))
+
+
+class QueueFullError(Exception):
+    """排队 + 运行中的任务数已达上限"""
+
+
+@dataclass
+class OCRJob:
+    id: str
+    filename: str | None = None
+    status: str = "queued"  # queued / running / done / failed
+    markdown: str | None = None
+    error: str | None = None
+    created_at: float = field(default_factory=time.time)
+    started_at: float | None = None
+    finished_at: float | None = None
+
+    def to_dict(self) -> dict:
+        data = {
+            "job_id": self.id,
+            "status": self.status,
+            "filename": self.filename,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if self.status == "done":
+            data["markdown"] = self.markdown
+        if self.status == "failed":
+            data["error"] = self.error
+        return data
+
+
+class OCRJobManager:
+    """
+    后台 OCR 任务队列：有界线程池执行阻塞的推理，
+    排队 + 运行中的任务数超过 max_pending 时拒绝新任务 (背压)。
+    已完成任务的结果保留 result_ttl 秒供轮询。
+    """
+
+    def __init__(
+        self,
+        max_workers: int = OCR_JOB_WORKERS,
+        max_pending: int = OCR_JOB_QUEUE_SIZE,
+        result_ttl: float = OCR_JOB_RESULT_TTL,
+    ):
+        self.max_pending = max_pending
+        self.result_ttl = result_ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ocr-job")
+        self._jobs: dict[str, OCRJob] = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def is_full(self) -> bool:
+        return self._pending >= self.max_pending
+
+    def submit(self, fn, *args, filename: str | None = None) -> OCRJob:
+        """提交任务，fn(*args) 的返回值作为 markdown 结果；队列满时抛出 QueueFullError"""
+        with self._lock:
+            self._prune()
+            if self._pending >= self.max_pending:
+                raise QueueFullError(f"OCR queue is full ({self.max_pending} pending jobs)")
+            job = OCRJob(id=uuid.uuid4().hex, filename=filename)
+            self._jobs[job.id] = job
+            self._pending += 1
+
+        try:
+            self._executor.submit(self._run, job, fn, args)
+        except RuntimeError:
+            # executor 已关闭
+            with self._lock:
+                self._pending -= 1
+                self._jobs.pop(job.id, None)
+            raise
+        return job
+
+    def get(self, job_id: str) -> OCRJob | None:
+        with self._lock:
+            self._prune()
+            return self._jobs.get(job_id)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, job: OCRJob, fn, args):
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            job.markdown = fn(*args)
+            job.status = "done"
+        except Exception as e:
+            print(f"OCR 任务失败 {job.id}: {e}")
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                self._pending -= 1
+
+    def _prune(self):
+        """清理超过保留期的已完成任务 (调用方需持有锁)"""
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished_at is not None and now - job.finished_at > self.result_ttl
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
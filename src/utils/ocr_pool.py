@@ -0,0 +1,162 @@
+import os
+import queue
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from utils.ocr_service import LocalOCREngine
+
+# 进程池配置 (可通过环境变量覆盖)
+# OCR_POOL_SIZE=0 表示不启用进程池，使用进程内单实例
+OCR_POOL_SIZE = int(os.getenv("OCR_POOL_SIZE", 0))
+# 每个工作进程处理多少个任务后重启，抑制长期运行的内存增长
+OCR_POOL_MAX_JOBS_PER_WORKER = int(os.getenv("OCR_POOL_MAX_JOBS_PER_WORKER", 200))
+# 逐页识别时工作进程最多领先客户端几页 (回传队列的容量)
+OCR_POOL_STREAM_AHEAD = int(os.getenv("OCR_POOL_STREAM_AHEAD", 2))
+
+# 工作进程内的引擎实例 (每个进程一个)
+_engine: LocalOCREngine | None = None
+
+
+def _init_worker(pipeline_kwargs: dict):
+    global _engine
+    from paddleocr import PPStructureV3
+
+    _engine = LocalOCREngine(PPStructureV3(**pipeline_kwargs))
+
+
+def _worker_ping() -> int:
+    return os.getpid()
+
+
+def _put(page_queue, item, cancelled) -> bool:
+    """队列已满时等待主进程取走，主进程取消 (客户端断开) 时放弃并返回 False"""
+    while not cancelled.is_set():
+        try:
+            page_queue.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _worker_iter_pages(upload_path: str, output_dir: str, page_queue, cancelled) -> int:
+    """
+    在工作进程中逐页识别，每页通过有界队列回传给主进程：
+    队列满时暂停识别，cancelled 被设置后停止识别剩余页面
+    """
+    count = 0
+    pages = _engine.iter_pages(upload_path, output_dir)
+    try:
+        for page in pages:
+            if not _put(page_queue, ("page", page), cancelled):
+                break
+            count += 1
+    finally:
+        pages.close()
+        _put(page_queue, ("end", None), cancelled)
+    return count
+
+
+def _worker_predict_batch(jobs: list[tuple[str, str]]) -> dict[str, list[str]]:
+    return _engine.predict_batch(jobs)
+
+
+class OCREnginePool:
+    """
+    多进程 OCR 引擎池：每个工作进程持有独立的 PPStructureV3 实例。
+    - 任务分派给当前在途任务最少的进程
+    - 每个进程处理 max_jobs_per_worker 个任务后自动重启 (重新加载模型)
+    与 LocalOCREngine 提供相同的 iter_pages / predict_batch 接口。
+    """
+
+    def __init__(
+        self,
+        size: int,
+        pipeline_kwargs: dict,
+        max_jobs_per_worker: int = OCR_POOL_MAX_JOBS_PER_WORKER,
+    ):
+        # 不能用 fork：paddle 在父进程中初始化过的状态无法安全继承
+        ctx = multiprocessing.get_context("spawn")
+        self.parallelism = size
+        self._workers = [
+            ProcessPoolExecutor(
+                max_workers=1,
+                mp_context=ctx,
+                initializer=_init_worker,
+                initargs=(pipeline_kwargs,),
+                max_tasks_per_child=max_jobs_per_worker or None,
+            )
+            for _ in range(size)
+        ]
+        self._load = [0] * size
+        self._lock = threading.Lock()
+        self._manager = None
+        self._ctx = ctx
+
+    def warmup(self):
+        """让每个工作进程提前启动并加载模型，返回可等待的 future 列表"""
+        return [worker.submit(_worker_ping) for worker in self._workers]
+
+    def _submit(self, fn, *args):
+        with self._lock:
+            idx = min(range(len(self._workers)), key=lambda i: self._load[i])
+            self._load[idx] += 1
+        try:
+            future = self._workers[idx].submit(fn, *args)
+        except Exception:
+            self._release(idx)
+            raise
+        future.add_done_callback(lambda _: self._release(idx))
+        return future
+
+    def _release(self, idx: int):
+        with self._lock:
+            self._load[idx] -= 1
+
+    def _get_manager(self):
+        with self._lock:
+            if self._manager is None:
+                self._manager = self._ctx.Manager()
+            return self._manager
+
+    def iter_pages(self, upload_path: str, output_dir: str):
+        """
+        逐页产出 markdown：工作进程每识别完一页就经由有界队列送回，最多领先 OCR_POOL_STREAM_AHEAD 页；
+        调用方提前关闭生成器 (客户端断开) 时通知工作进程停止，并丢弃已排队的页面
+        """
+        manager = self._get_manager()
+        page_queue = manager.Queue(maxsize=OCR_POOL_STREAM_AHEAD)
+        cancelled = manager.Event()
+        future = self._submit(_worker_iter_pages, upload_path, output_dir, page_queue, cancelled)
+        try:
+            while True:
+                try:
+                    kind, page = page_queue.get(timeout=1)
+                except queue.Empty:
+                    # 工作进程异常退出时不会发送结束标记
+                    if future.done():
+                        future.result()
+                        break
+                    continue
+                if kind == "end":
+                    break
+                yield page
+            # 把工作进程中的异常抛给调用方
+            future.result()
+        finally:
+            cancelled.set()
+            while True:
+                try:
+                    page_queue.get_nowait()
+                except queue.Empty:
+                    break
+
+    def predict_batch(self, jobs: list[tuple[str, str]]) -> dict[str, list[str]]:
+        return self._submit(_worker_predict_batch, jobs).result()
+
+    def close(self):
+        for worker in self._workers:
+            worker.shutdown(wait=False, cancel_futures=True)
+        if self._manager is not None:
+            self._manager.shutdown()
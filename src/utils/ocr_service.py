@@ -0,0 +1,382 @@
+import os
+import glob
+import shutil
+import time
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import fitz  # PyMuPDF
+from fastapi import HTTPException, UploadFile
+
+# 使用相对于当前文件 (src/utils/ocr_service.py) 的相对路径 ../../
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../"))
+UPLOAD_ROOT = os.path.join(BASE_DIR, "uploaded_files")
+OUTPUT_ROOT = os.path.join(BASE_DIR, "ocr_outputs")
+
+# PPStructureV3 的初始化参数 (main.py 的 lifespan 及 OCR 进程池中使用)
+OCR_PIPELINE_KWARGS = {
+    "use_doc_orientation_classify": False,
+    "use_doc_unwarping": False,
+}
+
+# PDF 文本层快速通道：有可用文本层的页面直接抽取文字，只有扫描页才走 PPStructureV3
+OCR_PDF_TEXT_LAYER = os.getenv("OCR_PDF_TEXT_LAYER", "1") == "1"
+# 一页至少包含多少个有效字符才认为文本层可用
+OCR_TEXT_LAYER_MIN_CHARS = int(os.getenv("OCR_TEXT_LAYER_MIN_CHARS", 50))
+
+# 影响输出结果的全部参数，作为 OCR 结果缓存键的一部分
+OCR_CACHE_SETTINGS = {
+    **OCR_PIPELINE_KWARGS,
+    "pdf_text_layer": OCR_PDF_TEXT_LAYER,
+    "text_layer_min_chars": OCR_TEXT_LAYER_MIN_CHARS,
+}
+
+KNOWN_EXTS = [".pdf", ".png", ".jpg", ".jpeg", ".bmp", ".webp", ".tif", ".tiff"]
+
+CONTENT_TYPE_EXTS = {
+    "application/pdf": ".pdf",
+    "image/png": ".png",
+    "image/jpeg": ".jpg",
+    "image/bmp": ".bmp",
+    "image/webp": ".webp",
+    "image/tiff": ".tiff",
+}
+
+# 模型加载方式：eager 启动时同步加载 / background 启动后后台加载 / lazy 首次使用时加载
+OCR_LOAD_MODE = os.getenv("OCR_LOAD_MODE", "background").lower()
+# 模型未就绪时建议客户端的重试间隔 (秒)
+OCR_RETRY_AFTER = int(os.getenv("OCR_RETRY_AFTER", 15))
+
+# 批量 OCR：每次送入 PPStructureV3 的文件数，以及单次请求允许的最大文件数
+OCR_BATCH_SIZE = int(os.getenv("OCR_BATCH_SIZE", 4))
+OCR_BATCH_MAX_FILES = int(os.getenv("OCR_BATCH_MAX_FILES", 50))
+
+def detect_ext(file: UploadFile) -> str:
+    """根据文件名或 Content-Type 判断扩展名，不支持时抛出 415"""
+    name = (file.filename or "").lower()
+    ct = (file.content_type or "").lower()
+
+    for ext in KNOWN_EXTS:
+        if name.endswith(ext):
+            return ext
+
+    if ct in CONTENT_TYPE_EXTS:
+        return CONTENT_TYPE_EXTS[ct]
+
+    raise HTTPException(status_code=415, detail="Unsupported file type")
+
+
+def page_markdown(res, output_dir: str) -> str:
+    """
+    直接从 PPStructureV3 的单页结果对象中取出 markdown，
+    页面中引用的图片保存到 output_dir，保证 markdown 里的相对路径可用。
+    """
+    md_info = getattr(res, "markdown", None)
+    if md_info is None:
+        # 旧版本结果对象没有 markdown 属性：写入本次请求私有的临时目录再读回
+        with tempfile.TemporaryDirectory(dir=output_dir) as tmp_dir:
+            res.save_to_markdown(save_path=tmp_dir)
+            parts = []
+            for md_file in sorted(glob.glob(os.path.join(tmp_dir, "*.md"))):
+                with open(md_file, "r", encoding="utf-8") as f:
+                    parts.append(f.read())
+            # 图片等附属文件保留在结果目录中
+            shutil.copytree(tmp_dir, output_dir, dirs_exist_ok=True, ignore=shutil.ignore_patterns("*.md"))
+            return "\n\n".join(parts)
+
+    for rel_path, image in (md_info.get("markdown_images") or {}).items():
+        image_path = os.path.join(output_dir, rel_path)
+        os.makedirs(os.path.dirname(image_path), exist_ok=True)
+        image.save(image_path)
+    return md_info.get("markdown_texts", "")
+
+
+class LocalOCREngine:
+    """
+    进程内的单个 PPStructureV3 实例。
+    同一个实例不是线程安全的，所有推理串行化。
+    """
+
+    parallelism = 1
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self._lock = threading.Lock()
+
+    def iter_pages(self, upload_path: str, output_dir: str):
+        """
+        逐页执行 OCR，每识别完一页就产出该页的 markdown。
+        优先使用 predict_iter，内存中同一时刻只保留一页的结果。
+        锁只在推理每一页时持有，产出结果 (等待客户端读取) 期间不占用模型，
+        客户端断开 (GeneratorExit) 时在 finally 中关闭推理迭代器。
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        predict = getattr(self.pipeline, "predict_iter", self.pipeline.predict)
+
+        with self._lock:
+            results = iter(predict(upload_path))
+        try:
+            while True:
+                with self._lock:
+                    res = next(results, None)
+                if res is None:
+                    return
+                yield page_markdown(res, output_dir)
+        finally:
+            close = getattr(results, "close", None)
+            if close is not None:
+                with self._lock:
+                    close()
+
+    def predict_batch(self, jobs: list[tuple[str, str]]) -> dict[str, list[str]]:
+        """jobs 为 [(upload_path, output_dir), ...]，一次性作为列表输入推理，返回 {upload_path: [每页 markdown]}"""
+        output_dirs = dict(jobs)
+        pages: dict[str, list[str]] = {}
+        for upload_path, output_dir in jobs:
+            os.makedirs(output_dir, exist_ok=True)
+            pages[upload_path] = []
+
+        with self._lock:
+            for res in self.pipeline.predict([path for path, _ in jobs]):
+                # 多页 PDF 的各页结果按顺序连续产出，依据 input_path 归属到对应文件
+                upload_path = res["input_path"]
+                pages[upload_path].append(page_markdown(res, output_dirs[upload_path]))
+        return pages
+
+    def close(self):
+        self.pipeline = None
+
+
+class OCREngineHandle:
+    """
+    OCR 引擎的延迟加载句柄：模型在后台线程中构建 (或首次使用时触发)，
+    未就绪时 get() 抛出带 Retry-After 的 503，供 /ocr 路由与 /ready 探针使用。
+    """
+
+    def __init__(self, factory, mode: str = OCR_LOAD_MODE):
+        self.factory = factory
+        self.mode = mode
+        self.state = "pending"  # pending / loading / ready / failed
+        self.error: str | None = None
+        self.engine = None
+        self.started_at: float | None = None
+        self.ready_at: float | None = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """按配置的方式开始加载；eager 模式会阻塞到加载完成"""
+        if self.mode == "eager":
+            self._load()
+        elif self.mode == "background":
+            self._start_background()
+
+    def _start_background(self):
+        with self._lock:
+            if self.state not in ("pending", "failed"):
+                return
+            self.state = "loading"
+        threading.Thread(target=self._load, name="ocr-loader", daemon=True).start()
+
+    def _load(self):
+        self.state = "loading"
+        self.started_at = time.time()
+        try:
+            self.engine = self.factory()
+        except Exception as e:
+            print(f"OCR 模型加载失败: {e}")
+            self.error = str(e)
+            self.state = "failed"
+            return
+        self.error = None
+        self.ready_at = time.time()
+        self.state = "ready"
+        print(f"OCR 模型加载完成，用时 {self.ready_at - self.started_at:.1f}s")
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    @property
+    def parallelism(self) -> int:
+        return getattr(self.engine, "parallelism", 1)
+
+    def get(self):
+        if self.state == "ready":
+            return self.engine
+        if self.mode == "lazy" or self.state == "failed":
+            # 首次使用 (或上次加载失败) 时在后台开始加载，本次请求先返回 503
+            self._start_background()
+        raise HTTPException(
+            status_code=503,
+            detail=f"OCR model is {self.state}",
+            headers={"Retry-After": str(OCR_RETRY_AFTER)},
+        )
+
+    def status(self) -> dict:
+        data = {"status": self.state, "mode": self.mode}
+        if self.ready_at is not None:
+            data["load_seconds"] = round(self.ready_at - self.started_at, 1)
+        if self.error:
+            data["error"] = self.error
+        return data
+
+    def close(self):
+        if self.engine is not None:
+            self.engine.close()
+        self.engine = None
+        self.state = "pending"
+
+
+def _text_layer_markdown(page) -> str | None:
+    """抽取页面文本层并按文本块组织成段落；文本层缺失或不可用 (乱码、过短) 时返回 None"""
+    blocks = page.get_text("blocks", sort=True)
+    paragraphs = [b[4].strip() for b in blocks if b[6] == 0 and b[4].strip()]
+    text = "\n\n".join(paragraphs)
+
+    visible = sum(1 for ch in text if not ch.isspace())
+    if visible < OCR_TEXT_LAYER_MIN_CHARS:
+        return None
+    # 字体缺少 ToUnicode 映射时抽出的是替换字符，这种文本层不可用
+    if text.count("\ufffd") > visible * 0.1:
+        return None
+    return text
+
+
+def iter_pdf_hybrid_pages(ocr, upload_path: str, output_dir: str):
+    """
+    混合模式逐页处理 PDF：有可用文本层的页面直接抽取文字，
+    其余页面抽出为一个子 PDF 交给 OCR 引擎，最终按原页码顺序合并输出。
+    OCR 结果页数少于扫描页时，缺少的页面退回该页原始的文本层 (可能为空)。
+    """
+    doc = fitz.open(upload_path)
+    try:
+        page_texts = [_text_layer_markdown(page) for page in doc]
+        scanned = [i for i, text in enumerate(page_texts) if text is None]
+
+        if len(scanned) == len(page_texts):
+            # 纯扫描件，整份交给 OCR
+            doc.close()
+            yield from ocr.iter_pages(upload_path, output_dir)
+            return
+
+        fallback = {i: doc[i].get_text().strip() for i in scanned}
+        scanned_path = None
+        if scanned:
+            os.makedirs(output_dir, exist_ok=True)
+            # 每次请求使用独立的临时文件，同一结果目录的并发请求互不覆盖
+            fd, scanned_path = tempfile.mkstemp(prefix="scanned-", suffix=".pdf", dir=output_dir)
+            os.close(fd)
+            sub_doc = fitz.open()
+            try:
+                for i in scanned:
+                    sub_doc.insert_pdf(doc, from_page=i, to_page=i)
+                sub_doc.save(scanned_path)
+            except BaseException:
+                os.remove(scanned_path)
+                raise
+            finally:
+                sub_doc.close()
+        print(f"PDF 文本层快速通道：{len(page_texts) - len(scanned)}/{len(page_texts)} 页直接抽取")
+    finally:
+        if not doc.is_closed:
+            doc.close()
+
+    ocr_pages = ocr.iter_pages(scanned_path, output_dir) if scanned_path is not None else iter(())
+    try:
+        # 子 PDF 的 OCR 结果与扫描页一一对应、顺序一致
+        for i, text in enumerate(page_texts):
+            if text is None:
+                text = next(ocr_pages, None)
+                if text is None:
+                    text = fallback[i]
+            yield text
+    finally:
+        close = getattr(ocr_pages, "close", None)
+        if close is not None:
+            close()
+        if scanned_path is not None:
+            os.remove(scanned_path)
+
+
+def iter_document_pages(ocr, upload_path: str, output_dir: str):
+    """按文件类型选择处理方式，逐页产出 markdown"""
+    if OCR_PDF_TEXT_LAYER and upload_path.lower().endswith(".pdf"):
+        return iter_pdf_hybrid_pages(ocr, upload_path, output_dir)
+    return ocr.iter_pages(upload_path, output_dir)
+
+
+def run_ocr(ocr, upload_path: str, output_dir: str) -> str:
+    """
+    对已保存的文件执行 OCR，返回拼接后的 markdown。
+    该函数是阻塞的，需在线程池中调用，不能直接在事件循环里执行。
+    """
+    return "\n\n".join(iter_document_pages(ocr, upload_path, output_dir))
+
+
+def recognize(ocr, cache, digest: str, upload_path: str) -> str:
+    """带缓存的 OCR：相同内容 + 相同参数直接返回已有结果 (阻塞调用)"""
+    cached = cache.get(digest)
+    if cached is not None:
+        return cached
+
+    markdown_content = run_ocr(ocr, upload_path, cache.output_dir(digest))
+    cache.put(digest, markdown_content)
+    return markdown_content
+
+
+def stream_pages(ocr, cache, digest: str, upload_path: str):
+    """带缓存的逐页 OCR：命中缓存时整篇作为一页返回，否则边识别边写缓存"""
+    cached = cache.get(digest)
+    if cached is not None:
+        yield cached
+        return
+
+    pages = iter_document_pages(ocr, upload_path, cache.output_dir(digest))
+    yield from cache.tee_pages(digest, pages)
+
+
+def recognize_batch(ocr, cache, items: list[tuple[str, str]], batch_size: int = OCR_BATCH_SIZE) -> dict[str, str]:
+    """
+    批量 OCR：items 为 [(digest, upload_path), ...]，返回 {digest: markdown}。
+    缓存命中的文件直接返回；其余去重后按 batch_size 分组，
+    每组作为一个列表输入交给 PPStructureV3 做批量推理。
+    """
+    batch_size = max(batch_size, 1)
+    results: dict[str, str] = {}
+    pending: dict[str, str] = {}
+    for digest, upload_path in items:
+        if digest in results or digest in pending:
+            continue
+        cached = cache.get(digest)
+        if cached is not None:
+            results[digest] = cached
+        else:
+            pending[digest] = upload_path
+
+    # 启用文本层快速通道时 PDF 逐个走混合模式，图片分组批量推理
+    todo = []
+    for digest, upload_path in pending.items():
+        if OCR_PDF_TEXT_LAYER and upload_path.lower().endswith(".pdf"):
+            results[digest] = recognize(ocr, cache, digest, upload_path)
+        else:
+            todo.append((digest, upload_path))
+    chunks = [todo[i:i + batch_size] for i in range(0, len(todo), batch_size)]
+
+    def _run_chunk(chunk: list[tuple[str, str]]):
+        pages = ocr.predict_batch([(path, cache.output_dir(digest)) for digest, path in chunk])
+        for digest, upload_path in chunk:
+            markdown_content = "\n\n".join(pages[upload_path])
+            cache.put(digest, markdown_content)
+            results[digest] = markdown_content
+
+    # 多进程引擎池可同时处理多组，进程内单实例则逐组执行
+    workers = min(max(getattr(ocr, "parallelism", 1), 1), len(chunks))
+    if workers <= 1:
+        for chunk in chunks:
+            _run_chunk(chunk)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(_run_chunk, chunks))
+
+    return results
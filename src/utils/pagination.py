@@ -0,0 +1,36 @@
+import base64
+import json
+from decimal import Decimal
+
+# MySQL 全文检索分数按 DECIMAL(20, 6) 比较和排序，游标里保存同样精度的定点数字符串
+SCORE_SCALE = 6
+
+
+def encode_cursor(score, kb_id: int) -> str:
+    """
+    把 (score, id) 编码为不透明的游标字符串。
+    score 以字符串保存：float 用 repr (可精确还原)，DECIMAL 列读出的 Decimal 原样保存，
+    避免经过 JSON 浮点数后与数据库中的值不再相等。
+    """
+    score = repr(score) if isinstance(score, float) else str(score)
+    raw = json.dumps([score, int(kb_id)], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[str, int]:
+    """解析游标，返回 (分数字符串, id)，格式不对时抛出 ValueError；兼容旧版数字格式的分数"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        score, kb_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        score = str(score)
+        if not Decimal(score).is_finite():
+            raise ValueError(score)
+        return score, int(kb_id)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def cursor_sort_key(cursor: tuple[str, int]) -> tuple[float, int]:
+    """游标在 (score DESC, id ASC) 排序下的排序键 (-score, id)，用于在已排序的命中列表中二分定位"""
+    score, kb_id = cursor
+    return -float(score), kb_id
@@ -0,0 +1,213 @@
+import os
+import re
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from utils.cache import LRUCache
+
+# 翻译后端：google (在线) | dict (离线双语词典) | none (不翻译)
+QUERY_EXPANSION_BACKEND = os.getenv("QUERY_EXPANSION_BACKEND", "google")
+# 离线词典路径：每行 "词<TAB>译文[<TAB>译文...]"，双向查询
+QUERY_EXPANSION_DICT = os.getenv("QUERY_EXPANSION_DICT", "")
+# 是否用 WordNet 同义词扩展英文检索词
+QUERY_EXPANSION_WORDNET = os.getenv("QUERY_EXPANSION_WORDNET", "1") == "1"
+# 扩展结果缓存：容量与有效期 (秒)；翻译失败的结果只缓存较短时间
+QUERY_EXPANSION_CACHE_SIZE = int(os.getenv("QUERY_EXPANSION_CACHE_SIZE", 2048))
+QUERY_EXPANSION_TTL = float(os.getenv("QUERY_EXPANSION_TTL", 3600))
+QUERY_EXPANSION_FAILURE_TTL = float(os.getenv("QUERY_EXPANSION_FAILURE_TTL", 60))
+# 检索等待扩展的最长时间 (毫秒)，超时后只用已得到的检索词
+QUERY_EXPANSION_BUDGET_MS = int(os.getenv("QUERY_EXPANSION_BUDGET_MS", 300))
+QUERY_EXPANSION_WORKERS = int(os.getenv("QUERY_EXPANSION_WORKERS", 4))
+
+_CJK = re.compile(r'[\u4e00-\u9fa5]')
+
+
+def is_chinese(text: str) -> bool:
+    return bool(_CJK.search(text))
+
+
+class GoogleTranslatorBackend:
+    """在线翻译 (deep_translator)，网络不可用时抛出异常"""
+
+    def translate(self, text: str, source: str, target: str) -> str | None:
+        from deep_translator import GoogleTranslator
+
+        return GoogleTranslator(source=source, target=target).translate(text)
+
+
+class DictTranslatorBackend:
+    """
+    离线双语词典：整句命中时直接返回译文，否则逐词 (中文用 jieba 分词) 查词典拼接。
+    一个词都查不到时返回 None。
+    """
+
+    def __init__(self, path: str):
+        self.entries: dict[str, str] = {}
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as fh:
+                for line in fh:
+                    parts = [p.strip() for p in line.rstrip("\n").split("\t") if p.strip()]
+                    if len(parts) < 2:
+                        continue
+                    word, translations = parts[0], parts[1:]
+                    self.entries.setdefault(word.casefold(), translations[0])
+                    for t in translations:
+                        self.entries.setdefault(t.casefold(), word)
+        else:
+            print(f"⚠️ 未找到离线词典: {path or '(未配置 QUERY_EXPANSION_DICT)'}")
+
+    def translate(self, text: str, source: str, target: str) -> str | None:
+        text = " ".join(text.split())
+        hit = self.entries.get(text.casefold())
+        if hit:
+            return hit
+
+        if source.startswith("zh"):
+            import jieba
+
+            tokens = [t for t in jieba.cut(text) if t.strip()]
+        else:
+            tokens = text.split()
+        translated = [self.entries.get(t.casefold()) for t in tokens]
+        if not any(translated):
+            return None
+        joiner = " " if target == "en" else ""
+        return joiner.join(t for t in translated if t)
+
+
+class NoTranslatorBackend:
+    def translate(self, text: str, source: str, target: str) -> str | None:
+        return None
+
+
+def build_translator(name: str = QUERY_EXPANSION_BACKEND):
+    if name == "google":
+        return GoogleTranslatorBackend()
+    if name == "dict":
+        return DictTranslatorBackend(QUERY_EXPANSION_DICT)
+    if name == "none":
+        return NoTranslatorBackend()
+    raise ValueError(f"Unknown QUERY_EXPANSION_BACKEND: {name}")
+
+
+def wordnet_expansions(word_en: str) -> list[str]:
+    """WordNet 同义词 (nltk 或语料未安装时返回空列表)"""
+    try:
+        from nltk.corpus import wordnet
+
+        synonyms = []
+        for syn in wordnet.synsets(word_en)[:2]:
+            for lemma in syn.lemmas():
+                synonyms.append(lemma.name().replace('_', ' '))
+    except Exception:
+        return []
+    return list(dict.fromkeys(synonyms))[:5]
+
+
+def normalize_query(q: str) -> str:
+    return " ".join(q.split()).casefold()
+
+
+class QueryExpander:
+    """
+    检索词扩展：原词 + 中英互译 + WordNet 同义词。
+    - 结果按规范化后的查询缓存 (LRU + TTL)
+    - 扩展在后台线程中计算，检索最多等待 budget_ms 毫秒；
+      超时则使用已得到的部分检索词，后台计算完成后写入缓存供后续查询使用
+    - 相同查询并发到达时共用同一次计算
+    """
+
+    def __init__(
+        self,
+        translator=None,
+        use_wordnet: bool = QUERY_EXPANSION_WORDNET,
+        cache_size: int = QUERY_EXPANSION_CACHE_SIZE,
+        ttl: float = QUERY_EXPANSION_TTL,
+        failure_ttl: float = QUERY_EXPANSION_FAILURE_TTL,
+        budget_ms: int = QUERY_EXPANSION_BUDGET_MS,
+        workers: int = QUERY_EXPANSION_WORKERS,
+    ):
+        self.translator = translator if translator is not None else build_translator()
+        self.use_wordnet = use_wordnet
+        self.cache = LRUCache(cache_size, ttl=ttl)
+        self.failure_ttl = failure_ttl
+        self.budget = budget_ms / 1000
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="query-expand")
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def expand(self, q: str) -> list[str]:
+        job = self._start(q)
+        if isinstance(job, list):
+            return job
+        future, terms = job
+        try:
+            return list(future.result(timeout=self.budget))
+        except FutureTimeout:
+            return self._partial(q, terms)
+
+    async def expand_async(self, q: str) -> list[str]:
+        """expand 的协程版本：等待时不占用事件循环"""
+        job = self._start(q)
+        if isinstance(job, list):
+            return job
+        future, terms = job
+        try:
+            return list(await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), self.budget))
+        except asyncio.TimeoutError:
+            return self._partial(q, terms)
+
+    def _start(self, q: str):
+        """命中缓存时返回检索词列表，否则返回 (后台计算的 future, 已得到的检索词)"""
+        key = normalize_query(q)
+        if not key:
+            return []
+        cached = self.cache.get(key)
+        if cached is not None:
+            return list(cached)
+        q = " ".join(q.split())
+
+        with self._lock:
+            job = self._in_flight.get(key)
+            if job is None:
+                # 已得到的检索词按顺序追加到 terms，超时时直接读取
+                terms = [q]
+                future = self._executor.submit(self._compute, key, q, terms)
+                job = self._in_flight[key] = (future, terms)
+        return job
+
+    def _partial(self, q: str, terms: list[str]) -> list[str]:
+        print(f"⚠️ 检索词扩展超时 ({self.budget * 1000:.0f}ms)，使用部分结果: {q}")
+        return list(dict.fromkeys(terms))
+
+    def _compute(self, key: str, q: str, terms: list[str]) -> list[str]:
+        ok = True
+        try:
+            if is_chinese(q):
+                translated = self.translator.translate(q, "zh-CN", "en")
+                if translated:
+                    terms.append(translated.strip())
+                    if self.use_wordnet:
+                        terms.extend(wordnet_expansions(translated))
+            else:
+                if self.use_wordnet:
+                    terms.extend(wordnet_expansions(q))
+                translated = self.translator.translate(q, "en", "zh-CN")
+                if translated:
+                    terms.append(translated.strip())
+        except Exception as e:
+            ok = False
+            print(f"⚠️ 检索词扩展失败，仅使用原词: {e}")
+
+        result = list(dict.fromkeys(t for t in terms if t))
+        self.cache.set(key, tuple(result), ttl=None if ok else self.failure_ttl)
+        with self._lock:
+            self._in_flight.pop(key, None)
+        return result
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+query_expander = QueryExpander()
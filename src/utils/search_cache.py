@@ -0,0 +1,70 @@
+import os
+
+from sqlalchemy.orm import Session
+
+from utils.cache import LRUCache
+from utils.corpus_version import current_corpus_version, current_corpus_version_async
+
+# 检索结果缓存后端：memory (进程内 LRU) | none (不缓存)
+SEARCH_CACHE_BACKEND = os.getenv("SEARCH_CACHE_BACKEND", "memory")
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", 1024))
+# 额外的有效期上限 (秒)，0 表示只依赖语料版本号失效
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", 0))
+
+
+class NullCache:
+    def get(self, key, default=None):
+        return default
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def clear(self):
+        pass
+
+
+def build_cache_backend(name: str = SEARCH_CACHE_BACKEND):
+    """后端只需实现 get / set / clear，可替换为共享缓存"""
+    if name == "memory":
+        return LRUCache(SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL or None)
+    if name == "none":
+        return NullCache()
+    raise ValueError(f"Unknown SEARCH_CACHE_BACKEND: {name}")
+
+
+class SearchResultCache:
+    """
+    检索结果缓存：键为 (检索类型, 最终的布尔模式检索串, limit 等参数, 语料版本号)。
+    语料版本号在任何写入后递增，旧版本的结果不再命中，版本变化时顺带清空后端释放内存。
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else build_cache_backend()
+        self._version = None
+
+    def get_or_compute(self, db: Session, kind: str, params: tuple, compute):
+        # 先读版本号再查询：查询期间发生的写入只会让结果比版本号更新，不会更旧
+        key = self._key(current_corpus_version(db), kind, params)
+        result = self.backend.get(key)
+        if result is None:
+            result = compute()
+            self.backend.set(key, result)
+        return result
+
+    async def get_or_compute_async(self, db, kind: str, params: tuple, compute):
+        """异步会话版本，compute 为返回结果的协程函数"""
+        key = self._key(await current_corpus_version_async(db), kind, params)
+        result = self.backend.get(key)
+        if result is None:
+            result = await compute()
+            self.backend.set(key, result)
+        return result
+
+    def _key(self, version: int, kind: str, params: tuple):
+        if version != self._version:
+            self.backend.clear()
+            self._version = version
+        return (kind, params, version)
+
+
+search_cache = SearchResultCache()
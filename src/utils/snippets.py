@@ -0,0 +1,40 @@
+import html
+import re
+
+# 摘要窗口长度 (字符)
+SNIPPET_WIDTH = 240
+
+
+def make_snippet(text: str, terms, width: int = SNIPPET_WIDTH) -> str:
+    """
+    以第一个命中的检索词为中心截取一段摘要，命中词用 <mark> 包裹。
+    文本先做 HTML 转义，前端可直接按 HTML 渲染。
+    """
+    text = " ".join((text or "").split())
+    terms = sorted({t.strip() for t in terms if t and t.strip()}, key=len, reverse=True)
+    if not terms:
+        return html.escape(text[:width])
+
+    pattern = re.compile("|".join(re.escape(t) for t in terms), re.IGNORECASE)
+    match = pattern.search(text)
+    start = 0
+    if match:
+        start = max(0, match.start() - width // 3)
+    end = min(len(text), start + width)
+    start = max(0, end - width)
+
+    window = text[start:end]
+    parts = []
+    last = 0
+    for m in pattern.finditer(window):
+        parts.append(html.escape(window[last:m.start()]))
+        parts.append(f"<mark>{html.escape(m.group())}</mark>")
+        last = m.end()
+    parts.append(html.escape(window[last:]))
+
+    snippet = "".join(parts)
+    if start > 0:
+        snippet = "…" + snippet
+    if end < len(text):
+        snippet += "…"
+    return snippet
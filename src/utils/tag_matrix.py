@@ -0,0 +1,295 @@
+import math
+import os
+import threading
+import time
+
+import numpy as np
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+
+from models import KnowledgeBase, KBTagRelation
+from utils.corpus_version import current_corpus_version
+from utils.corpus_sync import corpus_changes, recent_updates, INDEX_LOAD_BATCH
+from utils.neighbours import KB_NEIGHBOURS_MAX_DF, KB_NEIGHBOURS_MIN_DOCS
+
+# 启动时在后台加载文档 × 标签矩阵
+TAG_MATRIX_WARMUP = os.getenv("TAG_MATRIX_WARMUP", "1") == "1"
+# 变化的条目先放在增量部分 (逐条计算)，超过该数量时在后台线程重建矩阵
+TAG_MATRIX_OVERLAY_MAX = int(os.getenv("TAG_MATRIX_OVERLAY_MAX", 1000))
+
+_rel = KBTagRelation.__table__
+
+
+class TagMatrix:
+    """
+    进程内的文档 × 标签稀疏矩阵 (CSR 按文档取标签，CSC 按标签取文档)，用于多篇输入的推荐：
+    - 输入文章 (可带权重) 的标签向量乘以 IDF 后与矩阵做一次稀疏乘法，只访问输入标签的倒排
+    - IDF 与常见标签的过滤规则同 utils.neighbours，文档频率随变化增量维护
+    - 语料版本号变化时只读取变化的条目 (标签写入路径会更新条目的 updated_at)：
+      它们在矩阵中的旧行失效，新内容进入增量部分；增量超过 overlay_max 条时在后台重建矩阵
+    """
+
+    def __init__(
+        self,
+        max_df: float = KB_NEIGHBOURS_MAX_DF,
+        min_docs: int = KB_NEIGHBOURS_MIN_DOCS,
+        overlay_max: int = TAG_MATRIX_OVERLAY_MAX,
+    ):
+        self.max_df = max_df
+        self.min_docs = min_docs
+        self.overlay_max = overlay_max
+        self.loaded = False
+        self.corpus_version = None
+        self.watermark = None
+        # kb_id -> (标签 ID 元组, 年份, 分类)，始终是最新内容
+        self._docs: dict[int, tuple] = {}
+        # 标签 -> 文档频率，以及有标签的条目数
+        self._tag_df: dict[int, int] = {}
+        self._n_docs = 0
+        # 矩阵中的行已过期或不在矩阵中的条目 -> 变化序号
+        self._overlay: dict[int, int] = {}
+        self._generation = 0
+        self._rebuild_thread = None
+        self._lock = threading.RLock()
+        # 上次刷新时回看窗口内条目的 updated_at (见 corpus_changes)
+        self._seen = {}
+        self._install(self._build({}))
+
+    # ---------- 加载与刷新 ----------
+
+    def _read_docs(self, db: Session, kb_ids=None) -> dict[int, tuple]:
+        """读取条目的标签与过滤字段 (kb_ids 为空时读取全部)"""
+        meta = select(KnowledgeBase.id, KnowledgeBase.year, KnowledgeBase.category)
+        rel = select(_rel.c.kb_id, _rel.c.tag_id)
+        chunks = [None] if kb_ids is None else [
+            sorted(kb_ids)[i:i + INDEX_LOAD_BATCH] for i in range(0, len(kb_ids), INDEX_LOAD_BATCH)
+        ]
+        docs = {}
+        for chunk in chunks:
+            tags = {}
+            where_rel = rel if chunk is None else rel.where(_rel.c.kb_id.in_(chunk))
+            for kb_id, tag_id in db.execute(where_rel):
+                tags.setdefault(kb_id, []).append(tag_id)
+            where_meta = meta if chunk is None else meta.where(KnowledgeBase.id.in_(chunk))
+            for kb_id, year, category in db.execute(where_meta):
+                docs[kb_id] = (tuple(sorted(tags.get(kb_id, ()))), year, category)
+        return docs
+
+    @staticmethod
+    def _build(docs: dict[int, tuple]) -> dict:
+        """由条目快照构建 CSR / CSC 数组与过滤列 (不修改实例，可在后台线程中执行)"""
+        kb_ids = sorted(docs)
+        tag_col = {}
+        indptr = np.zeros(len(kb_ids) + 1, dtype=np.int64)
+        cols = []
+        years = np.full(len(kb_ids), -1, dtype=np.int32)
+        categories = np.full(len(kb_ids), -1, dtype=np.int32)
+        category_code = {}
+        for row, kb_id in enumerate(kb_ids):
+            tags, year, category = docs[kb_id]
+            for tag_id in tags:
+                cols.append(tag_col.setdefault(tag_id, len(tag_col)))
+            indptr[row + 1] = len(cols)
+            if year is not None:
+                years[row] = year
+            if category is not None:
+                categories[row] = category_code.setdefault(category, len(category_code))
+
+        indices = np.array(cols, dtype=np.int32)
+        rows = np.repeat(np.arange(len(kb_ids), dtype=np.int32), np.diff(indptr))
+        order = np.argsort(indices, kind="stable")
+        df = np.bincount(indices, minlength=len(tag_col))
+        return {
+            "doc_ids": np.array(kb_ids, dtype=np.int64),
+            "row_of": {kb_id: row for row, kb_id in enumerate(kb_ids)},
+            "tag_col": tag_col,
+            "csc_indptr": np.concatenate([[0], np.cumsum(df)]).astype(np.int64),
+            "csc_indices": rows[order],
+            "years": years,
+            "categories": categories,
+            "category_code": category_code,
+        }
+
+    def _install(self, arrays: dict):
+        self.doc_ids = arrays["doc_ids"]
+        self._row_of = arrays["row_of"]
+        self._tag_col = arrays["tag_col"]
+        self._csc_indptr = arrays["csc_indptr"]
+        self._csc_indices = arrays["csc_indices"]
+        self._years = arrays["years"]
+        self._categories = arrays["categories"]
+        self._category_code = arrays["category_code"]
+
+    def _apply(self, docs: dict[int, tuple], removed):
+        """把变化的条目写入 _docs 并维护文档频率，矩阵中的旧行在增量部分中标记为过期"""
+        for kb_id, doc in [*docs.items(), *((kb_id, None) for kb_id in removed)]:
+            old = self._docs.pop(kb_id, None)
+            if old is not None:
+                for tag_id in old[0]:
+                    self._tag_df[tag_id] -= 1
+                    if not self._tag_df[tag_id]:
+                        del self._tag_df[tag_id]
+                self._n_docs -= bool(old[0])
+            if doc is not None:
+                self._docs[kb_id] = doc
+                for tag_id in doc[0]:
+                    self._tag_df[tag_id] = self._tag_df.get(tag_id, 0) + 1
+                self._n_docs += bool(doc[0])
+            self._generation += 1
+            self._overlay[kb_id] = self._generation
+
+    def refresh(self, db: Session):
+        """语料版本号变化时只重新读取变化的条目，首次调用时全量加载"""
+        version = current_corpus_version(db)
+        if self.loaded and version == self.corpus_version:
+            return
+        with self._lock:
+            if self.loaded and version == self.corpus_version:
+                return
+            started = time.monotonic()
+            if not self.loaded:
+                self.watermark = db.execute(select(func.max(KnowledgeBase.updated_at))).scalar()
+                self._seen = recent_updates(db, self.watermark)
+                self._docs, self._tag_df, self._n_docs = {}, {}, 0
+                self._apply(self._read_docs(db), ())
+                self._overlay = {}
+                self._install(self._build(self._docs))
+                self.loaded = True
+                self.corpus_version = version
+                print(f"✅ 标签矩阵已加载: {len(self._docs)} 篇，{len(self._tag_col)} 个标签 ({time.monotonic() - started:.2f}s)")
+                return
+
+            watermark, changed, removed, seen = corpus_changes(db, self._docs.keys(), self.watermark, self._seen)
+            docs = self._read_docs(db, changed) if changed else {}
+            # 读取时已被删除的条目同样移除
+            self._apply(docs, set(removed) | (set(changed) - docs.keys()))
+            self.watermark = watermark
+            self._seen = seen
+            self.corpus_version = version
+            if len(self._overlay) > self.overlay_max:
+                self._rebuild_in_background()
+
+    def _rebuild_in_background(self):
+        """用当前条目的快照在后台重建矩阵，期间的变化保留在增量部分"""
+        if self._rebuild_thread is not None and self._rebuild_thread.is_alive():
+            return
+        snapshot = dict(self._docs)
+        generation = self._generation
+
+        def run():
+            try:
+                arrays = self._build(snapshot)
+            except Exception as e:
+                print(f"⚠️ 标签矩阵重建失败: {e}")
+                return
+            with self._lock:
+                self._install(arrays)
+                self._overlay = {kb_id: g for kb_id, g in self._overlay.items() if g > generation}
+
+        self._rebuild_thread = threading.Thread(target=run, daemon=True)
+        self._rebuild_thread.start()
+
+    def warmup(self, db_factory):
+        db = db_factory()
+        try:
+            self.refresh(db)
+        except Exception as e:
+            print(f"⚠️ 标签矩阵加载失败: {e}")
+        finally:
+            db.close()
+
+    # ---------- 推荐 ----------
+
+    def _idf(self, tag_id: int) -> float:
+        """同 utils.neighbours：只出现在一个条目中或过于常见的标签权重为 0"""
+        df = self._tag_df.get(tag_id, 0)
+        n_docs = self._n_docs
+        max_df = n_docs * self.max_df if n_docs >= self.min_docs else n_docs
+        if df <= 1 or df > max_df:
+            return 0.0
+        return math.log1p(n_docs / df)
+
+    @staticmethod
+    def _gather(indptr, indices, rows):
+        """取出多行 (CSR 行或 CSC 列) 的全部元素，返回 (拼接后的元素, 每行的长度)"""
+        starts = indptr[rows]
+        lens = indptr[rows + 1] - starts
+        offsets = np.repeat(starts - np.cumsum(lens) + lens, lens) + np.arange(int(lens.sum()))
+        return indices[offsets], lens
+
+    def recommend(
+        self,
+        db: Session,
+        seeds: dict[int, float],
+        limit: int = 10,
+        exclude=(),
+        year: int | None = None,
+        category: str | None = None,
+    ) -> list[tuple[int, float, int]]:
+        """
+        seeds 为 {kb_id: 权重}，返回按得分降序的 (kb_id, 得分, 共同标签数)。
+        得分 = Σ 权重 × 共同标签的 IDF；输入文章与 exclude 中的条目不会出现在结果中
+        """
+        self.refresh(db)
+        with self._lock:
+            # 输入文章的标签向量 (按权重累加) 与每个标签出现在几篇输入中
+            profile, counts = {}, {}
+            for kb_id, weight in seeds.items():
+                doc = self._docs.get(kb_id)
+                if doc is None:
+                    continue
+                for tag_id in doc[0]:
+                    profile[tag_id] = profile.get(tag_id, 0.0) + weight
+                    counts[tag_id] = counts.get(tag_id, 0) + 1
+            profile = {tag_id: w * self._idf(tag_id) for tag_id, w in profile.items()}
+            profile = {tag_id: w for tag_id, w in profile.items() if w}
+            if not profile:
+                return []
+            skip = {*seeds, *exclude}
+
+            # 矩阵部分：只展开输入标签的倒排 (CSC 列)，跳过已过期的行
+            candidates = []
+            base_tags = [(self._tag_col[t], w) for t, w in profile.items() if t in self._tag_col]
+            if base_tags:
+                cols = np.array([c for c, _ in base_tags], dtype=np.int64)
+                docs, lens = self._gather(self._csc_indptr, self._csc_indices, cols)
+                scores = np.bincount(
+                    docs, weights=np.repeat([w for _, w in base_tags], lens), minlength=len(self.doc_ids)
+                )
+                stale = [self._row_of[k] for k in (*skip, *self._overlay) if k in self._row_of]
+                scores[stale] = 0
+
+                # 之后的过滤只作用于有得分的候选条目
+                hits = np.flatnonzero(scores > 0)
+                if year is not None:
+                    hits = hits[self._years[hits] == year]
+                if category is not None:
+                    code = self._category_code.get(category)
+                    hits = hits[self._categories[hits] == code] if code is not None else hits[:0]
+                if len(hits) > limit:
+                    # 保留与第 limit 名同分的全部条目，与增量部分合并排序后再截断
+                    kth = -np.partition(-scores[hits], limit - 1)[limit - 1]
+                    hits = hits[scores[hits] >= kth]
+                candidates = [(int(self.doc_ids[d]), float(scores[d])) for d in hits]
+
+            # 增量部分逐条计算
+            for kb_id in self._overlay:
+                doc = self._docs.get(kb_id)
+                if doc is None or kb_id in skip:
+                    continue
+                tags, doc_year, doc_category = doc
+                if (year is not None and doc_year != year) or (category is not None and doc_category != category):
+                    continue
+                score = sum(profile.get(tag_id, 0.0) for tag_id in tags)
+                if score > 0:
+                    candidates.append((kb_id, score))
+
+            # 同分按 kb_id 升序
+            candidates.sort(key=lambda c: (-c[1], c[0]))
+            return [
+                (kb_id, score, sum(counts[t] for t in self._docs[kb_id][0] if t in profile))
+                for kb_id, score in candidates[:limit]
+            ]
+
+
+tag_matrix = TagMatrix()
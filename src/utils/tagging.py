@@ -0,0 +1,166 @@
+import os
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import event, insert, delete, select, update, func
+from sqlalchemy.orm import Session
+
+from models import Tag, KBTagRelation, KnowledgeBase
+from utils.neighbours import neighbour_table
+
+# 进程内标签缓存容量 (name -> id)
+TAG_CACHE_SIZE = int(os.getenv("TAG_CACHE_SIZE", 50000))
+
+# 与 Tag.name 的列宽保持一致
+TAG_NAME_MAX_LEN = 50
+
+# 当前事务中新建的标签，提交后才进入缓存 (回滚的 ID 不能被缓存)
+_PENDING_KEY = "_tag_resolver_pending"
+
+
+def _clean_names(names) -> list[str]:
+    """去空白、按列宽截断并去重 (保持原有顺序)"""
+    wanted = []
+    for name in names:
+        name = (name or "").strip()[:TAG_NAME_MAX_LEN]
+        if name and name not in wanted:
+            wanted.append(name)
+    return wanted
+
+
+class TagResolver:
+    """
+    批量标签解析：一次查询解析整组关键词，缺失的标签批量插入
+    (INSERT IGNORE，容忍并发写入同名标签)，并维护有界的 name -> id LRU 缓存。
+    所有写入路径 (KBService.add_entry / add_knowledge_entry / sync_papers) 共用同一实例。
+    关联变化的条目登记到 neighbour_table，提交前刷新推荐近邻表；
+    同时更新条目的 updated_at，各进程的内存索引 (如标签矩阵) 据此只重新读取这些条目。
+    """
+
+    def __init__(self, max_size: int = TAG_CACHE_SIZE):
+        self.max_size = max_size
+        self._cache: OrderedDict[str, int] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def resolve(self, db: Session, names) -> dict[str, int]:
+        """返回 {name: tag_id}，不存在的标签会被创建 (在调用方的事务内)"""
+        wanted = _clean_names(names)
+
+        resolved = {}
+        with self._lock:
+            for name in wanted:
+                tag_id = self._cache.get(name)
+                if tag_id is not None:
+                    self._cache.move_to_end(name)
+                    resolved[name] = tag_id
+        pending = db.info.get(_PENDING_KEY, {})
+        for name in wanted:
+            if name not in resolved and name in pending:
+                resolved[name] = pending[name]
+
+        missing = [name for name in wanted if name not in resolved]
+        if not missing:
+            return resolved
+
+        found = self._select(db, missing)
+        self._remember(found)
+        resolved.update(found)
+
+        missing = [name for name in missing if name not in found]
+        if missing:
+            stmt = (
+                insert(Tag.__table__)
+                .prefix_with("IGNORE", dialect="mysql")
+                .prefix_with("OR IGNORE", dialect="sqlite")
+            )
+            db.execute(stmt, [{"name": name} for name in missing])
+            # 加锁读：读到并发事务刚提交的同名标签，而不是本事务快照中的旧数据
+            created = self._select(db, missing, locking=True)
+            db.info.setdefault(_PENDING_KEY, {}).update(created)
+            resolved.update(created)
+
+        return resolved
+
+    def attach(self, db: Session, kb_id: int, names) -> dict[str, int]:
+        """为条目批量建立标签关联，已存在的关联会被忽略"""
+        tag_ids = self.resolve(db, names)
+        if tag_ids:
+            stmt = (
+                insert(KBTagRelation.__table__)
+                .prefix_with("IGNORE", dialect="mysql")
+                .prefix_with("OR IGNORE", dialect="sqlite")
+            )
+            db.execute(stmt, [{"kb_id": kb_id, "tag_id": tag_id} for tag_id in set(tag_ids.values())])
+            self._touch(db, [kb_id])
+            neighbour_table.mark(db, [kb_id])
+        return tag_ids
+
+    def attach_many(self, db: Session, items) -> int:
+        """
+        items 为 (kb_id, 关键词列表)：整批关键词只解析一次，
+        全部关联用一条 executemany 插入，返回关联行数
+        """
+        items = [(kb_id, _clean_names(names)) for kb_id, names in items]
+        tag_ids = self.resolve(db, [name for _, names in items for name in names])
+        rows = sorted({(kb_id, tag_ids[name]) for kb_id, names in items for name in names if name in tag_ids})
+        if rows:
+            stmt = (
+                insert(KBTagRelation.__table__)
+                .prefix_with("IGNORE", dialect="mysql")
+                .prefix_with("OR IGNORE", dialect="sqlite")
+            )
+            db.execute(stmt, [{"kb_id": kb_id, "tag_id": tag_id} for kb_id, tag_id in rows])
+            self._touch(db, {kb_id for kb_id, _ in rows})
+            neighbour_table.mark(db, {kb_id for kb_id, _ in rows})
+        return len(rows)
+
+    def detach(self, db: Session, kb_id: int):
+        """删除条目的全部标签关联"""
+        db.execute(delete(KBTagRelation.__table__).where(KBTagRelation.kb_id == kb_id))
+        self._touch(db, [kb_id])
+        neighbour_table.forget(db, kb_id)
+
+    @staticmethod
+    def _touch(db: Session, kb_ids):
+        """标签关联变化也算条目内容变化 (即使条目本身这一行没有被修改)"""
+        table = KnowledgeBase.__table__
+        db.execute(update(table).where(table.c.id.in_(sorted(kb_ids))).values(updated_at=func.now()))
+
+    def _select(self, db: Session, names: list[str], locking: bool = False) -> dict[str, int]:
+        stmt = select(Tag.id, Tag.name).where(Tag.name.in_(names))
+        if locking:
+            stmt = stmt.with_for_update(read=True)
+        rows = db.execute(stmt).all()
+
+        # MySQL 默认排序规则不区分大小写，返回的 name 可能与请求的写法不同
+        exact = {name: tag_id for tag_id, name in rows}
+        folded = {name.casefold(): tag_id for tag_id, name in rows}
+        found = {}
+        for name in names:
+            tag_id = exact.get(name, folded.get(name.casefold()))
+            if tag_id is not None:
+                found[name] = tag_id
+        return found
+
+    def _remember(self, mapping: dict[str, int]):
+        with self._lock:
+            for name, tag_id in mapping.items():
+                self._cache[name] = tag_id
+                self._cache.move_to_end(name)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+
+tag_resolver = TagResolver()
+
+
+@event.listens_for(Session, "after_commit")
+def _cache_committed_tags(session):
+    pending = session.info.pop(_PENDING_KEY, None)
+    if pending:
+        tag_resolver._remember(pending)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_pending_tags(session):
+    session.info.pop(_PENDING_KEY, None)
@@ -0,0 +1,139 @@
+import os
+import uuid
+import hashlib
+
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+
+from utils.ocr_service import detect_ext, OCR_BATCH_MAX_FILES
+
+# 上传配置 (可通过环境变量覆盖)
+OCR_MAX_UPLOAD_MB = int(os.getenv("OCR_MAX_UPLOAD_MB", 200))
+OCR_UPLOAD_CHUNK_SIZE = int(os.getenv("OCR_UPLOAD_CHUNK_SIZE", 1024 * 1024))
+
+# multipart 边界、表单字段等额外开销的余量
+_MULTIPART_OVERHEAD = 64 * 1024
+
+# 文件头魔数 -> 扩展名
+_MAGIC_EXTS = [
+    (b"%PDF-", ".pdf"),
+    (b"\x89PNG\r\n\x1a\n", ".png"),
+    (b"\xff\xd8\xff", ".jpg"),
+    (b"II*\x00", ".tiff"),
+    (b"MM\x00*", ".tiff"),
+    (b"BM", ".bmp"),
+]
+
+
+def sniff_ext(head: bytes) -> str | None:
+    """根据文件头判断真实类型，无法识别时返回 None"""
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+    for magic, ext in _MAGIC_EXTS:
+        if head.startswith(magic):
+            return ext
+    return None
+
+
+def max_request_bytes(path: str) -> int:
+    """OCR 路由允许的最大请求体 (用于在读取请求体之前依据 Content-Length 拒绝)"""
+    per_file = OCR_MAX_UPLOAD_MB * 1024 * 1024
+    if path.rstrip("/").endswith("/batch"):
+        return per_file * OCR_BATCH_MAX_FILES + _MULTIPART_OVERHEAD
+    return per_file + _MULTIPART_OVERHEAD
+
+
+def limit_body_size(receive, max_bytes: int):
+    """
+    包装 ASGI receive，边接收边累计请求体字节数，超过 max_bytes 时抛出 413。
+    用于没有 Content-Length (分块传输) 或 Content-Length 与实际不符的请求。
+    """
+    received = 0
+
+    async def limited_receive():
+        nonlocal received
+        message = await receive()
+        if message["type"] == "http.request":
+            received += len(message.get("body", b""))
+            if received > max_bytes:
+                raise HTTPException(status_code=413, detail="Request body too large")
+        return message
+
+    return limited_receive
+
+
+class OCRUploadLimitMiddleware:
+    """
+    OCR 上传的请求体大小限制 (纯 ASGI 中间件，receive 中抛出的 413 可以原样传给路由的异常处理)：
+    带 Content-Length 的超大请求在读取请求体之前直接拒绝，
+    其余请求 (分块上传等) 在接收请求体的过程中累计字节数，超过上限即返回 413
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] == "POST" and scope["path"].startswith("/ocr"):
+            max_bytes = max_request_bytes(scope["path"])
+            content_length = Headers(scope=scope).get("content-length")
+            if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+                response = JSONResponse(status_code=413, content={"detail": "Request body too large"})
+                await response(scope, receive, send)
+                return
+            receive = limit_body_size(receive, max_bytes)
+        await self.app(scope, receive, send)
+
+
+async def receive_upload(
+    file: UploadFile,
+    cache,
+    max_bytes: int = OCR_MAX_UPLOAD_MB * 1024 * 1024,
+    chunk_size: int = OCR_UPLOAD_CHUNK_SIZE,
+) -> tuple[str, str, str]:
+    """
+    分块把上传内容写入磁盘，同一遍内完成 SHA-256 计算、类型嗅探与大小限制检查，
+    内存占用与文件大小无关。写完后按内容哈希移动到缓存的分片目录。
+    返回 (digest, upload_path, ext)。
+    """
+    tmp_dir = os.path.join(cache.upload_root, ".tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    tmp_path = os.path.join(tmp_dir, f"{uuid.uuid4().hex}.part")
+
+    hasher = hashlib.sha256()
+    size = 0
+    ext = None
+    fh = open(tmp_path, "wb")
+
+    def _consume(chunk: bytes):
+        hasher.update(chunk)
+        fh.write(chunk)
+
+    try:
+        while True:
+            chunk = await file.read(chunk_size)
+            if not chunk:
+                break
+            if size == 0:
+                # 文件名和 Content-Type 不可信，优先以文件头为准
+                ext = sniff_ext(chunk) or detect_ext(file)
+            size += len(chunk)
+            if size > max_bytes:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"File too large (max {max_bytes // (1024 * 1024)} MB)",
+                )
+            await run_in_threadpool(_consume, chunk)
+        fh.close()
+
+        if size == 0:
+            raise HTTPException(status_code=400, detail="Empty file")
+
+        digest = hasher.hexdigest()
+        upload_path = await run_in_threadpool(cache.commit_upload, tmp_path, digest, ext)
+        return digest, upload_path, ext
+    finally:
+        fh.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
@@ -0,0 +1,486 @@
+import os
+import json
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+
+from models import KnowledgeBase
+from utils.bm25_index import tokenize
+from utils.corpus_version import current_corpus_version
+from utils.corpus_sync import corpus_changes, recent_updates, load_texts
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../"))
+
+# 向量索引持久化目录 (numpy 文件，文档矩阵以内存映射方式加载)
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", os.path.join(BASE_DIR, "vector_index"))
+# LSA 维度 (截断 SVD)；0 表示不降维，直接使用 TF-IDF 向量 (只适合小语料)
+VECTOR_DIM = int(os.getenv("VECTOR_DIM", 256))
+# 词表：最多保留的词数，最少出现在几篇文档中，出现在超过该比例文档中的词视为停用词
+VECTOR_MAX_FEATURES = int(os.getenv("VECTOR_MAX_FEATURES", 50000))
+VECTOR_MIN_DF = int(os.getenv("VECTOR_MIN_DF", 2))
+VECTOR_MAX_DF = float(os.getenv("VECTOR_MAX_DF", 0.5))
+# 标题词重复计数的次数 (标题加权)
+VECTOR_TITLE_REPEAT = int(os.getenv("VECTOR_TITLE_REPEAT", 3))
+# 增量 (折叠进已有词表与 SVD 基) 的文档超过主索引的该比例、且不少于 VECTOR_REBUILD_MIN_CHANGES 篇时，
+# 在后台线程全量重建，重建完成前继续使用旧索引加增量
+VECTOR_REBUILD_RATIO = float(os.getenv("VECTOR_REBUILD_RATIO", 0.2))
+VECTOR_REBUILD_MIN_CHANGES = int(os.getenv("VECTOR_REBUILD_MIN_CHANGES", 50))
+# 相似度计算时每次从文档矩阵中读取的行数
+VECTOR_QUERY_BLOCK = int(os.getenv("VECTOR_QUERY_BLOCK", 65536))
+# 启动时在后台加载 / 构建索引
+VECTOR_INDEX_WARMUP = os.getenv("VECTOR_INDEX_WARMUP", "1") == "1"
+
+_FORMAT = 1
+_SVD_OVERSAMPLE = 10
+_SVD_POWER_ITERS = 4
+# 稀疏矩阵乘法时每块的非零元个数
+_SPMM_BLOCK = 1_000_000
+
+
+def _spmm(rows, cols, vals, dense, n_rows):
+    """稀疏 (COO，rows 已排序) 矩阵乘稠密矩阵，按非零元分块控制中间数组大小"""
+    out = np.zeros((n_rows, dense.shape[1]), dtype=np.float32)
+    for s in range(0, len(vals), _SPMM_BLOCK):
+        r, c, v = rows[s:s + _SPMM_BLOCK], cols[s:s + _SPMM_BLOCK], vals[s:s + _SPMM_BLOCK]
+        if len(r) == 0:
+            continue
+        starts = np.flatnonzero(np.r_[True, r[1:] != r[:-1]])
+        out[r[starts]] += np.add.reduceat(v[:, None] * dense[c], starts, axis=0)
+    return out
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return (matrix / norms).astype(np.float32)
+
+
+def _randomized_svd(rows, cols, vals, n_rows, n_cols, k):
+    """
+    随机化截断 SVD (Halko 等)：只需要稀疏矩阵与稠密矩阵的乘积，
+    返回 (文档向量 n_rows×k, 词空间基 k×n_cols)
+    """
+    rng = np.random.default_rng(0)
+    width = min(k + _SVD_OVERSAMPLE, n_rows, n_cols)
+    order = np.argsort(cols, kind="stable")
+    t_rows, t_cols, t_vals = cols[order], rows[order], vals[order]
+
+    q, _ = np.linalg.qr(_spmm(rows, cols, vals, rng.standard_normal((n_cols, width)).astype(np.float32), n_rows))
+    for _ in range(_SVD_POWER_ITERS):
+        z, _ = np.linalg.qr(_spmm(t_rows, t_cols, t_vals, q, n_cols))
+        q, _ = np.linalg.qr(_spmm(rows, cols, vals, z, n_rows))
+    b = _spmm(t_rows, t_cols, t_vals, q, n_cols).T
+    u, s, vt = np.linalg.svd(b, full_matrices=False)
+    k = min(k, len(s))
+    return (q @ u[:, :k]) * s[:k], vt[:k].astype(np.float32)
+
+
+class VectorIndex:
+    """
+    本地语义向量索引：jieba 分词 -> TF-IDF (次线性词频) -> 截断 SVD (LSA) -> 单位向量。
+    - 文档矩阵保存为 .npy 并以内存映射打开，查询时分块做矩阵乘法求余弦相似度，
+      多个查询向量一次批量计算
+    - 新增或修改的文档用现有词表与 SVD 基折叠 (fold-in) 进内存增量部分；
+      增量足够多时在后台线程全量重建，使词表与基向量跟上语料变化，重建期间查询不受影响
+    - 与 BM25 索引相同，按语料版本号感知写入并增量刷新
+    全程只依赖 numpy，CPU 运行，无需网络。
+    """
+
+    def __init__(
+        self,
+        index_dir: str = VECTOR_INDEX_DIR,
+        dim: int = VECTOR_DIM,
+        rebuild_ratio: float = VECTOR_REBUILD_RATIO,
+        rebuild_min_changes: int = VECTOR_REBUILD_MIN_CHANGES,
+    ):
+        self.index_dir = index_dir
+        self.dim = dim
+        self.rebuild_ratio = rebuild_ratio
+        self.rebuild_min_changes = rebuild_min_changes
+        self._lock = threading.RLock()
+        # 正在运行的后台重建线程
+        self._rebuild_thread = None
+        # 上次刷新时回看窗口内条目的 updated_at (见 corpus_changes)
+        self._seen = {}
+        self.loaded = False
+        self.path = None
+        self._set_model({}, np.zeros(0, dtype=np.float32), None)
+        self._set_docs(np.zeros(0, dtype=np.int64), np.zeros((0, 0), dtype=np.float32))
+        self.corpus_version = None
+        self.watermark = None
+
+    def _set_model(self, vocab: dict[str, int], idf, components):
+        self.vocab = vocab
+        self.idf = idf
+        # k × V 的词空间基；None 表示不降维
+        self.components = components
+
+    def _set_docs(self, doc_ids, matrix):
+        self.doc_ids = doc_ids
+        self.matrix = matrix
+        self._rows = {int(kb_id): i for i, kb_id in enumerate(doc_ids)}
+        self._deleted: set[int] = set()
+        self._delta_ids: list[int] = []
+        self._delta_vectors: list[np.ndarray] = []
+
+    @property
+    def width(self) -> int:
+        if self.components is not None:
+            return self.components.shape[0]
+        return len(self.vocab)
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self._delta_ids or self._deleted)
+
+    # ---------- 向量化 ----------
+
+    def _term_weights(self, title: str | None, content: str | None):
+        """返回 (词 ID 数组, TF-IDF 权重数组)，已做 L2 归一化"""
+        counts = {}
+        tokens = tokenize(title) * VECTOR_TITLE_REPEAT + tokenize(content)
+        for t in tokens:
+            idx = self.vocab.get(t)
+            if idx is not None:
+                counts[idx] = counts.get(idx, 0) + 1
+        if not counts:
+            return None
+        cols = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        tfs = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+        weights = (1 + np.log(tfs)) * self.idf[cols]
+        return cols, weights / np.linalg.norm(weights)
+
+    def embed(self, title: str | None, content: str | None = None):
+        """把一段文本映射为单位向量 (不含词表内任何词时返回 None)"""
+        tw = self._term_weights(title, content)
+        if tw is None:
+            return None
+        cols, weights = tw
+        if self.components is None:
+            vector = np.zeros(len(self.vocab), dtype=np.float32)
+            vector[cols] = weights
+        else:
+            vector = self.components[:, cols] @ weights
+        norm = np.linalg.norm(vector)
+        return (vector / norm).astype(np.float32) if norm > 0 else None
+
+    def doc_vectors(self, kb_ids) -> list[np.ndarray]:
+        """已索引文档的向量 (不在索引中的 ID 被跳过)"""
+        with self._lock:
+            n_base = len(self.doc_ids)
+            vectors = []
+            for kb_id in kb_ids:
+                row = self._rows.get(kb_id)
+                if row is None:
+                    continue
+                vectors.append(np.asarray(self.matrix[row]) if row < n_base else self._delta_vectors[row - n_base])
+            return vectors
+
+    # ---------- 构建 / 加载 / 持久化 ----------
+
+    def build(self, db: Session):
+        """从 knowledge_base 全量构建词表、SVD 基与文档矩阵，并落盘 (计算过程不持有锁)"""
+        self._install(*self._compute(db))
+
+    def _compute(self, db: Session):
+        """读取全部文档并计算新的模型与文档矩阵，返回 _install 的参数"""
+        started = time.monotonic()
+        version = current_corpus_version(db)
+        watermark = db.execute(select(func.max(KnowledgeBase.updated_at))).scalar()
+        seen = recent_updates(db, watermark)
+        ids = list(db.scalars(select(KnowledgeBase.id)))
+
+        terms: dict[str, int] = {}
+        doc_ids, doc_terms, doc_counts = [], [], []
+        for kb_id, title, text in load_texts(db, ids):
+            counts = {}
+            for t in tokenize(title) * VECTOR_TITLE_REPEAT + tokenize(text):
+                idx = terms.setdefault(t, len(terms))
+                counts[idx] = counts.get(idx, 0) + 1
+            doc_ids.append(kb_id)
+            doc_terms.append(np.fromiter(counts.keys(), dtype=np.int64, count=len(counts)))
+            doc_counts.append(np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))
+
+        n_docs = len(doc_ids)
+        all_terms = np.concatenate(doc_terms) if doc_terms else np.zeros(0, dtype=np.int64)
+        df = np.bincount(all_terms, minlength=len(terms))
+
+        # 词表剪枝：去掉过稀有和过常见的词，按文档频率保留前 VECTOR_MAX_FEATURES 个
+        # 语料太小 (< 50 篇) 时文档频率统计不可靠，不做剪枝
+        if n_docs >= 50:
+            keep = (df >= VECTOR_MIN_DF) & (df <= VECTOR_MAX_DF * n_docs)
+        else:
+            keep = df > 0
+        kept = np.flatnonzero(keep)
+        kept = kept[np.argsort(-df[kept], kind="stable")[:VECTOR_MAX_FEATURES]]
+        remap = np.full(len(terms), -1, dtype=np.int64)
+        remap[kept] = np.arange(len(kept))
+        names = [None] * len(kept)
+        for t, i in terms.items():
+            if remap[i] >= 0:
+                names[remap[i]] = t
+        idf = (np.log((1 + n_docs) / (1 + df[kept])) + 1).astype(np.float32)
+
+        # TF-IDF 稀疏矩阵 (COO，按行有序)，每行 L2 归一化
+        rows_parts, cols_parts, vals_parts = [], [], []
+        for row, (cols, tfs) in enumerate(zip(doc_terms, doc_counts)):
+            cols = remap[cols]
+            mask = cols >= 0
+            cols, tfs = cols[mask], tfs[mask]
+            if len(cols) == 0:
+                continue
+            weights = (1 + np.log(tfs)) * idf[cols]
+            rows_parts.append(np.full(len(cols), row, dtype=np.int64))
+            cols_parts.append(cols)
+            vals_parts.append((weights / np.linalg.norm(weights)).astype(np.float32))
+        rows = np.concatenate(rows_parts) if rows_parts else np.zeros(0, dtype=np.int64)
+        cols = np.concatenate(cols_parts) if cols_parts else np.zeros(0, dtype=np.int64)
+        vals = np.concatenate(vals_parts) if vals_parts else np.zeros(0, dtype=np.float32)
+
+        k = min(self.dim, n_docs, len(kept))
+        if self.dim > 0 and k > 0:
+            matrix, components = _randomized_svd(rows, cols, vals, n_docs, len(kept), k)
+        else:
+            components = None
+            matrix = np.zeros((n_docs, len(kept)), dtype=np.float32)
+            matrix[rows, cols] = vals
+
+        model = ({t: i for i, t in enumerate(names)}, idf, components)
+        docs = (np.array(doc_ids, dtype=np.int64), _normalize_rows(matrix))
+        width = components.shape[0] if components is not None else len(kept)
+        print(
+            f"🧭 向量索引已构建: {n_docs} 篇文档，词表 {len(kept)}，维度 {width} "
+            f"({time.monotonic() - started:.2f}s)"
+        )
+        return model, docs, version, watermark, seen
+
+    def _install(self, model, docs, version, watermark, seen):
+        """
+        切换到新构建的索引并落盘。构建期间折叠进来的增量被丢弃：
+        版本号与水位回到构建时的快照，下次刷新会重新读取之后变化的文档
+        """
+        with self._lock:
+            self._set_model(*model)
+            self._set_docs(*docs)
+            self.corpus_version = version
+            self.watermark = watermark
+            self._seen = seen
+            self.loaded = True
+            self.save()
+
+    def rebuild_in_background(self, session_factory):
+        """在后台线程全量重建 (已有重建在运行时忽略)，返回该线程"""
+        with self._lock:
+            if self._rebuild_thread is not None and self._rebuild_thread.is_alive():
+                return self._rebuild_thread
+
+            def run():
+                db = session_factory()
+                try:
+                    self._install(*self._compute(db))
+                except Exception as e:
+                    print(f"⚠️ 向量索引后台重建失败: {e}")
+                finally:
+                    db.close()
+
+            self._rebuild_thread = threading.Thread(target=run, daemon=True)
+            self._rebuild_thread.start()
+            return self._rebuild_thread
+
+    def load(self) -> bool:
+        current = os.path.join(self.index_dir, "CURRENT")
+        if not os.path.exists(current):
+            return False
+        with open(current, encoding="utf-8") as fh:
+            path = os.path.join(self.index_dir, fh.read().strip())
+        try:
+            with open(os.path.join(path, "meta.json"), encoding="utf-8") as fh:
+                meta = json.load(fh)
+            if meta.get("format") != _FORMAT:
+                return False
+            idf = np.load(os.path.join(path, "idf.npy"))
+            components = np.load(os.path.join(path, "components.npy")) if meta["reduced"] else None
+            doc_ids = np.load(os.path.join(path, "doc_ids.npy"))
+            matrix = np.load(os.path.join(path, "docs.npy"), mmap_mode="r")
+        except (OSError, ValueError, KeyError) as e:
+            print(f"⚠️ 向量索引加载失败，将重建: {e}")
+            return False
+        with self._lock:
+            self._set_model({t: i for i, t in enumerate(meta["vocab"])}, idf, components)
+            self._set_docs(doc_ids, matrix)
+            self.corpus_version = meta["corpus_version"]
+            self.watermark = datetime.fromisoformat(meta["watermark"]) if meta["watermark"] else None
+            self.path = path
+            self.loaded = True
+        print(f"🧭 已加载向量索引: {len(doc_ids)} 篇文档，维度 {self.width}")
+        return True
+
+    def save(self):
+        """把增量部分并入文档矩阵，写入新目录后原子切换 CURRENT"""
+        with self._lock:
+            # 行号覆盖主索引与增量两部分：增量中被再次修改的文档，旧的增量行同样在 _deleted 中
+            n_base = len(self.doc_ids)
+            live = np.ones(n_base + len(self._delta_ids), dtype=bool)
+            if self._deleted:
+                live[np.fromiter(self._deleted, dtype=np.int64)] = False
+            doc_ids = np.concatenate([np.asarray(self.doc_ids), np.array(self._delta_ids, dtype=np.int64)])[live]
+            parts = [np.asarray(self.matrix)] if n_base else []
+            if self._delta_vectors:
+                parts.append(np.vstack(self._delta_vectors))
+            if parts:
+                matrix = np.vstack(parts).astype(np.float32)[live]
+            else:
+                matrix = np.zeros((0, self.width), dtype=np.float32)
+
+            name = f"seg-{time.time_ns()}"
+            path = os.path.join(self.index_dir, name)
+            os.makedirs(path)
+            np.save(os.path.join(path, "idf.npy"), self.idf)
+            if self.components is not None:
+                np.save(os.path.join(path, "components.npy"), self.components)
+            np.save(os.path.join(path, "doc_ids.npy"), doc_ids)
+            np.save(os.path.join(path, "docs.npy"), matrix)
+            vocab = [None] * len(self.vocab)
+            for t, i in self.vocab.items():
+                vocab[i] = t
+            meta = {
+                "format": _FORMAT,
+                "reduced": self.components is not None,
+                "vocab": vocab,
+                "corpus_version": self.corpus_version,
+                "watermark": self.watermark.isoformat() if self.watermark else None,
+            }
+            with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as fh:
+                json.dump(meta, fh, ensure_ascii=False)
+
+            # 多个进程可能同时落盘，临时文件名各不相同，切换 CURRENT 是原子的
+            fd, tmp = tempfile.mkstemp(prefix="CURRENT.", suffix=".tmp", dir=self.index_dir)
+            with os.fdopen(fd, "w", encoding="utf-8") as fh:
+                fh.write(name)
+            os.replace(tmp, os.path.join(self.index_dir, "CURRENT"))
+
+            old, self.path = self.path, path
+            self._set_docs(doc_ids, np.load(os.path.join(path, "docs.npy"), mmap_mode="r"))
+        if old and os.path.isdir(old):
+            shutil.rmtree(old, ignore_errors=True)
+
+    # ---------- 增量更新 ----------
+
+    def refresh(self, db: Session):
+        """
+        语料版本号变化时折叠进新增 / 修改的文档并剔除已删除的文档；
+        变化过多时另外启动后台全量重建，本次仍按增量处理，不阻塞查询
+        """
+        version = current_corpus_version(db)
+        if self.loaded and version == self.corpus_version:
+            return
+        with self._lock:
+            if self.loaded and version == self.corpus_version:
+                return
+            if not self.loaded and not self.load():
+                self.build(db)
+                return
+            if self.loaded and version == self.corpus_version:
+                return
+
+            watermark, changed, removed, seen = corpus_changes(db, self._rows, self.watermark, self._seen)
+            pending = len(self._delta_ids) + len(changed) + len(self._deleted) + len(removed)
+            if pending >= self.rebuild_min_changes and pending > self.rebuild_ratio * len(self.doc_ids):
+                bind = db.get_bind()
+                self.rebuild_in_background(lambda: Session(bind=bind))
+
+            for kb_id in removed | changed:
+                self._remove(kb_id)
+            for kb_id, title, text in load_texts(db, changed):
+                vector = self.embed(title, text)
+                if vector is None:
+                    continue
+                self._rows[kb_id] = len(self.doc_ids) + len(self._delta_ids)
+                self._delta_ids.append(kb_id)
+                self._delta_vectors.append(vector)
+            self.corpus_version = version
+            self.watermark = watermark
+            self._seen = seen
+
+    def _remove(self, kb_id: int):
+        row = self._rows.pop(kb_id, None)
+        if row is not None:
+            self._deleted.add(row)
+
+    # ---------- 检索 ----------
+
+    def search_vectors(self, queries: np.ndarray, limit: int = 10, exclude=()) -> list[list[tuple[int, float]]]:
+        """
+        批量余弦相似度 top-k：queries 为 m×d 单位向量，
+        分块读取文档矩阵，每块一次矩阵乘法，返回每个查询的 [(kb_id, score)]
+        """
+        queries = np.atleast_2d(queries).astype(np.float32)
+        exclude = set(exclude)
+        with self._lock:
+            n_base = len(self.doc_ids)
+            blocks = [(i, self.matrix[i:i + VECTOR_QUERY_BLOCK]) for i in range(0, n_base, VECTOR_QUERY_BLOCK)]
+            if self._delta_vectors:
+                blocks.append((n_base, np.vstack(self._delta_vectors)))
+            skip = set(self._deleted)
+            skip.update(row for kb_id, row in self._rows.items() if kb_id in exclude)
+
+            best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+            best_scores = np.zeros((len(queries), 0), dtype=np.float32)
+            for start, block in blocks:
+                scores = np.asarray(block, dtype=np.float32) @ queries.T  # rows × m
+                if skip:
+                    local = [r - start for r in skip if start <= r < start + len(scores)]
+                    scores[local] = -np.inf
+                take = min(limit, len(scores))
+                top = np.argpartition(-scores, take - 1, axis=0)[:take].T  # m × take
+                best_rows = np.hstack([best_rows, top + start])
+                best_scores = np.hstack([best_scores, np.take_along_axis(scores.T, top, axis=1)])
+
+            results = []
+            for rows, scores in zip(best_rows, best_scores):
+                order = np.argsort(-scores, kind="stable")[:limit]
+                hits = []
+                for row, score in zip(rows[order], scores[order]):
+                    if not np.isfinite(score) or score <= 0:
+                        continue
+                    kb_id = int(self.doc_ids[row]) if row < n_base else self._delta_ids[row - n_base]
+                    hits.append((kb_id, float(score)))
+                results.append(hits)
+            return results
+
+    def search(self, db: Session, text: str | None = None, seed_ids=(), limit: int = 10) -> list[tuple[int, float]]:
+        """
+        语义检索：查询文本与种子文档向量之和作为查询向量 (种子文档本身不出现在结果中)
+        """
+        self.refresh(db)
+        parts = []
+        if text:
+            vector = self.embed(text)
+            if vector is not None:
+                parts.append(vector)
+        parts.extend(self.doc_vectors(seed_ids))
+        if not parts:
+            return []
+        query = np.sum(parts, axis=0)
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return []
+        return self.search_vectors(query / norm, limit=limit, exclude=seed_ids)[0]
+
+    def warmup(self, db_factory):
+        db = db_factory()
+        try:
+            self.refresh(db)
+        except Exception as e:
+            print(f"⚠️ 向量索引预热失败: {e}")
+        finally:
+            db.close()
+
+
+vector_index = VectorIndex()